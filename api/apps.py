@@ -1,5 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
 
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from .reaper import start_reaper
+        from .warmup import start_warmup
+        # Background tasks start with the first request, so management commands never run them
+        request_started.connect(start_reaper, dispatch_uid='api.reaper.start_reaper')
+        if settings.EXC_LIST_WARMUP:
+            # The first request of a worker is usually the readiness probe, which answers 503 until warmed up
+            request_started.connect(start_warmup, dispatch_uid='api.warmup.start_warmup')
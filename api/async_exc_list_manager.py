@@ -0,0 +1,316 @@
+"""
+asyncio versions of the exc_list_* functions for the async views.
+
+Requests go out over a handful of ldap3 ASYNC connections that every coroutine
+shares; replies are matched up by message id, so one process can keep many
+directory operations in flight without a thread per request. Anything else
+that may block, backends without multiplexed connections and a lookup cache
+shared over the network, is called off the loop in a thread.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from ldap3 import MODIFY_INCREMENT
+from ldap3.core.exceptions import LDAPCommunicationError, LDAPResponseTimeoutError
+from ldap3.protocol.rfc4527 import post_read_control
+from ldap3.utils.conv import escape_filter_chars
+
+from .backends import get_backend, exc_list_base, exc_list_dn, exc_list_timestamp, exc_list_error, \
+    exc_list_check_result, POST_READ_OID, INCREMENT_UNSUPPORTED
+from .circuit_breaker import get_breaker
+from .exc_list_manager import ExcListError, get_write_buffer, exc_list_project, _exc_list_attributes, \
+    _exc_list_with_pending, _exc_list_add_delta, _exc_list_remember, _exc_list_hot_lookup, _exc_list_hot_add, \
+    _exc_list_flight, _exc_list_invalidate, _exc_list_snapshot_put
+from .hot_keys import get_throttle
+from .ldap_pool import PoolError
+from .lookup_cache import get_cache, MISSING
+from .metrics import ldap_duration
+from .ou_snapshot import get_snapshot
+from .single_flight import get_flights
+
+import asyncio
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Multiplexer(object):
+    """
+    A fixed set of ASYNC connections shared by all coroutines.
+    Connections come from the multiplexed pool and go back to it when they break.
+    """
+
+    def __init__(self, pool, size):
+        self.pool = pool
+        self.size = min(size, pool.size)
+        self._conns = []
+        self._opening = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    async def connection(self):
+        with self._lock:
+            if self._conns and len(self._conns) + self._opening >= self.size:
+                self._next = (self._next + 1) % len(self._conns)
+                return self._conns[self._next]
+            self._opening += 1
+        try:
+            # Bind off the event loop
+            conn = await asyncio.get_running_loop().run_in_executor(None, self.pool.acquire)
+        except PoolError:
+            if not self._conns:
+                raise
+            return self._conns[0]
+        finally:
+            with self._lock:
+                self._opening -= 1
+        with self._lock:
+            self._conns.append(conn)
+        return conn
+
+    def discard(self, conn):
+        with self._lock:
+            if conn in self._conns:
+                self._conns.remove(conn)
+                self.pool.discard(conn)
+
+    async def request(self, send, operation):
+        """
+        Send a request with send(conn) and wait for its reply without blocking the loop.
+        Returns the (response, result) pair from ldap3, the round trip is timed as operation.
+        """
+        conn = await self.connection()
+        try:
+            start = time.perf_counter()
+            message_id = send(conn)
+            deadline = time.monotonic() + (settings.LDAP_RECEIVE_TIMEOUT or settings.LDAP_TIME_LIMIT)
+            delay = 0.0005
+            while True:
+                try:
+                    reply = conn.get_response(message_id, timeout=0)
+                    ldap_duration.observe(time.perf_counter() - start, operation)
+                    return reply
+                except LDAPResponseTimeoutError:
+                    if time.monotonic() > deadline:
+                        raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.02)
+        except LDAPCommunicationError:
+            self.discard(conn)
+            raise
+
+
+async def _off_loop(fn, *args):
+    # Unlike run_in_executor this carries context variables into the thread
+    return await sync_to_async(fn, thread_sensitive=False)(*args)
+
+
+async def _cache_call(fn, *args):
+    # A process LRU answers at once, a shared cache is a round trip
+    if get_cache().blocking:
+        return await _off_loop(fn, *args)
+    return fn(*args)
+
+
+_multiplexer = None
+_multiplexer_pid = None
+_multiplexer_lock = threading.Lock()
+
+
+def get_multiplexer():
+    global _multiplexer, _multiplexer_pid
+    pid = os.getpid()
+    if _multiplexer is None or _multiplexer_pid != pid:
+        with _multiplexer_lock:
+            if _multiplexer is None or _multiplexer_pid != pid:
+                _multiplexer = Multiplexer(get_backend().multiplexed_pool, settings.LDAP_ASYNC_CONNECTIONS)
+                _multiplexer_pid = pid
+    return _multiplexer
+
+
+async def exc_list_find_umid(umid, fields=None):
+    # Serve from the local replica of ou=Admin unless it has gone stale
+    snapshot = get_snapshot()
+    if snapshot and snapshot.fresh():
+        attrs = snapshot.get(umid)
+    else:
+        attrs = await _exc_list_lookup(umid, ou='Admin', fields=fields)
+
+    if attrs is None:
+        raise ExcListError('not_found')
+
+    return exc_list_project(attrs, fields)
+
+
+async def exc_list_find_key(key, ou='IDProof', fields=None):
+    attrs = _exc_list_with_pending(await _exc_list_lookup(key, ou, fields), key, ou)
+
+    if attrs is None:
+        raise ExcListError('not_found')
+
+    return exc_list_project(attrs, fields)
+
+
+async def exc_list_add_key(key, ou='IDProof', fields=None):
+    return exc_list_project(await _exc_list_add_key(key, ou, fields), fields)
+
+
+async def _exc_list_add_key(key, ou, fields=None):
+    dn = exc_list_dn(key, ou)
+
+    # Buffer the increment and answer from the last known entry plus pending deltas
+    buffer = get_write_buffer() if settings.EXC_LIST_WRITE_BEHIND else None
+    if buffer and buffer.add(key, ou):
+        stored, delta, first_seen = buffer.known(key, ou)
+        if stored is MISSING:
+            stored = await _exc_list_lookup(key, ou)
+            buffer.remember(key, ou, stored, replace=False)
+            stored, delta, first_seen = buffer.known(key, ou)
+        if stored is None and delta == 1:
+            return {'dn': dn}
+        return _exc_list_add_delta(stored, key, delta, first_seen)
+
+    # Past its rate a hot key is counted in the write-behind buffer instead
+    throttle = get_throttle()
+    if throttle and not throttle.admit(ou, key):
+        return _exc_list_hot_add(throttle, key, ou)
+
+    with get_breaker().guard(blocking=False):
+        response = await _exc_list_increment(key, ou)
+    _exc_list_remember(key, ou, response)
+    _exc_list_snapshot_put(key, ou, response)
+    return response
+
+
+async def _exc_list_increment(key, ou):
+    dn = exc_list_dn(key, ou)
+    backend = get_backend()
+    if backend.multiplexed_pool is None or not backend.use_increment():
+        try:
+            # Compare-and-retry is a read-modify-write loop, run it off the loop
+            return await _off_loop(backend.increment, key, ou)
+        finally:
+            await _cache_call(_exc_list_invalidate, key, ou)
+
+    def increment(conn):
+        mod_attrs = {
+            'umichExcListBadAttempts': [(MODIFY_INCREMENT, [1])],
+        }
+        return conn.modify(dn, mod_attrs, controls=[post_read_control(['*'])])
+
+    def create(conn):
+        attrs = {
+            'umichExcListBadAttempts': 1,
+            'umichExcListTimestamp': exc_list_timestamp(),
+        }
+        return conn.add(dn, {'Top', 'umichExcListText'}, attrs)
+
+    try:
+        for attempt in range(settings.LDAP_INCREMENT_RETRIES):
+            response, result = await get_multiplexer().request(increment, 'modify')
+            if result['result'] == 0:
+                controls = result.get('controls') or {}
+                if POST_READ_OID in controls:
+                    return controls[POST_READ_OID]['value']['result']
+                # Server ignored the post-read control
+                return await _exc_list_search(key, ou)
+            if result['description'] in INCREMENT_UNSUPPORTED:
+                backend.increment_supported = False
+                return await _exc_list_increment(key, ou)
+            if result['description'] != 'noSuchObject':
+                raise exc_list_error(result['description'])
+
+            # No entry yet so create one
+            response, result = await get_multiplexer().request(create, 'add')
+            if result['result'] == 0:
+                logger.debug('Created new_dn={} result={}'.format(dn, result))
+                return {'dn': dn}
+            if result['description'] != 'entryAlreadyExists':
+                raise exc_list_error(result['description'])
+            logger.debug('Lost race on dn={} attempt={}'.format(dn, attempt))
+
+        raise ExcListError('increment_conflict')
+    finally:
+        await _cache_call(_exc_list_invalidate, key, ou)
+
+
+async def exc_list_delete_key(key, ou='IDProof'):
+    backend = get_backend()
+    delete_dn = exc_list_dn(key, ou)
+    logger.debug('delete_dn={}'.format(delete_dn))
+    if settings.EXC_LIST_WRITE_BEHIND or get_throttle():
+        get_write_buffer().discard(key, ou)
+
+    with get_breaker().guard(blocking=False):
+        if backend.multiplexed_pool is None:
+            message = await _off_loop(backend.delete, key, ou)
+        else:
+            response, result = await get_multiplexer().request(lambda conn: conn.delete(delete_dn), 'delete')
+            exc_list_check_result(result)
+            message = result['description']
+    await _cache_call(_exc_list_invalidate, key, ou)
+    if get_throttle():
+        get_throttle().remember(ou, key, None)
+    if ou == 'Admin' and get_snapshot():
+        get_snapshot().discard(key)
+    return {'message': message}
+
+
+async def _exc_list_lookup(umichExcListName, ou, fields=None):
+    """Read-through cache in front of _exc_list_search"""
+    cache = get_cache()
+    attrs = await _cache_call(cache.get, ou, umichExcListName)
+    if attrs is not MISSING:
+        return attrs
+
+    attributes = _exc_list_attributes(fields, ou)
+
+    async def load():
+        throttle = get_throttle()
+        if throttle and not throttle.admit(ou, umichExcListName):
+            return _exc_list_hot_lookup(throttle, umichExcListName, ou)
+
+        token = cache.token()
+        with get_breaker().guard(blocking=False):
+            attrs = await _exc_list_search(umichExcListName, ou, attributes)
+        await _cache_call(cache.set, ou, umichExcListName, attrs, token)
+        if attributes is None:
+            _exc_list_remember(umichExcListName, ou, attrs)
+        return attrs
+
+    # Concurrent misses for the same name on this loop share one search
+    flights = get_flights()
+    if flights:
+        return await flights.do_async(_exc_list_flight(umichExcListName, ou), load, tag=attributes)
+    return await load()
+
+
+async def _exc_list_search(umichExcListName, ou='IDProof', attributes=None):
+    """Returns the entry attributes, or None if there is no entry"""
+    if get_backend().multiplexed_pool is None:
+        return await _off_loop(get_backend().search, umichExcListName, ou, attributes)
+
+    base = exc_list_base(ou)
+    logger.debug('Searching for umichExcListName={},{}'.format(umichExcListName, base))
+
+    response, result = await get_multiplexer().request(lambda conn: conn.search(
+        base,
+        '(umichExcListName={})'.format(escape_filter_chars(umichExcListName)),
+        attributes=attributes or ['*'],
+        time_limit=settings.LDAP_TIME_LIMIT,
+    ), 'search')
+    exc_list_check_result(result)
+    entries = [entry for entry in response if entry['type'] == 'searchResEntry']
+
+    if len(entries) == 1:
+        return {
+            name: values if isinstance(values, list) else [values]
+            for name, values in entries[0]['attributes'].items()
+        }
+    elif len(entries) == 0:
+        return None
+    else:    # pragma: no cover
+        logger.debug('multiple results found')
+        raise ExcListError(message='multiple_results_found')
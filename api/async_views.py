@@ -0,0 +1,148 @@
+from django.http import JsonResponse
+from .serializers import ExcListUMIDSerializer, ExcListKeySerializer
+from .exc_list_manager import ExcListError, exc_list_compact
+from .circuit_breaker import ExcListUnavailable
+from .hot_keys import ExcListThrottled
+from .metrics import count_error
+from .log_pipeline import sampled
+from . import async_exc_list_manager as manager
+import json
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# Async counterparts of the views in views.py, same URLs and same 200/400/404/405 contract.
+# DRF cannot run async views, so these parse and render the request themselves.
+
+
+def _data(request):
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+    return request.POST
+
+
+def _method_not_allowed(request):
+    response = JsonResponse({"detail": 'Method "{}" not allowed.'.format(request.method)}, status=405)
+    response['Allow'] = 'POST'
+    return response
+
+
+def _async_api_view(view):
+    # The async views authenticate like the DRF views they replace, so skip CSRF
+    view.csrf_exempt = True
+    return view
+
+
+async def _handle(request, serializer_class, field, operation, not_found=True, shaped=True):
+    if request.method != 'POST':
+        return _method_not_allowed(request)
+
+    try:
+        data = _data(request)
+    except ValueError as e:
+        # Return a 400 on a body that is not JSON
+        return JsonResponse({"detail": 'JSON parse error - {}'.format(e)}, status=400)
+
+    try:
+        logger.info('<ASGIRequest: %s \'%s\' data=%s>', request.method, request.path, data,
+                    extra=sampled(request.path, data, field))
+        serializer = serializer_class(data=data)
+
+        if serializer.is_valid():
+            options = serializer.validated_data
+            if shaped:
+                result = await operation(options[field], fields=options.get('fields'))
+                if options['format'] == 'compact':
+                    result = exc_list_compact(result)
+            else:
+                result = await operation(options[field])
+            # Return 200 on success
+            response = JsonResponse(result)
+        else:
+            # Return a 400 on invalid input
+            response = JsonResponse(serializer.errors, status=400)
+
+    # Return a 429 for a hot key there is no local answer for
+    except ExcListThrottled as e:
+        count_error(e)
+        response = JsonResponse({
+            "message": e.message,
+            "status": 429,
+            },
+            status=429
+        )
+        response['Retry-After'] = str(e.retry_after)
+
+    # Return a 503 while the directory is failing or too busy to take the call
+    except ExcListUnavailable as e:
+        count_error(e)
+        response = JsonResponse({
+            "message": e.message,
+            "status": 503,
+            },
+            status=503
+        )
+        response['Retry-After'] = str(e.retry_after)
+
+    # Return a 404 on a failed match
+    except ExcListError as e:
+        count_error(e)
+        if not_found:
+            response = JsonResponse({
+                "message": e.message,
+                "status": 404,
+                },
+                status=404
+            )
+        else:    # pragma: no cover
+            response = JsonResponse({"message": e.message}, status=500)
+            logger.error(traceback.format_exc())
+
+    # Return a 500 on any unexpected exceptions
+    except Exception as e:    # pragma: no cover
+        count_error(e)
+        response = JsonResponse({"message": str(e)}, status=500)
+        logger.error(traceback.format_exc())
+
+    logger.info('Return status_code=%s response=%s', response.status_code, response.content,
+                extra=sampled(request.path, data, field) if response.status_code < 300 else None)
+    return response
+
+
+@_async_api_view
+async def find_umid(request):
+    """
+    API endpoint that searches the exclusion list for the provided umid
+    Returns the entry as a json string if a match is found
+    """
+    return await _handle(request, ExcListUMIDSerializer, 'umid', manager.exc_list_find_umid)
+
+
+@_async_api_view
+async def find_key(request):
+    """
+    API endpoint that searches the exclusion list for the provided key
+    Returns the entry as a json string if a match is found
+    """
+    return await _handle(request, ExcListKeySerializer, 'key', manager.exc_list_find_key)
+
+
+@_async_api_view
+async def add_key(request):
+    """
+    API endpoint that increments bad attempts for the provided key
+    Will create the exc list entry if it does not exist
+    Returns 200 on a successful add
+    """
+    return await _handle(request, ExcListKeySerializer, 'key', manager.exc_list_add_key, not_found=False)
+
+
+@_async_api_view
+async def delete_key(request):
+    """
+    API endpoint that deletes the exc list entry for the provided key
+    Returns 200 on a successful delete
+    """
+    return await _handle(request, ExcListKeySerializer, 'key', manager.exc_list_delete_key, not_found=False,
+                         shaped=False)
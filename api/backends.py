@@ -0,0 +1,754 @@
+"""
+Storage backends behind the exc_list_* functions.
+
+EXC_LIST_BACKEND picks one by dotted path:
+
+    api.backends.LDAPBackend        the directory at LDAP_URI (default)
+    api.backends.MockLDAPBackend    an ldap3 mock directory seeded from EXC_LIST_BACKEND_LDIF
+    api.backends.MemoryBackend      a dict seeded from EXC_LIST_BACKEND_LDIF
+
+Caching, the Admin snapshot and write-behind all sit above the backend, so
+every backend gets them. The mock and in-memory backends live in the process
+that created them, each forked worker starts from its own copy of the fixture.
+"""
+from django.conf import settings
+from django.utils.module_loading import import_string
+from ldap3 import Server, Connection, BASE, SUBTREE, MODIFY_ADD, MODIFY_DELETE, MODIFY_INCREMENT, MOCK_SYNC, MOCK_ASYNC
+from ldap3.protocol.rfc4527 import post_read_control
+from ldap3.utils.conv import escape_filter_chars
+from ldap3.utils.dn import parse_dn
+from ldap3.core.exceptions import LDAPCommunicationError
+from .ldap_pool import ConnectionPool, get_pool, get_read_pool, get_async_pool, get_multiplexed_pool, PoolError, HEALTH_CHECK_DN
+from .metrics import ldap_duration
+
+from collections import OrderedDict, deque
+import base64
+import copy
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+POST_READ_OID = '1.3.6.1.1.13.2'
+PAGED_RESULTS_OID = '1.2.840.113556.1.4.319'
+
+# Modify results that mean the server does not implement RFC 4525
+INCREMENT_UNSUPPORTED = ('protocolError', 'unwillingToPerform', 'unavailableCriticalExtension')
+
+# Results that say the directory is in trouble rather than refusing this request
+DIRECTORY_DISTRESS = ('busy', 'unavailable', 'unwillingToPerform', 'timeLimitExceeded')
+
+# Returned by the increment helpers when a concurrent writer got there first
+_CONFLICT = object()
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class ExcListError(Error):
+    """
+    Exception raised on exclusion list error.
+    Attributes:
+        message: explanation of the error
+    """
+
+    def __init__(self, message):
+        self.message = message
+
+
+class ExcListDirectoryError(ExcListError):
+    """Raised for a DIRECTORY_DISTRESS result, the circuit breaker counts it as a failure"""
+    pass
+
+
+def exc_list_error(description):
+    """The exception for an LDAP result description other than success"""
+    if description in DIRECTORY_DISTRESS:
+        return ExcListDirectoryError(description)
+    return ExcListError(description)
+
+
+def exc_list_check_result(result):
+    """Raise for a result the directory was in no state to give, a search that found nothing is no entry"""
+    if result['description'] in DIRECTORY_DISTRESS:
+        raise ExcListDirectoryError(result['description'])
+
+
+# Parent of every exclusion list OU
+EXC_LIST_ROOT = 'ou=ExclusionList,dc=umich,dc=edu'
+
+
+def exc_list_base(ou):
+    return 'ou={},{}'.format(ou, EXC_LIST_ROOT)
+
+
+def exc_list_dn(key, ou):
+    return 'umichExcListName={},{}'.format(key, exc_list_base(ou))
+
+
+def exc_list_timestamp(when=None):
+    return time.strftime('%Y%m%d%H%M%SZ', when or time.gmtime())
+
+
+def read_ldif(path):
+    """
+    Returns [(dn, {attribute: [values]})] for the entries in an LDIF content file.
+    Handles comments, folded lines and base64 values, which is all the fixtures use.
+    """
+    entries = []
+    lines = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.startswith(' ') and lines:
+                lines[-1] += line[1:]
+            elif not line.startswith('#'):
+                lines.append(line)
+
+    dn, attrs = None, {}
+    for line in lines + ['']:
+        if not line.strip():
+            if dn:
+                entries.append((dn, attrs))
+            dn, attrs = None, {}
+            continue
+        name, sep, value = line.partition(':')
+        if value.startswith(':'):
+            value = base64.b64decode(value[1:].strip()).decode('utf-8')
+        else:
+            value = value.strip()
+        if name.lower() == 'dn':
+            dn = value
+        elif name.lower() != 'version':
+            attrs.setdefault(name, []).append(value)
+    return entries
+
+
+class ExcListBackend(object):
+    """
+    Interface the exc_list_* functions use to reach the store.
+
+    Attributes are returned as {name: [values]} and names are matched case
+    insensitively, the way the directory matches umichExcListName. pool is the
+    sync ldap3 pool for backends that have one, the Admin snapshot and the
+    async views only use the directory when it is set. read_pool is the pool
+    searches go to, the same as pool unless reads are routed to replicas.
+    """
+
+    pool = None
+    async_pool = None
+    multiplexed_pool = None
+
+    @property
+    def read_pool(self):
+        return self.pool
+
+    @classmethod
+    def from_settings(cls):
+        return cls()
+
+    def search(self, name, ou, attributes=None):
+        """
+        Returns the entry attributes, or None if there is no entry.
+        attributes is a hint, a backend may return more than asked for.
+        """
+        raise NotImplementedError
+
+    def search_many(self, names, ou, attributes=None):
+        """Returns {lowercased umichExcListName: attributes} for the names that exist"""
+        raise NotImplementedError
+
+    def search_ous(self, names, attributes=None):
+        """
+        Look up (ou, name) pairs across OUs at once.
+        Returns {(ou, lowercased umichExcListName): attributes} for the pairs that exist.
+        """
+        by_ou = {}
+        for ou, name in names:
+            by_ou.setdefault(ou, []).append(name)
+        return {
+            (ou, name): attrs
+            for ou, ou_names in by_ou.items()
+            for name, attrs in self.search_many(ou_names, ou, attributes).items()
+        }
+
+    def increment(self, key, ou, delta=1):
+        """
+        Add delta to umichExcListBadAttempts, creating the entry if there is none.
+        Returns the updated attributes, or {'dn': dn} for a new entry.
+        """
+        raise NotImplementedError
+
+    def increment_many(self, keys, ou):
+        """Returns {key: result} with what increment would have returned or a message on failure"""
+        return {key: self.increment(key, ou) for key in keys}
+
+    def delete(self, key, ou):
+        """Returns the LDAP result description, 'success' or 'noSuchObject'"""
+        raise NotImplementedError
+
+    def delete_many(self, keys, ou):
+        return {key: {'message': self.delete(key, ou)} for key in keys}
+
+    def export(self, ou, page_size=500, cookie=None):
+        """
+        Yields every entry in the OU a page at a time, as ([(dn, attributes)], cookie) pairs.
+        cookie is None on the last page, otherwise passing it back in resumes after that page.
+        """
+        raise NotImplementedError
+
+    def expired(self, ou, before, page_size=500):
+        """
+        Yields lists of the umichExcListName of entries whose umichExcListTimestamp is at
+        or before the struct_time before, a page at a time
+        """
+        raise NotImplementedError
+
+    def ping(self):
+        """Raises if the store cannot be reached"""
+        pass
+
+
+class LDAPBackend(ExcListBackend):
+    """
+    The directory at LDAP_URI, reached through the shared connection pools.
+    Searches go to the replicas in LDAP_READ_URIS when there are any, writes always go to LDAP_URI.
+    """
+
+    def __init__(self, pool=None, async_pool=None, multiplexed_pool=None):
+        self._pool = pool
+        self._async_pool = async_pool
+        self._multiplexed_pool = multiplexed_pool
+        # Flipped off the first time the server rejects Modify-Increment
+        self.increment_supported = True
+
+    @property
+    def pool(self):
+        return self._pool or get_pool()
+
+    @property
+    def read_pool(self):
+        # An injected pool takes the reads as well
+        return self._pool or get_read_pool()
+
+    @property
+    def async_pool(self):
+        return self._async_pool or get_async_pool()
+
+    @property
+    def multiplexed_pool(self):
+        return self._multiplexed_pool or get_multiplexed_pool()
+
+    def use_increment(self):
+        return settings.LDAP_INCREMENT_MODE == 'auto' and self.increment_supported
+
+    def search(self, name, ou, attributes=None):
+        entry = self.read_pool.run(lambda conn: self._search(conn, name, ou, attributes))
+        if not entry:
+            return None
+        logger.debug('Found dn={}'.format(entry.entry_dn))
+        return entry.entry_attributes_as_dict
+
+    def search_many(self, names, ou, attributes=None):
+        return self.read_pool.run(lambda conn: self._search_many(conn, names, ou, attributes))
+
+    def search_ous(self, names, attributes=None):
+        # One subtree search under ou=ExclusionList per chunk instead of one search per OU
+        return self.read_pool.run(lambda conn: self._search_ous(conn, names, attributes))
+
+    def increment(self, key, ou, delta=1):
+        # Increment (or create) on a single pooled connection
+        return self.pool.run(lambda conn: self._add_key(conn, key, ou, delta), retry=False)
+
+    def increment_many(self, keys, ou):
+        if self.use_increment():
+            return self._pipelined(keys, self._increment_pipelined, ou)
+        # Compare-and-retry needs the current value, so run it key by key on one connection
+        return self.pool.run(lambda conn: {key: self._add_key(conn, key, ou) for key in keys}, retry=False)
+
+    def delete(self, key, ou):
+        delete_dn = exc_list_dn(key, ou)
+        logger.debug('delete_dn={}'.format(delete_dn))
+
+        def delete(conn):
+            with ldap_duration.time('delete'):
+                conn.delete(delete_dn)
+            exc_list_check_result(conn.result)
+            return conn.result['description']
+
+        return self.pool.run(delete, retry=False)
+
+    def delete_many(self, keys, ou):
+        def delete(conn, key):
+            return conn.delete(exc_list_dn(key, ou))
+
+        def delete_all(conns, keys, ou):
+            return {
+                key: {'message': result['description']}
+                for key, result in self._pipeline(conns, keys, delete, 'delete').items()
+            }
+
+        return self._pipelined(keys, delete_all, ou)
+
+    def ping(self):
+        def probe(conn):
+            with ldap_duration.time('search'):
+                conn.search(HEALTH_CHECK_DN, '(objectClass=*)', search_scope=BASE, attributes=['1.1'])
+            if conn.result['description'] != 'success':
+                raise exc_list_error(conn.result['description'])
+
+        self.pool.run(probe)
+
+    def export(self, ou, page_size=500, cookie=None):
+        pages = self._paged(ou, '(umichExcListName=*)', ['*'], page_size, cookie)
+        for entries, cookie in pages:
+            yield [(entry.entry_dn, entry.entry_attributes_as_dict) for entry in entries], cookie
+
+    def expired(self, ou, before, page_size=500):
+        search_filter = '(&(umichExcListName=*)(umichExcListTimestamp<={}))'.format(exc_list_timestamp(before))
+        for entries, cookie in self._paged(ou, search_filter, ['umichExcListName'], page_size):
+            yield [str(entry.entry_attributes_as_dict['umichExcListName'][0]) for entry in entries]
+
+    def _paged(self, ou, search_filter, attributes, page_size, cookie=None):
+        """Yields (entries, cookie) for each page of a simple paged results search"""
+        # Paged results cookies belong to the connection that issued them, so one
+        # connection is held for the whole search and only goes back to the pool at the end
+        base = exc_list_base(ou)
+        pool = self.read_pool
+        conn = pool.acquire()
+        try:
+            while True:
+                with ldap_duration.time('search'):
+                    conn.search(
+                        base,
+                        search_filter,
+                        attributes=attributes,
+                        paged_size=page_size,
+                        paged_cookie=cookie,
+                        time_limit=settings.LDAP_TIME_LIMIT,
+                    )
+                if conn.result['description'] != 'success':
+                    raise exc_list_error(conn.result['description'])
+                controls = conn.result.get('controls') or {}
+                cookie = controls.get(PAGED_RESULTS_OID, {}).get('value', {}).get('cookie') or None
+                yield conn.entries, cookie
+                if cookie is None:
+                    break
+        except LDAPCommunicationError:
+            pool.discard(conn)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                pool.release(conn)
+
+    def _search(self, conn, name, ou, attributes=None):
+        entry = ''
+        base = exc_list_base(ou)
+        logger.debug('Searching for umichExcListName={},{}'.format(name, base))
+
+        with ldap_duration.time('search'):
+            conn.search(
+                base,
+                '(umichExcListName={})'.format(escape_filter_chars(name)),
+                attributes=attributes or ['*'],
+                time_limit=settings.LDAP_TIME_LIMIT,
+            )
+        exc_list_check_result(conn.result)
+
+        if len(conn.entries) == 1:
+            entry = conn.entries[0]
+        elif len(conn.entries) == 0:
+            pass
+        else:    # pragma: no cover
+            logger.debug('multiple results found')
+            raise ExcListError(message='multiple_results_found')
+
+        return entry
+
+    def _search_many(self, conn, names, ou, attributes=None):
+        entries = {}
+        base = exc_list_base(ou)
+        chunk_size = settings.EXC_LIST_BATCH_CHUNK_SIZE
+
+        for i in range(0, len(names), chunk_size):
+            chunk = names[i:i + chunk_size]
+            logger.debug('Searching for {} names under {}'.format(len(chunk), base))
+            with ldap_duration.time('search'):
+                conn.search(
+                    base,
+                    '(|{})'.format(''.join('(umichExcListName={})'.format(escape_filter_chars(name)) for name in chunk)),
+                    attributes=attributes or ['*'],
+                    time_limit=settings.LDAP_TIME_LIMIT,
+                )
+            exc_list_check_result(conn.result)
+            for entry in conn.entries:
+                attrs = entry.entry_attributes_as_dict
+                entries[str(attrs['umichExcListName'][0]).lower()] = attrs
+
+        return entries
+
+    def _search_ous(self, conn, names, attributes=None):
+        wanted = {(ou, name.lower()) for ou, name in names}
+        ous = {ou.lower(): ou for ou, name in names}
+        unique = list(OrderedDict((name.lower(), name) for ou, name in names).values())
+        entries = {}
+        chunk_size = settings.EXC_LIST_BATCH_CHUNK_SIZE
+
+        for i in range(0, len(unique), chunk_size):
+            chunk = unique[i:i + chunk_size]
+            logger.debug('Searching for {} names under {}'.format(len(chunk), EXC_LIST_ROOT))
+            with ldap_duration.time('search'):
+                conn.search(
+                    EXC_LIST_ROOT,
+                    '(|{})'.format(''.join('(umichExcListName={})'.format(escape_filter_chars(name)) for name in chunk)),
+                    search_scope=SUBTREE,
+                    attributes=attributes or ['*'],
+                    time_limit=settings.LDAP_TIME_LIMIT,
+                )
+            exc_list_check_result(conn.result)
+            for entry in conn.entries:
+                # The OU is the second RDN, umichExcListName=<name>,ou=<OU>,ou=ExclusionList,...
+                ou = ous.get(parse_dn(entry.entry_dn)[1][1].lower())
+                attrs = entry.entry_attributes_as_dict
+                key = (ou, str(attrs['umichExcListName'][0]).lower())
+                # A name asked of one OU may also be in the other
+                if key in wanted:
+                    entries[key] = attrs
+
+        return entries
+
+    def _add_key(self, conn, key, ou, delta=1):
+        dn = exc_list_dn(key, ou)
+
+        # Retry when a concurrent writer beats us to the entry
+        for attempt in range(settings.LDAP_INCREMENT_RETRIES):
+            response = self._increment(conn, key, ou, dn, delta)
+            # No entry yet so create one
+            if response is None:
+                response = self._create(conn, dn, delta)
+            if response is not _CONFLICT:
+                return response
+            logger.debug('Lost race on dn={} attempt={}'.format(dn, attempt))
+
+        raise ExcListError('increment_conflict')
+
+    def _increment(self, conn, key, ou, dn, delta=1):
+        """
+        Add delta to umichExcListBadAttempts and return the updated attributes.
+        Returns None if the entry does not exist and _CONFLICT if a concurrent update won.
+        """
+        if self.use_increment():
+            # RFC 4525 Modify-Increment, the post-read control returns the new entry
+            mod_attrs = {
+                'umichExcListBadAttempts': [(MODIFY_INCREMENT, [delta])],
+            }
+            with ldap_duration.time('modify'):
+                modified = conn.modify(dn, mod_attrs, controls=[post_read_control(['*'])])
+            if modified:
+                controls = conn.result.get('controls') or {}
+                if POST_READ_OID in controls:
+                    return controls[POST_READ_OID]['value']['result']
+                # Server ignored the post-read control
+                entry = self._search(conn, key, ou)
+                return entry.entry_attributes_as_dict if entry else None
+
+            description = conn.result['description']
+            if description == 'noSuchObject':
+                return None
+            if description not in INCREMENT_UNSUPPORTED:
+                raise exc_list_error(description)
+            logger.info('Modify-Increment unsupported ({}), using compare-and-retry'.format(description))
+            self.increment_supported = False
+
+        return self._compare_increment(conn, key, ou, delta)
+
+    def _compare_increment(self, conn, key, ou, delta=1):
+        # Optimistic update, deleting the old value fails if someone else changed it first
+        entry = self._search(conn, key, ou)
+        if not entry:
+            return None
+
+        logger.debug('Found dn={}'.format(entry.entry_dn))
+        response = entry.entry_attributes_as_dict
+        current = response['umichExcListBadAttempts'][0]
+        bad_attempts = int(current) + delta
+        mod_attrs = {
+            'umichExcListBadAttempts': [(MODIFY_DELETE, [current]), (MODIFY_ADD, [bad_attempts])],
+        }
+        with ldap_duration.time('modify'):
+            modified = conn.modify(entry.entry_dn, mod_attrs)
+        if modified:
+            response['umichExcListBadAttempts'] = [str(bad_attempts)]
+            return response
+
+        description = conn.result['description']
+        if description in ('noSuchAttribute', 'noSuchObject'):
+            return _CONFLICT
+        raise exc_list_error(description)
+
+    def _create(self, conn, dn, bad_attempts=1):
+        objectClasses = {'Top', 'umichExcListText'}
+        attrs = {
+            'umichExcListBadAttempts': bad_attempts,
+            'umichExcListTimestamp': exc_list_timestamp(),
+        }
+        with ldap_duration.time('add'):
+            added = conn.add(dn, objectClasses, attrs)
+        if added:
+            logger.debug('Created new_dn={} conn.result={}'.format(dn, conn.result))
+            return {'dn': dn}
+        if conn.result['description'] == 'entryAlreadyExists':
+            return _CONFLICT
+        raise exc_list_error(conn.result['description'])    # pragma: no cover
+
+    def _increment_pipelined(self, conns, keys, ou):
+        def increment(conn, key):
+            mod_attrs = {
+                'umichExcListBadAttempts': [(MODIFY_INCREMENT, [1])],
+            }
+            return conn.modify(exc_list_dn(key, ou), mod_attrs, controls=[post_read_control(['*'])])
+
+        def create(conn, key):
+            attrs = {
+                'umichExcListBadAttempts': 1,
+                'umichExcListTimestamp': exc_list_timestamp(),
+            }
+            return conn.add(exc_list_dn(key, ou), {'Top', 'umichExcListText'}, attrs)
+
+        results = {}
+        unread = []
+        pending = keys
+        # Increment, create what was missing, then increment whatever lost a create race
+        for attempt, (send, operation) in enumerate(((increment, 'modify'), (create, 'add'), (increment, 'modify'))):
+            retry = []
+            for key, result in self._pipeline(conns, pending, send, operation).items():
+                description = result['description']
+                if result['result'] == 0 and send is create:
+                    results[key] = {'dn': exc_list_dn(key, ou)}
+                elif result['result'] == 0:
+                    controls = result.get('controls') or {}
+                    if POST_READ_OID in controls:
+                        results[key] = controls[POST_READ_OID]['value']['result']
+                    else:
+                        unread.append(key)
+                elif description in ('noSuchObject', 'entryAlreadyExists') and attempt < 2:
+                    retry.append(key)
+                elif description in INCREMENT_UNSUPPORTED and send is increment:
+                    self.increment_supported = False
+                    raise ExcListError('increment_unsupported')
+                else:
+                    results[key] = {'message': description}
+            pending = retry
+
+        if unread:
+            # Server ignored the post-read control, read the entries back in one go
+            found = self.pool.run(lambda conn: self._search_many(conn, unread, ou))
+            for key in unread:
+                results[key] = found.get(key.lower(), {'message': 'success'})
+
+        return results
+
+    def _pipelined(self, keys, operation, ou):
+        """
+        Call operation(conns, keys, ou) with as many async connections as the batch can use.
+        Falls back to the sequential helpers if the server turns out not to support Modify-Increment.
+        """
+        pool = self.async_pool
+        wanted = min(pool.size, max(1, -(-len(keys) // settings.LDAP_PIPELINE_WINDOW)))
+        conns = [pool.acquire()]
+        try:
+            # Only take extra connections that are free right now
+            while len(conns) < wanted:
+                conns.append(pool.acquire(timeout=0))
+        except PoolError:
+            pass
+
+        try:
+            return operation(conns, keys, ou)
+        except ExcListError as e:
+            if e.message != 'increment_unsupported':
+                raise
+            logger.info('Modify-Increment unsupported, adding keys one at a time')
+            return self.pool.run(lambda conn: {key: self._add_key(conn, key, ou) for key in keys}, retry=False)
+        except LDAPCommunicationError:
+            for conn in conns:
+                pool.discard(conn)
+            conns = []
+            raise
+        finally:
+            for conn in conns:
+                pool.release(conn)
+
+    def _pipeline(self, conns, items, send, operation):
+        """
+        Call send(conn, item) for every item, spreading items over conns and keeping up to
+        LDAP_PIPELINE_WINDOW requests in flight per connection.
+        Returns {item: ldap result}, each round trip is timed as operation.
+        """
+        results = {}
+        in_flight = [deque() for conn in conns]
+
+        def collect(slot):
+            item, message_id, start = in_flight[slot].popleft()
+            response, result = conns[slot].get_response(message_id)
+            ldap_duration.observe(time.perf_counter() - start, operation)
+            results[item] = result
+
+        for i, item in enumerate(items):
+            slot = i % len(conns)
+            if len(in_flight[slot]) >= settings.LDAP_PIPELINE_WINDOW:
+                collect(slot)
+            in_flight[slot].append((item, send(conns[slot], item), time.perf_counter()))
+
+        for slot in range(len(conns)):
+            while in_flight[slot]:
+                collect(slot)
+
+        return results
+
+
+class MockLDAPBackend(LDAPBackend):
+    """
+    LDAPBackend over an ldap3 mock directory seeded from an LDIF file.
+    Runs the real LDAP code paths, pipelining and the async views included, without a server.
+    """
+
+    @classmethod
+    def from_settings(cls):
+        return cls(settings.EXC_LIST_BACKEND_LDIF)
+
+    def __init__(self, ldif=None):
+        server = Server('mock')
+        seeder = Connection(server, settings.LDAP_USERNAME, settings.LDAP_PW, client_strategy=MOCK_SYNC)
+        # Any credentials the settings hold are good against the mock
+        seeder.strategy.add_entry(settings.LDAP_USERNAME, {'userPassword': settings.LDAP_PW, 'objectClass': 'person'})
+        entries = read_ldif(ldif) if ldif else []
+        for dn, attrs in entries:
+            seeder.strategy.add_entry(dn, attrs)
+        logger.info('Seeded mock directory with {} entries from {}'.format(len(entries), ldif))
+
+        def pool(strategy, size):
+            # Mock strategies only decode attribute values when names are checked
+            return ConnectionPool(
+                settings.LDAP_URI,
+                settings.LDAP_USERNAME,
+                settings.LDAP_PW,
+                size=size,
+                acquire_timeout=settings.LDAP_POOL_ACQUIRE_TIMEOUT,
+                server=server,
+                client_strategy=strategy,
+                check_names=True,
+            )
+
+        super().__init__(
+            pool=pool(MOCK_SYNC, settings.LDAP_POOL_SIZE),
+            async_pool=pool(MOCK_ASYNC, settings.LDAP_PIPELINE_CONNECTIONS),
+            multiplexed_pool=pool(MOCK_ASYNC, settings.LDAP_ASYNC_CONNECTIONS),
+        )
+
+
+class MemoryBackend(ExcListBackend):
+    """
+    Entries kept in a dict, optionally seeded from an LDIF file.
+    Only entries with a umichExcListName directly under an exclusion list OU are loaded.
+    """
+
+    @classmethod
+    def from_settings(cls):
+        return cls(settings.EXC_LIST_BACKEND_LDIF)
+
+    def __init__(self, ldif=None):
+        self._entries = {}    # (ou, lowercased umichExcListName) -> attributes
+        self._lock = threading.Lock()
+        for dn, attrs in read_ldif(ldif) if ldif else []:
+            rdns = [rdn.split('=', 1) for rdn in dn.split(',')]
+            if len(rdns) > 1 and attrs.get('umichExcListName') and rdns[1][0].lower() == 'ou':
+                self._entries[(rdns[1][1], attrs['umichExcListName'][0].lower())] = attrs
+        logger.info('Loaded {} entries from {}'.format(len(self._entries), ldif))
+
+    def search(self, name, ou, attributes=None):
+        with self._lock:
+            return copy.deepcopy(self._entries.get((ou, name.lower())))
+
+    def search_many(self, names, ou, attributes=None):
+        with self._lock:
+            return {
+                name.lower(): copy.deepcopy(self._entries[(ou, name.lower())])
+                for name in names if (ou, name.lower()) in self._entries
+            }
+
+    def increment(self, key, ou, delta=1):
+        with self._lock:
+            attrs = self._entries.get((ou, key.lower()))
+            if attrs is None:
+                self._entries[(ou, key.lower())] = {
+                    'objectClass': ['top', 'umichExcListText'],
+                    'umichExcListName': [key],
+                    'umichExcListBadAttempts': [str(delta)],
+                    'umichExcListTimestamp': [exc_list_timestamp()],
+                }
+                return {'dn': exc_list_dn(key, ou)}
+            bad_attempts = int(attrs.get('umichExcListBadAttempts', ['0'])[0]) + delta
+            attrs['umichExcListBadAttempts'] = [str(bad_attempts)]
+            return copy.deepcopy(attrs)
+
+    def delete(self, key, ou):
+        with self._lock:
+            if self._entries.pop((ou, key.lower()), None) is None:
+                return 'noSuchObject'
+        return 'success'
+
+    def export(self, ou, page_size=500, cookie=None):
+        # The cookie is the last name handed out, pages follow name order
+        after = cookie.decode('utf-8') if cookie else None
+        while True:
+            with self._lock:
+                names = sorted(name for entry_ou, name in self._entries
+                               if entry_ou == ou and (after is None or name > after))
+                page = [(exc_list_dn(self._entries[(ou, name)]['umichExcListName'][0], ou),
+                         copy.deepcopy(self._entries[(ou, name)])) for name in names[:page_size]]
+            after = names[page_size - 1] if len(names) > page_size else None
+            yield page, after.encode('utf-8') if after else None
+            if after is None:
+                break
+
+    def expired(self, ou, before, page_size=500):
+        stamp = exc_list_timestamp(before)
+        with self._lock:
+            names = [attrs['umichExcListName'][0] for (entry_ou, name), attrs in self._entries.items()
+                     if entry_ou == ou and attrs.get('umichExcListTimestamp')
+                     and attrs['umichExcListTimestamp'][0] <= stamp]
+        for i in range(0, len(names), page_size):
+            yield names[i:i + page_size]
+
+
+_backend = None
+_backend_pid = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the backend named by EXC_LIST_BACKEND for this process, creating it on first use"""
+    global _backend, _backend_pid
+    pid = os.getpid()
+    if _backend is None or _backend_pid != pid:
+        with _backend_lock:
+            if _backend is None or _backend_pid != pid:
+                _backend = import_string(settings.EXC_LIST_BACKEND).from_settings()
+                _backend_pid = pid
+    return _backend
+
+
+def set_backend(backend):
+    """Use backend in this process from now on, returns the one it replaces"""
+    global _backend, _backend_pid
+    with _backend_lock:
+        previous = _backend if _backend_pid == os.getpid() else None
+        _backend = backend
+        _backend_pid = os.getpid()
+    return previous
@@ -0,0 +1,301 @@
+"""
+HTTP load benchmark for the single-key endpoints.
+
+Requests are built as WSGI environs and pushed through the Django WSGI
+application in-process by a pool of threads, so the numbers cover URL routing,
+DRF parsing and serialisation, the lookup cache, the snapshot and the backend,
+but not a web server or the network. The backend is an offline stand-in
+wrapped in LatencyBackend, which adds a fixed delay to every backend call to
+play the part of the directory round trip and counts the calls.
+"""
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from .backends import ExcListBackend, set_backend
+from .exc_list_manager import get_write_buffer
+from .hot_keys import get_throttle
+from .lookup_cache import get_cache
+
+from collections import Counter
+from urllib.parse import urlencode
+import contextvars
+import io
+import random
+import sys
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Endpoint name -> the form field it takes
+ENDPOINTS = {
+    'add_key': 'key',
+    'find_key': 'key',
+    'delete_key': 'key',
+    'find_umid': 'umid',
+}
+
+DEFAULT_MIX = {
+    'add_key': 2,
+    'find_key': 5,
+    'delete_key': 1,
+    'find_umid': 2,
+}
+
+# Entry in the fixture every find_umid hit goes to
+FIXTURE_UMID = '00133700'
+
+
+class LatencyBackend(ExcListBackend):
+    """
+    Wraps a backend, sleeping latency seconds before every call and counting calls.
+    Calls are also counted per request, in a context variable so the count follows
+    async views onto the event loop thread.
+    """
+
+    def __init__(self, backend, latency=0.0):
+        self.backend = backend
+        self.latency = latency
+        self.calls = Counter()
+        self._request_calls = contextvars.ContextVar('request_calls', default=None)
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        return self.backend.pool
+
+    @property
+    def read_pool(self):
+        # The snapshot loads through the wrapped backend's pool, outside the injected latency
+        return self.backend.read_pool
+
+    def count_request(self):
+        """Start counting calls for the current request, returns the [count] it goes into"""
+        counter = [0]
+        self._request_calls.set(counter)
+        return counter
+
+    def _call(self, name, *args):
+        counter = self._request_calls.get()
+        if counter is not None:
+            counter[0] += 1
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return getattr(self.backend, name)(*args)
+
+    def search(self, name, ou, attributes=None):
+        return self._call('search', name, ou, attributes)
+
+    def search_many(self, names, ou, attributes=None):
+        return self._call('search_many', names, ou, attributes)
+
+    def search_ous(self, names, attributes=None):
+        return self._call('search_ous', names, attributes)
+
+    def increment(self, key, ou, delta=1):
+        return self._call('increment', key, ou, delta)
+
+    def increment_many(self, keys, ou):
+        return self._call('increment_many', keys, ou)
+
+    def delete(self, key, ou):
+        return self._call('delete', key, ou)
+
+    def delete_many(self, keys, ou):
+        return self._call('delete_many', keys, ou)
+
+    def export(self, ou, page_size=500, cookie=None):
+        return self._call('export', ou, page_size, cookie)
+
+    def expired(self, ou, before, page_size=500):
+        return self._call('expired', ou, before, page_size)
+
+
+def parse_mix(mix):
+    """Parse 'add_key=2,find_key=5' into {'add_key': 2, 'find_key': 5}"""
+    weights = {}
+    for item in mix.split(','):
+        name, sep, weight = item.strip().partition('=')
+        if name not in ENDPOINTS:
+            raise ValueError('Unknown endpoint {}, expected one of {}'.format(name, ', '.join(ENDPOINTS)))
+        weights[name] = float(weight) if sep else 1.0
+        if weights[name] < 0:
+            raise ValueError('Weight for {} must not be negative'.format(name))
+    if not any(weights.values()):
+        raise ValueError('Mix must give at least one endpoint a positive weight')
+    return weights
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[int(rank) - 1]
+
+
+def _host():
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def _environ(path, field, value, host):
+    body = urlencode({field: value}).encode('utf-8')
+    return {
+        'REQUEST_METHOD': 'POST',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+        'CONTENT_LENGTH': str(len(body)),
+        'HTTP_HOST': host,
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+
+def _summary(latencies, statuses, calls, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': sum(n for status, n in statuses.items() if status >= 500),
+        'statuses': {str(status): n for status, n in sorted(statuses.items())},
+        'rps': count / elapsed if elapsed else None,
+        'mean_ms': 1000 * sum(latencies) / count if count else None,
+        'p50_ms': 1000 * percentile(latencies, 50) if count else None,
+        'p95_ms': 1000 * percentile(latencies, 95) if count else None,
+        'p99_ms': 1000 * percentile(latencies, 99) if count else None,
+        'max_ms': 1000 * latencies[-1] if count else None,
+        'backend_ops_per_request': calls / count if count else None,
+    }
+
+
+def run_benchmark(requests=1000, concurrency=8, mix=None, keys=100, latency=0.0,
+                  backend='api.backends.MockLDAPBackend', warmup=0, seed=0):
+    """
+    Send requests requests, drawn from the mix by weight, from concurrency threads.
+    Keys are picked from a set of keys names so adds and finds hit the same entries.
+    Returns the results as a dict ready to be written out as JSON.
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    names = [name for name in mix if mix[name] > 0]
+    plan = []
+    for name in rng.choices(names, weights=[mix[name] for name in names], k=warmup + requests):
+        if name == 'find_umid':
+            # Half the lookups miss, like most logins
+            value = FIXTURE_UMID if rng.random() < 0.5 else '9{:07d}'.format(rng.randrange(keys))
+        else:
+            value = 'benchmark-key-{}'.format(rng.randrange(keys))
+        plan.append((name, value))
+
+    stand_in = LatencyBackend(import_string(backend).from_settings(), latency)
+    previous = set_backend(stand_in)
+    get_cache().clear()
+    # Django is already set up, get_wsgi_application would configure logging again
+    application = WSGIHandler()
+    host = _host()
+    paths = {name: reverse(name) for name in ENDPOINTS}
+
+    lock = threading.Lock()
+    position = [0]
+    samples = []    # (endpoint, seconds, status, backend calls)
+
+    def call(name, value):
+        statuses = []
+        calls = stand_in.count_request()
+        start = time.perf_counter()
+        response = application(_environ(paths[name], ENDPOINTS[name], value, host),
+                               lambda status, headers, exc_info=None: statuses.append(status))
+        try:
+            for chunk in response:
+                pass
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        return time.perf_counter() - start, int(statuses[0].split()[0]), calls[0]
+
+    def worker():
+        while True:
+            with lock:
+                i = position[0]
+                position[0] += 1
+            if i >= len(plan):
+                return
+            name, value = plan[i]
+            seconds, status, calls = call(name, value)
+            if i >= warmup:
+                with lock:
+                    samples.append((name, seconds, status, calls))
+
+    try:
+        for name, value in plan[:warmup]:
+            call(name, value)
+        position[0] = warmup
+        threads = [threading.Thread(target=worker, name='benchmark-{}'.format(n)) for n in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        # Buffered increments and remembered answers belong to the stand-in backend
+        if settings.EXC_LIST_WRITE_BEHIND or get_throttle():
+            get_write_buffer().flush()
+        if get_throttle():
+            get_throttle().clear()
+        set_backend(previous)
+        get_cache().clear()
+
+    endpoints = {}
+    for name in names:
+        mine = [sample for sample in samples if sample[0] == name]
+        endpoints[name] = _summary(
+            [sample[1] for sample in mine],
+            Counter(sample[2] for sample in mine),
+            sum(sample[3] for sample in mine),
+            elapsed,
+        )
+
+    return {
+        'config': {
+            'requests': requests,
+            'concurrency': concurrency,
+            'mix': mix,
+            'keys': keys,
+            'latency_ms': latency * 1000,
+            'backend': backend,
+            'warmup': warmup,
+            'seed': seed,
+            'async_views': settings.EXC_LIST_ASYNC_VIEWS,
+            'fast_views': settings.EXC_LIST_FAST_VIEWS,
+            'write_behind': settings.EXC_LIST_WRITE_BEHIND,
+            'python': sys.version.split()[0],
+        },
+        'elapsed': elapsed,
+        'total': _summary(
+            [sample[1] for sample in samples],
+            Counter(sample[2] for sample in samples),
+            sum(sample[3] for sample in samples),
+            elapsed,
+        ),
+        'endpoints': endpoints,
+        'backend_calls': dict(stand_in.calls),
+    }
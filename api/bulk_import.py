@@ -0,0 +1,183 @@
+"""
+Bulk import of key and UMID feeds into an exclusion list OU.
+
+The feed is read as a stream and compared with what the OU already holds, read
+with the same paged search as the export. Names the OU lacks are added, and
+with delete_missing entries the feed no longer lists are deleted. Both go out
+in batches through exc_list_add_keys and exc_list_delete_keys, so the LDAP
+backend pipelines each batch over the shared async connections, from a
+bounded set of worker threads.
+"""
+from django.conf import settings
+
+from .backends import get_backend
+from .exc_list_manager import exc_list_add_keys, exc_list_delete_keys
+from .serializers import UMID
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import csv
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# NDJSON objects may name the entry with any of these, or be lines of an export
+NAME_FIELDS = ('key', 'umid', 'umichExcListName')
+
+
+def read_csv(stream, column=0):
+    """
+    Yields the names in one column of a CSV stream.
+    column is an index, or a header name in which case the first row is the header.
+    """
+    reader = csv.reader(stream)
+    if not isinstance(column, int):
+        header = next(reader, [])
+        if column not in header:
+            raise ValueError('Column {} is not in the header {}'.format(column, ', '.join(header)))
+        column = header.index(column)
+    for row in reader:
+        if len(row) > column:
+            yield row[column].strip()
+
+
+def read_ndjson(stream):
+    """Yields the names in an NDJSON stream of strings, objects or export lines"""
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            raise ValueError('Line {} is not JSON'.format(number))
+        if isinstance(item, dict) and isinstance(item.get('attributes'), dict):
+            item = item['attributes']
+        if isinstance(item, dict):
+            # Resume cookie lines in an export name no entry
+            item = next((item[name] for name in NAME_FIELDS if name in item), None)
+            if isinstance(item, list):
+                item = item[0] if item else None
+        if item is not None:
+            yield str(item).strip()
+
+
+def existing_names(ou):
+    """Lowercased umichExcListName of every entry in the OU"""
+    names = set()
+    for entries, cookie in get_backend().export(ou, settings.EXC_LIST_EXPORT_PAGE_SIZE):
+        for dn, attrs in entries:
+            if attrs.get('umichExcListName'):
+                names.add(str(attrs['umichExcListName'][0]).lower())
+    return names
+
+
+def _valid(name, ou):
+    if not name:
+        return False
+    return ou != 'Admin' or bool(UMID.match(name))
+
+
+def plan_import(names, ou, delete_missing=False):
+    """
+    Compare a feed with the OU. Returns a generator of ('add', name) and ('delete', name)
+    changes, and a dict of counts that is complete once the generator is used up.
+    """
+    counts = {'read': 0, 'invalid': 0, 'duplicate': 0, 'unchanged': 0, 'add': 0, 'delete': 0}
+    existing = existing_names(ou)
+
+    def changes():
+        seen = set()
+        for name in names:
+            counts['read'] += 1
+            if not _valid(name, ou):
+                counts['invalid'] += 1
+                logger.warning('Skipping invalid name {!r}'.format(name))
+                continue
+            lowered = name.lower()
+            if lowered in seen:
+                counts['duplicate'] += 1
+                continue
+            seen.add(lowered)
+            if lowered in existing:
+                counts['unchanged'] += 1
+                continue
+            counts['add'] += 1
+            yield 'add', name
+
+        if delete_missing:
+            for name in sorted(existing - seen):
+                counts['delete'] += 1
+                yield 'delete', name
+
+    return changes(), counts
+
+
+def _batches(changes, batch_size):
+    # A batch only holds one kind of change
+    batch, kind = [], None
+    for change, name in changes:
+        if batch and (change != kind or len(batch) >= batch_size):
+            yield kind, batch
+            batch = []
+        kind = change
+        batch.append(name)
+    if batch:
+        yield kind, batch
+
+
+def _apply(kind, batch, ou):
+    if kind == 'add':
+        results, elapsed = exc_list_add_keys(batch, ou)
+        return [name for name, result in results.items() if 'message' in result]
+    results, elapsed = exc_list_delete_keys(batch, ou)
+    # Someone else deleting it first is as good as deleting it
+    return [name for name, result in results.items() if result['message'] not in ('success', 'noSuchObject')]
+
+
+def run_import(names, ou, delete_missing=False, dry_run=False, workers=4, batch_size=100, on_change=None):
+    """
+    Apply a feed to the OU, or with dry_run only work out the changes.
+    on_change(change, name) is called for every change before it is applied.
+    Returns the counts, the names that failed, and throughput figures.
+    """
+    start = time.monotonic()
+    changes, counts = plan_import(names, ou, delete_missing)
+    if on_change:
+        changes = _reported(changes, on_change)
+
+    failed = []
+    if dry_run:
+        for change in changes:
+            pass
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='import') as executor:
+            in_flight = set()
+            for kind, batch in _batches(changes, batch_size):
+                # Keep the feed from being read far ahead of the writes
+                if len(in_flight) >= 2 * workers:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        failed.extend(future.result())
+                in_flight.add(executor.submit(_apply, kind, batch, ou))
+            for future in in_flight:
+                failed.extend(future.result())
+
+    elapsed = time.monotonic() - start
+    applied = 0 if dry_run else counts['add'] + counts['delete'] - len(failed)
+    return {
+        'ou': ou,
+        'dry_run': dry_run,
+        'counts': counts,
+        'failed': sorted(failed),
+        'elapsed': elapsed,
+        'read_per_second': counts['read'] / elapsed if elapsed else None,
+        'applied_per_second': applied / elapsed if elapsed else None,
+    }
+
+
+def _reported(changes, on_change):
+    for change, name in changes:
+        on_change(change, name)
+        yield change, name
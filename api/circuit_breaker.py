@@ -0,0 +1,227 @@
+"""
+Fail-fast guard around the directory calls of the exc_list_* functions.
+
+A per-process semaphore caps the directory operations in flight, so a slow
+directory ties up at most max_in_flight workers and the rest are turned away
+with a 503 instead of queueing behind it. The cap is held to the size of the
+connection pool, so calls queue on the semaphore rather than on the pool; a
+call that still finds the pool exhausted is turned away as busy too. A circuit
+breaker counts consecutive failures, connection errors, timeouts and results
+such as busy that say the directory is in distress; at failure_threshold it
+opens and calls fail at once with a 503 and a Retry-After of the time left. After reset_timeout one call is let through as a
+probe (half open), its success closes the breaker and its failure opens it
+again. Cache and snapshot hits never reach the guard, so they keep being
+served while it is open.
+"""
+from django.conf import settings
+from ldap3.core.exceptions import LDAPException
+
+from .backends import get_backend, ExcListError, ExcListDirectoryError
+from .ldap_pool import PoolError
+from .metrics import registry
+
+from contextlib import contextmanager
+import math
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Exceptions that count against the directory's health, anything else means it answered.
+# A busy, unavailable or time limit result is an answer that says it is unwell. An
+# exhausted pool says this process is busy, not that the directory is unwell
+FAILURES = (LDAPException, ExcListDirectoryError)
+
+rejected = registry.counter(
+    'exclusionlist_breaker_rejected_total',
+    'Calls turned away without reaching the directory, by reason.',
+    ('reason',),
+)
+
+
+class ExcListUnavailable(ExcListError):
+    """Raised instead of calling the directory, the views return a 503"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker(object):
+    """
+    A failure_threshold of 0 never opens the breaker, and a max_in_flight of 0
+    leaves the number of calls in flight uncapped.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=10, max_in_flight=0, in_flight_wait=0.1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_in_flight = max_in_flight
+        self.in_flight_wait = in_flight_wait
+
+        self._slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight > 0 else None
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+        self._counters = {
+            'calls': 0,
+            'failures': 0,
+            'opened': 0,
+            'rejected_open': 0,
+            'rejected_busy': 0,
+        }
+
+    def _admit(self):
+        """Raises while open, returns True for the half-open probe"""
+        with self._lock:
+            if self._state == OPEN:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self._reject('open')
+                    raise ExcListUnavailable('ldap_unavailable', max(1, math.ceil(remaining)))
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN:
+                if self._probing:
+                    self._reject('open')
+                    raise ExcListUnavailable('ldap_unavailable', 1)
+                self._probing = True
+            self._counters['calls'] += 1
+            return self._state == HALF_OPEN
+
+    def _reject(self, reason):
+        self._counters['rejected_{}'.format(reason)] += 1
+        rejected.inc(reason)
+
+    def _busy(self, probe):
+        with self._lock:
+            if probe:
+                self._probing = False
+            self._reject('busy')
+        return ExcListUnavailable('ldap_busy', 1)
+
+    def _succeeded(self, probe):
+        with self._lock:
+            self._failures = 0
+            if probe:
+                self._probing = False
+                self._state = CLOSED
+                logger.warning('Circuit breaker closed, the directory is answering again')
+
+    def _failed(self, probe, error):
+        with self._lock:
+            self._failures += 1
+            self._counters['failures'] += 1
+            if probe:
+                self._probing = False
+            if probe or (self._state == CLOSED and 0 < self.failure_threshold <= self._failures):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._counters['opened'] += 1
+                logger.error('Circuit breaker opened for {}s after {} failures: {}'.format(
+                    self.reset_timeout, self._failures, error))
+
+    @contextmanager
+    def guard(self, blocking=True):
+        """
+        Wrap a directory call. blocking waits up to in_flight_wait for a slot,
+        coroutines pass False so they never block the event loop.
+        """
+        probe = self._admit()
+        if self._slots is not None:
+            if not (self._slots.acquire(timeout=self.in_flight_wait) if blocking else self._slots.acquire(False)):
+                raise self._busy(probe)
+        try:
+            yield
+        except PoolError as e:
+            raise self._busy(probe) from e
+        except FAILURES as e:
+            self._failed(probe, e)
+            raise
+        except BaseException:
+            self._succeeded(probe)
+            raise
+        else:
+            self._succeeded(probe)
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                'state': state,
+                'consecutive_failures': self._failures,
+                'max_in_flight': self.max_in_flight,
+            })
+        return stats
+
+
+def _max_in_flight():
+    """
+    LDAP_MAX_IN_FLIGHT, held to LDAP_POOL_SIZE when the calls each take a pooled connection.
+    The async views share multiplexed connections, so they keep the setting as it is.
+    """
+    max_in_flight = settings.LDAP_MAX_IN_FLIGHT
+    if max_in_flight > 0 and not settings.EXC_LIST_ASYNC_VIEWS:
+        max_in_flight = min(max_in_flight, settings.LDAP_POOL_SIZE)
+    return max_in_flight
+
+
+_breaker = None
+_breaker_pid = None
+_breaker_backend = None
+_breaker_lock = threading.Lock()
+
+
+def get_breaker():
+    """
+    Return the circuit breaker for this process. It tracks the health of one backend,
+    so a backend swapped in with set_backend starts with a closed breaker of its own.
+    """
+    global _breaker, _breaker_pid, _breaker_backend
+    backend = get_backend()
+    pid = os.getpid()
+    if _breaker is None or _breaker_pid != pid or _breaker_backend is not backend:
+        with _breaker_lock:
+            if _breaker is None or _breaker_pid != pid or _breaker_backend is not backend:
+                _breaker = CircuitBreaker(
+                    failure_threshold=settings.EXC_LIST_BREAKER_FAILURES,
+                    reset_timeout=settings.EXC_LIST_BREAKER_RESET_TIMEOUT,
+                    max_in_flight=_max_in_flight(),
+                    in_flight_wait=settings.LDAP_IN_FLIGHT_WAIT,
+                )
+                _breaker_pid = pid
+                _breaker_backend = backend
+    return _breaker
+
+
+def _breaker_metrics():
+    breaker = _breaker if _breaker_pid == os.getpid() else None
+    if breaker is None:
+        return []
+    state = breaker.state
+    return [
+        ('exclusionlist_breaker_state', 'gauge', 'Circuit breaker state, 1 for the current one.', [
+            ({'state': name}, int(name == state)) for name in (CLOSED, OPEN, HALF_OPEN)
+        ]),
+    ]
+
+
+registry.register_collector(_breaker_metrics)
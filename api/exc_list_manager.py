@@ -1,135 +1,389 @@
 from django.conf import settings
-from ldap3 import Server, Connection, ALL, MODIFY_REPLACE
+from .backends import get_backend, exc_list_dn, exc_list_timestamp, Error, ExcListError
+from .circuit_breaker import get_breaker
+from .hot_keys import get_throttle, throttled, ExcListThrottled, UNKNOWN
+from .lookup_cache import get_cache, MISSING
+from .ou_snapshot import get_snapshot
+from .single_flight import get_flights
+from .write_behind import IncrementBuffer
 
+from collections import OrderedDict
+import atexit
+import os
+import threading
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
-class Error(Exception):
-    """Base class for exceptions in this module."""
-    pass
+# Returned as integers by the compact format
+COUNTER_ATTRIBUTES = ('umichExcListBadAttempts',)
 
+# Always fetched with a field list, the manager needs them whatever the caller asked for
+REQUIRED_ATTRIBUTES = ('umichExcListName', 'umichExcListBadAttempts')
 
-class ExcListError(Error):
-    """
-    Exception raised on exclusion list error.
-    Attributes:
-        message: explanation of the error
-    """
 
-    def __init__(self, message):
-        self.message = message
+def exc_list_find_umid(umid, fields=None):
+    # Serve from the local replica of ou=Admin unless it has gone stale
+    snapshot = get_snapshot()
+    if snapshot and snapshot.fresh():
+        attrs = snapshot.get(umid)
+    else:
+        attrs = _exc_list_lookup(umid, ou='Admin', fields=fields)
 
+    if attrs is None:
+        raise ExcListError('not_found')
 
-def exc_list_find_umid(umid):
-    entry = _exc_list_search(umid, ou='Admin')
+    return exc_list_project(attrs, fields)
 
-    if entry:
-        logger.debug('Found dn={}'.format(entry.entry_dn))
-    else:
+
+def exc_list_find_key(key, ou='IDProof', fields=None):
+    attrs = _exc_list_with_pending(_exc_list_lookup(key, ou, fields), key, ou)
+
+    if attrs is None:
         raise ExcListError('not_found')
 
-    return entry.entry_attributes_as_dict            
+    return exc_list_project(attrs, fields)
+
+
+def exc_list_find_keys(keys, ou='IDProof', fields=None):
+    """
+    Look up several keys at once, the LDAP backend runs one OR-filter search per chunk of cache misses.
+    Returns {key: attributes} with None for keys that have no entry.
+    """
+    cache = get_cache()
+    results = {}
+    missing = []
+    for key in keys:
+        attrs = cache.get(ou, key)
+        if attrs is MISSING:
+            missing.append(key)
+        else:
+            results[key] = attrs
 
+    if missing:
+        token = cache.token()
+        with get_breaker().guard():
+            found = get_backend().search_many(_unique(missing), ou, _exc_list_attributes(fields, ou))
+        for key in missing:
+            attrs = found.get(key.lower())
+            cache.set(ou, key, attrs, token)
+            results[key] = attrs
 
-def exc_list_find_key(key, ou='IDProof'):
-    entry = _exc_list_search(key, ou)
+    return {key: exc_list_project(_exc_list_with_pending(attrs, key, ou), fields) for key, attrs in results.items()}
 
-    if entry:
-        logger.debug('Found dn={}'.format(entry.entry_dn))
-    else:
-        raise ExcListError('not_found')
 
-    return entry.entry_attributes_as_dict
-
-
-def exc_list_add_key(key, ou='IDProof'):
-
-    # Check if an entry already exists
-    entry = _exc_list_search(key, ou)
-    logger.debug('entry={}'.format(entry))
-
-    with Connection(
-        Server(settings.LDAP_URI),
-        settings.LDAP_USERNAME,
-        settings.LDAP_PW,
-        auto_bind=True,
-        check_names=False,    # Do not check attr format from schema (for time formatting)
-    ) as conn:
-
-        # If we have an entry then increment umichExcListBadAttempts
-        if entry:
-            logger.debug('Found dn={}'.format(entry.entry_dn))
-            bad_attempts = int(entry['umichExcListBadAttempts'][0]) + 1
-            mod_attrs = {
-                'umichExcListBadAttempts': [(MODIFY_REPLACE, [bad_attempts])],
-            }
-            result = conn.modify(entry.entry_dn, mod_attrs)
-            logger.debug('result={}'.format(result))
-            response = _exc_list_search(key, ou).entry_attributes_as_dict
-            logger.debug('entry={}'.format(entry))
-        # Else create a new entry
+def exc_list_check(umid=None, keys=(), fields=None):
+    """
+    Look up a UMID in ou=Admin and keys in ou=IDProof in one go, for a login that checks both.
+    The cache misses of both OUs go to the backend together, the LDAP backend runs one
+    subtree search under ou=ExclusionList. Returns {'Admin': {umid: attributes},
+    'IDProof': {key: attributes}} with None for names that have no entry, an OU that
+    nothing was asked of is left out.
+    """
+    cache = get_cache()
+    snapshot = get_snapshot()
+    wanted = ([('Admin', umid)] if umid else []) + [('IDProof', key) for key in _unique(keys)]
+    results = {}
+    missing = []
+    for ou, name in wanted:
+        # Serve from the local replica of ou=Admin unless it has gone stale
+        if ou == 'Admin' and snapshot and snapshot.fresh():
+            attrs = snapshot.get(name)
+        else:
+            attrs = cache.get(ou, name)
+        if attrs is MISSING:
+            missing.append((ou, name))
         else:
-            new_dn = 'umichExcListName={},ou={},ou=ExclusionList,dc=umich,dc=edu'.format(key, ou)
-            objectClasses = {'Top', 'umichExcListText'}
-            attrs = {
-                'umichExcListBadAttempts': 1,
-                'umichExcListTimestamp': time.strftime('%Y%m%d%H%M%SZ', time.gmtime()),
-            }
-            if conn.add(new_dn, objectClasses, attrs):
-                logger.debug('Created new_dn={} conn.result={}'.format(new_dn, conn.result)) 
-                response = {'dn': new_dn}
-            else:    # pragma: no cover
-                raise('Error creating new_dn={} result={}'.format(new_dn, conn.result))
+            results[(ou, name)] = attrs
+
+    if missing:
+        token = cache.token()
+        # Whole entries unless none of the OUs searched is cached
+        attributes = [_exc_list_attributes(fields, ou) for ou in sorted({ou for ou, name in missing})]
+        attributes = None if None in attributes else attributes[0]
+        with get_breaker().guard():
+            found = get_backend().search_ous(missing, attributes)
+        for ou, name in missing:
+            attrs = found.get((ou, name.lower()))
+            cache.set(ou, name, attrs, token)
+            results[(ou, name)] = attrs
 
+    response = {}
+    for ou, name in wanted:
+        attrs = results[(ou, name)]
+        if ou == 'IDProof':
+            attrs = _exc_list_with_pending(attrs, name, ou)
+        response.setdefault(ou, {})[name] = exc_list_project(attrs, fields)
     return response
 
 
+def exc_list_add_key(key, ou='IDProof', fields=None):
+    # Buffer the increment and answer from the last known entry plus pending deltas
+    buffer = get_write_buffer() if settings.EXC_LIST_WRITE_BEHIND else None
+    if buffer and buffer.add(key, ou):
+        stored, delta, first_seen = buffer.known(key, ou)
+        if stored is MISSING:
+            # Only a key this process knows nothing about costs a search, of the whole entry
+            stored = _exc_list_lookup(key, ou)
+            buffer.remember(key, ou, stored, replace=False)
+            stored, delta, first_seen = buffer.known(key, ou)
+        if stored is None and delta == 1:
+            return {'dn': exc_list_dn(key, ou)}
+        return exc_list_project(_exc_list_add_delta(stored, key, delta, first_seen), fields)
+
+    # Past its rate a hot key is counted in the write-behind buffer instead
+    throttle = get_throttle()
+    if throttle and not throttle.admit(ou, key):
+        return exc_list_project(_exc_list_hot_add(throttle, key, ou), fields)
+
+    with get_breaker().guard():
+        response = get_backend().increment(key, ou)
+    _exc_list_invalidate(key, ou)
+    _exc_list_remember(key, ou, response)
+    _exc_list_snapshot_put(key, ou, response)
+    return exc_list_project(response, fields)
+
+
+def exc_list_add_keys(keys, ou='IDProof', fields=None):
+    """
+    Increment or create several keys, the LDAP backend pipelines the writes over a few async connections.
+    Returns {key: result}, where result matches what exc_list_add_key would have returned
+    or carries a message on failure, and the elapsed time in seconds.
+    """
+    start = time.monotonic()
+    keys = _unique(keys)
+
+    with get_breaker().guard():
+        results = get_backend().increment_many(keys, ou)
+    for key in keys:
+        _exc_list_invalidate(key, ou)
+        _exc_list_snapshot_put(key, ou, results[key])
+    return {key: exc_list_project(results[key], fields) for key in keys}, time.monotonic() - start
+
+
+def exc_list_delete_keys(keys, ou='IDProof'):
+    """
+    Delete several keys, the LDAP backend pipelines the deletes over a few async connections.
+    Returns {key: {'message': ...}} and the elapsed time in seconds.
+    """
+    start = time.monotonic()
+    keys = _unique(keys)
+    if settings.EXC_LIST_WRITE_BEHIND or get_throttle():
+        for key in keys:
+            get_write_buffer().discard(key, ou)
+
+    with get_breaker().guard():
+        results = get_backend().delete_many(keys, ou)
+    for key in keys:
+        _exc_list_invalidate(key, ou)
+        if get_throttle():
+            get_throttle().remember(ou, key, None)
+        if ou == 'Admin' and get_snapshot():
+            get_snapshot().discard(key)
+    return {key: results[key] for key in keys}, time.monotonic() - start
+
+
+def _unique(names):
+    # umichExcListName is case insensitive, keep the first spelling of each name
+    return list(OrderedDict((name.lower(), name) for name in names).values())
+
+
 def exc_list_delete_key(key, ou='IDProof'):
-    delete_dn = 'umichExcListName={},ou={},ou=ExclusionList,dc=umich,dc=edu'.format(key, ou)
-    logger.debug('delete_dn={}'.format(delete_dn))
-    # Connection context manager
-    with Connection(
-        Server(settings.LDAP_URI),
-        settings.LDAP_USERNAME,
-        settings.LDAP_PW,
-        auto_bind=True,
-        check_names=False,    # Do not check attr format from schema (for time formatting)
-    ) as conn:
-        conn.delete(delete_dn)
-        message = conn.result['description']
+    if settings.EXC_LIST_WRITE_BEHIND or get_throttle():
+        get_write_buffer().discard(key, ou)
+
+    with get_breaker().guard():
+        message = get_backend().delete(key, ou)
+    _exc_list_invalidate(key, ou)
+    if get_throttle():
+        get_throttle().remember(ou, key, None)
+    if ou == 'Admin' and get_snapshot():
+        get_snapshot().discard(key)
     return {'message': message}
 
 
-def _exc_list_search(umichExcListName, ou='IDProof'):
-    entry = ''
-    base = 'ou={},ou=ExclusionList,dc=umich,dc=edu'.format(ou)
-    logger.debug('Searching for umichExcListName={},{}'.format(umichExcListName, base))
-
-    # Connection context manager
-    with Connection(
-        Server(settings.LDAP_URI),
-        settings.LDAP_USERNAME,
-        settings.LDAP_PW,
-        auto_bind=True,
-        check_names=False,    # Do not check attr format from schema (for time formatting)
-    ) as conn:
-        conn.search(
-            base,
-            '(umichExcListName={})'.format(umichExcListName),
-            attributes=['*'],
-            time_limit=settings.LDAP_TIME_LIMIT,
-        )
-
-        if len(conn.entries) == 1:
-            entry = conn.entries[0]
-            #logger.debug('Found dn={}'.format(entry.entry_dn))
-        elif len(conn.entries) == 0:
-            pass
-        else:    # pragma: no cover
-            logger.debug('multiple results found')
-            raise ExcListError(message='multiple_results_found')
-
-    return entry
+def _exc_list_lookup(umichExcListName, ou, fields=None):
+    """
+    Read-through cache in front of the backend.
+    Returns the entry attributes, or None if there is no entry.
+    """
+    cache = get_cache()
+    attrs = cache.get(ou, umichExcListName)
+    if attrs is not MISSING:
+        logger.debug('Cache hit for umichExcListName={},ou={}'.format(umichExcListName, ou))
+        return attrs
+
+    attributes = _exc_list_attributes(fields, ou)
+
+    def load():
+        throttle = get_throttle()
+        if throttle and not throttle.admit(ou, umichExcListName):
+            return _exc_list_hot_lookup(throttle, umichExcListName, ou)
 
+        token = cache.token()
+        with get_breaker().guard():
+            attrs = get_backend().search(umichExcListName, ou, attributes)
+        cache.set(ou, umichExcListName, attrs, token)
+        if attributes is None:
+            _exc_list_remember(umichExcListName, ou, attrs)
+        return attrs
+
+    # Concurrent misses for the same name share one search
+    flights = get_flights()
+    if flights:
+        return flights.do(_exc_list_flight(umichExcListName, ou), load, tag=attributes)
+    return load()
+
+
+def _exc_list_flight(name, ou):
+    return (ou, name.lower())
+
+
+def _exc_list_invalidate(key, ou):
+    """Drop what is cached for a key after a write, later lookups must not join a search from before it"""
+    get_cache().invalidate(ou, key)
+    flights = get_flights()
+    if flights:
+        flights.forget(_exc_list_flight(key, ou))
+
+
+def _exc_list_remember(key, ou, attrs):
+    # Whole entries and not_found only, a {'dn': ...} from a create says nothing about the counter
+    if get_throttle() and (attrs is None or 'umichExcListBadAttempts' in attrs):
+        get_throttle().remember(ou, key, attrs)
+
+
+def _exc_list_hot_lookup(throttle, umichExcListName, ou):
+    """Answer a lookup of a hot key with what the backend last said about it"""
+    attrs = throttle.last(ou, umichExcListName)
+    if attrs is UNKNOWN:
+        throttled.inc('find', 'rejected')
+        raise ExcListThrottled(throttle.retry_after(ou, umichExcListName))
+    throttled.inc('find', 'answered')
+    return attrs
+
+
+def _exc_list_hot_add(throttle, key, ou):
+    """Buffer an increment of a hot key and answer from its last entry plus the buffered deltas"""
+    attrs = throttle.last(ou, key)
+    if not attrs or attrs is UNKNOWN or not get_write_buffer().add(key, ou):
+        throttled.inc('add', 'rejected')
+        raise ExcListThrottled(throttle.retry_after(ou, key))
+    throttled.inc('add', 'answered')
+    return _exc_list_with_pending(attrs, key, ou)
+
+
+def _exc_list_attributes(fields, ou):
+    """
+    Attributes to ask the backend for. Entries are cached whole, so the field list
+    only goes down to the directory for an OU that is not cached.
+    """
+    if not fields or get_cache().enabled(ou):
+        return None
+    return list(OrderedDict((name.lower(), name) for name in list(REQUIRED_ATTRIBUTES) + fields).values())
+
+
+def exc_list_project(attrs, fields):
+    """Keep only the requested attributes of an entry, names compare case insensitively"""
+    if not attrs or not fields or 'dn' in attrs or 'message' in attrs:
+        return attrs
+    wanted = {name.lower() for name in fields}
+    return {name: values for name, values in attrs.items() if name.lower() in wanted}
+
+
+def exc_list_compact(attrs):
+    """Flatten single-valued attributes and return the counters as integers"""
+    if not attrs or 'dn' in attrs or 'message' in attrs:
+        return attrs
+    compact = {}
+    for name, values in attrs.items():
+        if isinstance(values, list) and len(values) == 1:
+            values = values[0]
+        if name in COUNTER_ATTRIBUTES:
+            values = [int(value) for value in values] if isinstance(values, list) else int(values)
+        compact[name] = values
+    return compact
+
+
+def _exc_list_with_pending(attrs, key, ou):
+    """
+    Add increments still sitting in the write-behind buffer to a lookup result.
+    Returns a new dict, attrs may be shared with other callers.
+    """
+    if not settings.EXC_LIST_WRITE_BEHIND and not get_throttle():
+        return attrs
+    delta, first_seen = get_write_buffer().pending(key, ou)
+    return _exc_list_add_delta(attrs, key, delta, first_seen)
+
+
+def _exc_list_add_delta(attrs, key, delta, first_seen):
+    if not delta:
+        return attrs
+
+    if attrs is None:
+        attrs = {
+            'umichExcListName': [key],
+            'umichExcListBadAttempts': ['0'],
+            'umichExcListTimestamp': [exc_list_timestamp(first_seen)],
+        }
+    return dict(attrs, umichExcListBadAttempts=[str(int(attrs['umichExcListBadAttempts'][0]) + delta)])
+
+
+def _exc_list_flush_increment(key, ou, delta):
+    """Write a buffered delta, returns the entry after it for the buffer to answer adds from"""
+    with get_breaker().guard():
+        response = get_backend().increment(key, ou, delta)
+    _exc_list_invalidate(key, ou)
+    _exc_list_remember(key, ou, response)
+    _exc_list_snapshot_put(key, ou, response, delta)
+    return _exc_list_entry(key, response, delta)
+
+
+def _exc_list_entry(key, response, delta=1):
+    """The entry an increment left behind, or None when the response is a failure"""
+    if 'umichExcListBadAttempts' in response:
+        return response
+    if 'dn' not in response:
+        return None
+    # A {'dn': ...} answers a create, the new entry holds the delta
+    return {
+        'objectClass': ['top', 'umichExcListText'],
+        'umichExcListName': [key],
+        'umichExcListBadAttempts': [str(delta)],
+        'umichExcListTimestamp': [exc_list_timestamp(time.gmtime())],
+    }
+
+
+def _exc_list_snapshot_put(key, ou, response, delta=1):
+    # Admin lockouts are served from the snapshot at once, not after its next refresh
+    snapshot = get_snapshot() if ou == 'Admin' else None
+    attrs = _exc_list_entry(key, response, delta) if snapshot else None
+    if attrs is not None:
+        snapshot.put(key, attrs)
+
+
+_write_buffer = None
+_write_buffer_pid = None
+_write_buffer_lock = threading.Lock()
+
+
+def get_write_buffer():
+    """
+    Return the write-behind buffer for this process, starting its flush thread on first use.
+    Whatever is still buffered is flushed when the process exits.
+    """
+    global _write_buffer, _write_buffer_pid
+    pid = os.getpid()
+    if _write_buffer is None or _write_buffer_pid != pid:
+        with _write_buffer_lock:
+            if _write_buffer is None or _write_buffer_pid != pid:
+                _write_buffer = IncrementBuffer(
+                    _exc_list_flush_increment,
+                    interval=settings.EXC_LIST_WRITE_BEHIND_INTERVAL,
+                    max_keys=settings.EXC_LIST_WRITE_BEHIND_MAX_KEYS,
+                )
+                _write_buffer.start()
+                atexit.register(_write_buffer.stop)
+                _write_buffer_pid = pid
+    return _write_buffer
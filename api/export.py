@@ -0,0 +1,80 @@
+"""
+NDJSON export of an exclusion list OU, shared by the export endpoint and the
+export_exc_list command.
+
+Entries are read a page at a time with the simple paged results control and
+written out as they arrive, so memory use depends on the page size and not on
+the size of the OU. Each entry is one line:
+
+    {"dn": "...", "attributes": {...}}
+
+Every page that is not the last is followed by a resume line:
+
+    {"cookie": "..."}
+
+and the export ends with {"cookie": null, "entries": <count>}. Passing the last
+cookie seen back in carries on after that page, where the directory accepts a
+paged results cookie on a new connection.
+"""
+from rest_framework.utils.encoders import JSONEncoder
+from .backends import get_backend, ExcListError
+
+import base64
+import binascii
+import logging
+
+logger = logging.getLogger(__name__)
+
+_encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def encode_cookie(cookie):
+    return base64.urlsafe_b64encode(cookie).decode('ascii') if cookie else None
+
+
+def decode_cookie(cookie):
+    """Returns the raw paged results cookie, raises ExcListError('invalid_cookie') on a malformed one"""
+    if not cookie:
+        return None
+    try:
+        return base64.urlsafe_b64decode(cookie.encode('ascii'))
+    except (binascii.Error, UnicodeEncodeError, ValueError):
+        raise ExcListError('invalid_cookie')
+
+
+def _line(data):
+    return (_encoder.encode(data) + '\n').encode('utf-8')
+
+
+def export_lines(ou, page_size=500, cookie=None):
+    """
+    Returns a generator of NDJSON lines as bytes. The first page is read before
+    this returns, so a bad OU or cookie raises ExcListError here and not midway
+    through a response.
+    """
+    pages = get_backend().export(ou, page_size, decode_cookie(cookie))
+    try:
+        first = next(pages)
+    except StopIteration:    # pragma: no cover
+        first = ([], None)
+
+    def lines():
+        count = 0
+        try:
+            page = first
+            while True:
+                entries, next_cookie = page
+                for dn, attrs in entries:
+                    yield _line({'dn': dn, 'attributes': attrs})
+                count += len(entries)
+                if next_cookie is None:
+                    break
+                yield _line({'cookie': encode_cookie(next_cookie)})
+                page = next(pages)
+        finally:
+            # Hand the connection back if the client goes away part way through
+            pages.close()
+        logger.info('Exported entries={} ou={}'.format(count, ou))
+        yield _line({'cookie': None, 'entries': count})
+
+    return lines()
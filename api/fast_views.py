@@ -0,0 +1,197 @@
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.utils.encoders import JSONEncoder
+from .serializers import ExcListUMIDSerializer, ExcListKeySerializer, UMID, FORMATS, split_fields
+from .exc_list_manager import exc_list_find_umid, exc_list_find_key, exc_list_add_key, exc_list_delete_key, exc_list_compact, ExcListError
+from .circuit_breaker import ExcListUnavailable
+from .hot_keys import ExcListThrottled
+from .metrics import count_error
+from . import views
+from .log_pipeline import sampled
+import json
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# Fast path versions of the four single-key views in views.py, same URLs and the same
+# 200/400/404/405 bodies. A request is parsed and checked directly, and only one that
+# fails the checks goes through the serializer, so error messages match DRF's exactly.
+# OPTIONS is handed to the DRF view itself.
+
+FORM_TYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+
+# Rendered as DRF's JSONRenderer would: compact, UTF-8, same handling of dates
+_encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def _json(data, status=200):
+    return HttpResponse(_encoder.encode(data).encode('utf-8'), status=status, content_type='application/json')
+
+
+class _ParseError(Exception):
+
+    def __init__(self, status, detail):
+        self.status = status
+        self.detail = detail
+
+
+def _data(request):
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError as e:
+            raise _ParseError(400, 'JSON parse error - {}'.format(e))
+    if request.content_type in FORM_TYPES or not request.body:
+        return request.POST
+    raise _ParseError(415, 'Unsupported media type "{}" in request.'.format(request.META.get('CONTENT_TYPE', '')))
+
+
+def _options(data, field, pattern=None):
+    """
+    The checks ExcListResultSerializer and its subclasses make, for the common case of
+    string values. Returns the validated options, or None to let the serializer decide.
+    """
+    if not isinstance(data, dict):
+        return None
+    value = data.get(field)
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if not value or (pattern and not pattern.match(value)):
+        return None
+
+    format = data.get('format', 'full')
+    if format not in FORMATS:
+        return None
+
+    fields = None
+    if 'fields' in data:
+        items = data.getlist('fields') if hasattr(data, 'getlist') else data['fields']
+        if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+            return None
+        fields = split_fields(items)
+        if fields is None:
+            return None
+    return {field: value, 'fields': fields or None, 'format': format}
+
+
+def _handle(request, serializer_class, field, operation, not_found=True, pattern=None, shaped=True, drf_view=None):
+    if request.method == 'OPTIONS':
+        # Answered by the DRF view this one stands in for, so the metadata is the same
+        return drf_view(request)
+    if request.method != 'POST':
+        response = _json({"detail": 'Method "{}" not allowed.'.format(request.method)}, status=405)
+        response['Allow'] = 'POST, OPTIONS'
+        return response
+
+    try:
+        data = _data(request)
+    except _ParseError as e:
+        # Return a 400 on a body that is not JSON, a 415 on other content types
+        return _json({"detail": e.detail}, status=e.status)
+
+    try:
+        logger.info('<FastRequest: %s \'%s\' data=%s>', request.method, request.path, data,
+                    extra=sampled(request.path, data, field))
+        options = _options(data, field, pattern)
+        if options is None:
+            serializer = serializer_class(data=data)
+            if serializer.is_valid():
+                options = serializer.validated_data
+            else:
+                # Return a 400 on invalid input
+                response = _json(serializer.errors, status=400)
+
+        if options is not None:
+            if shaped:
+                result = operation(options[field], fields=options.get('fields'))
+                if options['format'] == 'compact':
+                    result = exc_list_compact(result)
+            else:
+                result = operation(options[field])
+            # Return 200 on success
+            response = _json(result)
+
+    # Return a 429 for a hot key there is no local answer for
+    except ExcListThrottled as e:
+        count_error(e)
+        response = _json({
+            "message": e.message,
+            "status": 429,
+            },
+            status=429
+        )
+        response['Retry-After'] = str(e.retry_after)
+
+    # Return a 503 while the directory is failing or too busy to take the call
+    except ExcListUnavailable as e:
+        count_error(e)
+        response = _json({
+            "message": e.message,
+            "status": 503,
+            },
+            status=503
+        )
+        response['Retry-After'] = str(e.retry_after)
+
+    # Return a 404 on a failed match
+    except ExcListError as e:
+        count_error(e)
+        if not_found:
+            response = _json({
+                "message": e.message,
+                "status": 404,
+                },
+                status=404
+            )
+        else:    # pragma: no cover
+            response = _json({"message": e.message}, status=500)
+            logger.error(traceback.format_exc())
+
+    # Return a 500 on any unexpected exceptions
+    except Exception as e:    # pragma: no cover
+        count_error(e)
+        response = _json({"message": str(e)}, status=500)
+        logger.error(traceback.format_exc())
+
+    logger.info('Return status_code=%s response=%s', response.status_code, response.content,
+                extra=sampled(request.path, data, field) if response.status_code < 300 else None)
+    return response
+
+
+@csrf_exempt
+def find_umid(request):
+    """
+    API endpoint that searches the exclusion list for the provided umid
+    Returns the entry as a json string if a match is found
+    """
+    return _handle(request, ExcListUMIDSerializer, 'umid', exc_list_find_umid, pattern=UMID, drf_view=views.find_umid)
+
+
+@csrf_exempt
+def find_key(request):
+    """
+    API endpoint that searches the exclusion list for the provided key
+    Returns the entry as a json string if a match is found
+    """
+    return _handle(request, ExcListKeySerializer, 'key', exc_list_find_key, drf_view=views.find_key)
+
+
+@csrf_exempt
+def add_key(request):
+    """
+    API endpoint that increments bad attempts for the provided key
+    Will create the exc list entry if it does not exist
+    Returns 200 on a successful add
+    """
+    return _handle(request, ExcListKeySerializer, 'key', exc_list_add_key, not_found=False, drf_view=views.add_key)
+
+
+@csrf_exempt
+def delete_key(request):
+    """
+    API endpoint that deletes the exc list entry for the provided key
+    Returns 200 on a successful delete
+    """
+    return _handle(request, ExcListKeySerializer, 'key', exc_list_delete_key, not_found=False, shaped=False, drf_view=views.delete_key)
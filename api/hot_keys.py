@@ -0,0 +1,130 @@
+from django.conf import settings
+
+from .backends import ExcListError
+from .metrics import registry
+
+from collections import OrderedDict
+import copy
+import threading
+import time
+
+# Returned by HotKeyThrottle.last when no answer is known for a key
+UNKNOWN = object()
+
+throttled = registry.counter(
+    'exclusionlist_hot_key_throttled_total',
+    'Requests for a hot key answered without going to the backend, by operation and outcome.',
+    ('operation', 'outcome'),
+)
+
+
+class ExcListThrottled(ExcListError):
+    """Raised for a hot key when there is no answer to give locally, the views return a 429"""
+
+    def __init__(self, retry_after):
+        super().__init__('hot_key')
+        self.retry_after = retry_after
+
+
+class HotKeyThrottle(object):
+    """
+    Per-key token buckets in front of the backend, keyed by (ou, name).
+
+    Each key may go to the backend rate times a second with bursts of up to
+    burst requests. Beyond that the key is hot, and requests for it are
+    answered from the last result the backend gave for it. Buckets are kept in
+    LRU order and the coldest are dropped past max_keys, so memory stays
+    bounded however many keys are seen.
+    """
+
+    def __init__(self, rate=10.0, burst=20, max_keys=10000):
+        self.rate = float(rate)
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()    # (ou, lowercased name) -> [tokens, updated, last result]
+        self._lock = threading.Lock()
+        self._counters = {
+            'admitted': 0,
+            'throttled': 0,
+            'evictions': 0,
+        }
+
+    @staticmethod
+    def _key(ou, name):
+        return (ou, name.lower())
+
+    def admit(self, ou, name):
+        """Take a token for the key, returns False if the key is hot"""
+        key = self._key(ou, name)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, UNKNOWN]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+                    self._counters['evictions'] += 1
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                self._counters['admitted'] += 1
+                return True
+            self._counters['throttled'] += 1
+            return False
+
+    def retry_after(self, ou, name):
+        """Whole seconds until the key has a token again"""
+        with self._lock:
+            bucket = self._buckets.get(self._key(ou, name))
+            tokens = bucket[0] if bucket else 1
+        return max(1, int(-(-(1 - tokens) // self.rate))) if self.rate > 0 else 1
+
+    def remember(self, ou, name, value):
+        """Keep the backend's answer for a key that has a bucket, None records not_found"""
+        with self._lock:
+            bucket = self._buckets.get(self._key(ou, name))
+            if bucket is not None:
+                bucket[2] = copy.deepcopy(value)
+
+    def last(self, ou, name):
+        """The last answer remembered for the key, or UNKNOWN"""
+        with self._lock:
+            bucket = self._buckets.get(self._key(ou, name))
+            value = bucket[2] if bucket else UNKNOWN
+        return value if value is UNKNOWN else copy.deepcopy(value)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                'keys': len(self._buckets),
+                'max_keys': self.max_keys,
+            })
+        return stats
+
+
+_throttle = None
+_throttle_lock = threading.Lock()
+
+
+def get_throttle():
+    """Return the process-wide hot key throttle, or None when EXC_LIST_HOT_KEY_RATE is 0"""
+    global _throttle
+    if settings.EXC_LIST_HOT_KEY_RATE <= 0:
+        return None
+    if _throttle is None:
+        with _throttle_lock:
+            if _throttle is None:
+                _throttle = HotKeyThrottle(
+                    rate=settings.EXC_LIST_HOT_KEY_RATE,
+                    burst=settings.EXC_LIST_HOT_KEY_BURST,
+                    max_keys=settings.EXC_LIST_HOT_KEY_MAX_KEYS,
+                )
+    return _throttle
@@ -0,0 +1,559 @@
+from django.conf import settings
+from ldap3 import Server, Connection, ASYNC, BASE
+from ldap3.core.exceptions import LDAPException, LDAPBindError, LDAPCommunicationError, LDAPResponseTimeoutError, \
+    LDAPSocketOpenError, LDAPSocketSendError
+from .metrics import registry, ldap_duration
+
+from collections import deque
+from contextlib import contextmanager
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cheap base-scope search used to verify a pooled connection is still alive
+HEALTH_CHECK_DN = 'ou=ExclusionList,dc=umich,dc=edu'
+
+# Failures that mean the request never reached the server, so even a write is safe to send again
+NOT_SENT = (LDAPSocketOpenError, LDAPSocketSendError)
+
+
+class PoolError(Exception):
+    """
+    Exception raised when a connection cannot be obtained from the pool.
+    Attributes:
+        message: explanation of the error
+    """
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of pre-bound ldap3 connections.
+
+    Connections are handed out LIFO so the hot ones stay hot. A connection that
+    has been idle longer than idle_timeout is rebound, and one idle longer than
+    health_check_interval is probed before it is handed out. connect_timeout and
+    receive_timeout bound, in seconds, opening a socket and waiting for a reply.
+    """
+
+    def __init__(self, uri, user, password, size=10, idle_timeout=300,
+                 health_check_interval=30, acquire_timeout=5, server=None, client_strategy=None,
+                 check_names=False, connect_timeout=None, receive_timeout=None):
+        self.uri = uri
+        self.server = server or Server(uri, connect_timeout=connect_timeout)
+        self.user = user
+        self.password = password
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.client_strategy = client_strategy
+        self.check_names = check_names
+        self.receive_timeout = receive_timeout
+
+        self._idle = deque()    # (conn, last_used) pairs
+        self._open_count = 0    # idle + in use
+        self._last_success = None
+        self._latency = None    # moving average of run() in seconds
+        self._cond = threading.Condition()
+        self._counters = {
+            'created': 0,
+            'reused': 0,
+            'rebinds': 0,
+            'health_checks': 0,
+            'discarded': 0,
+            'waits': 0,
+            'timeouts': 0,
+        }
+
+    def _connect(self):
+        kwargs = {
+            'auto_bind': True,
+            'check_names': self.check_names,    # Do not check attr format from schema (for time formatting)
+        }
+        if self.client_strategy:
+            kwargs['client_strategy'] = self.client_strategy
+        if self.receive_timeout:
+            kwargs['receive_timeout'] = self.receive_timeout
+        with ldap_duration.time('bind'):
+            conn = Connection(self.server, self.user, self.password, **kwargs)
+            if not conn.bound and not conn.bind():    # mock strategies skip auto_bind
+                raise LDAPBindError('unable to bind')
+        self._count('created')
+        logger.debug('Opened pooled connection {}'.format(id(conn)))
+        return conn
+
+    def _count(self, name):
+        with self._cond:
+            self._counters[name] += 1
+
+    def _close(self, conn):
+        try:
+            conn.unbind()
+        except LDAPException:    # pragma: no cover
+            pass
+
+    def _healthy(self, conn, idle_for):
+        if conn.closed or not conn.bound:
+            return False
+        if idle_for < self.health_check_interval:
+            return True
+        self._count('health_checks')
+        try:
+            result = conn.search(HEALTH_CHECK_DN, '(objectClass=*)', search_scope=BASE, attributes=['1.1'])
+            if not conn.strategy.sync:
+                conn.get_response(result)
+        except LDAPException:
+            return False
+        return True
+
+    def _rebind(self, conn):
+        """Replace a stale or broken connection with a fresh one in the same slot"""
+        logger.debug('Rebinding pooled connection {}'.format(id(conn)))
+        self._close(conn)
+        self._count('rebinds')
+        try:
+            return self._connect()
+        except Exception:
+            self._forget()
+            raise
+
+    def _forget(self):
+        with self._cond:
+            self._open_count -= 1
+            self._counters['discarded'] += 1
+            self._cond.notify()
+
+    def acquire(self, timeout=None):
+        deadline = time.monotonic() + (self.acquire_timeout if timeout is None else timeout)
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    self._counters['reused'] += 1
+                    break
+                if self._open_count < self.size:
+                    self._open_count += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolError('ldap_pool_exhausted')
+                self._counters['waits'] += 1
+                self._cond.wait(remaining)
+
+        if conn is None:
+            try:
+                return self._connect()
+            except Exception:
+                self._forget()
+                raise
+
+        idle_for = time.monotonic() - last_used
+        if idle_for >= self.idle_timeout or not self._healthy(conn, idle_for):
+            conn = self._rebind(conn)
+        return conn
+
+    def release(self, conn):
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def discard(self, conn):
+        self._close(conn)
+        self._forget()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except LDAPCommunicationError:
+            self.discard(conn)
+            raise
+        except Exception:
+            self.release(conn)
+            raise
+        self.release(conn)
+
+    def run(self, operation, retry=True):
+        """
+        Call operation(conn) with a pooled connection.
+        If the connection turns out to be dead the operation is retried once on a fresh bind.
+        Writes pass retry=False, they are only sent again if the request never went out,
+        a write whose reply was lost may have been applied.
+        """
+        conn = self.acquire()
+        start = time.perf_counter()
+        try:
+            result = operation(conn)
+        except LDAPCommunicationError as e:
+            logger.debug('Pooled connection {} failed: {}'.format(id(conn), e))
+            if not retry and not isinstance(e, NOT_SENT):
+                self.discard(conn)
+                raise
+            conn = self._rebind(conn)
+            try:
+                result = operation(conn)
+            except LDAPCommunicationError:
+                self.discard(conn)
+                raise
+            except Exception:
+                self.release(conn)
+                raise
+        except Exception:
+            self.release(conn)
+            raise
+        self.release(conn)
+        self._succeeded(time.perf_counter() - start)
+        return result
+
+    def _succeeded(self, seconds):
+        # Plain attribute writes, a lost update between threads does not matter here
+        self._last_success = time.monotonic()
+        self._latency = seconds if self._latency is None else 0.8 * self._latency + 0.2 * seconds
+
+    def last_success_age(self):
+        """Seconds since run() last completed an operation, None if it never has"""
+        last_success = self._last_success
+        return None if last_success is None else time.monotonic() - last_success
+
+    def close(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open_count -= len(idle)
+            self._cond.notify_all()
+        for conn, last_used in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update({
+                'size': self.size,
+                'open': self._open_count,
+                'idle': len(self._idle),
+                'in_use': self._open_count - len(self._idle),
+                'last_success_age': self.last_success_age(),
+                'latency_ms': None if self._latency is None else 1000 * self._latency,
+            })
+        return stats
+
+
+# Ways ReplicaSet picks the replica for a read
+READ_STRATEGIES = ('round_robin', 'least_latency')
+
+
+class ReplicaSet(object):
+    """
+    Routes reads over pools to several directory replicas.
+
+    Each read goes to one admitted replica, taken in turn with round_robin or
+    the one with the lowest moving-average latency with least_latency. A replica
+    whose reads fail max_failures times in a row with a communication, response
+    timeout or bind error is ejected for eject_seconds. After that the next read
+    is sent to it as a probe, a reply readmits it and failure ejects it again.
+    Errors in the pool or in the caller's operation say nothing of the replica
+    and leave its state as it was. A read that fails on a replica is retried
+    once on the fallback pool, the master, which also takes all reads while
+    every replica is ejected.
+    """
+
+    def __init__(self, pools, fallback=None, strategy='round_robin', max_failures=3, eject_seconds=30):
+        if strategy not in READ_STRATEGIES:
+            raise ValueError('Unknown read strategy {}, expected one of {}'.format(strategy, ', '.join(READ_STRATEGIES)))
+        self.fallback = fallback
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+
+        # Per replica: pool, consecutive failures, monotonic time the ejection ends, probe in flight
+        self._replicas = [{'pool': pool, 'failures': 0, 'ejected_until': None, 'probing': False} for pool in pools]
+        self._owners = {}    # id(conn) -> replica, or None for the fallback, while a connection is out
+        self._next = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'reads': 0,
+            'fallbacks': 0,
+            'ejections': 0,
+            'probes': 0,
+            'readmissions': 0,
+        }
+
+    @property
+    def pools(self):
+        return [replica['pool'] for replica in self._replicas]
+
+    def _choose(self):
+        """The replica for the next read, or None to use the fallback"""
+        now = time.monotonic()
+        with self._lock:
+            self._counters['reads'] += 1
+            for replica in self._replicas:
+                if replica['ejected_until'] is not None and replica['ejected_until'] <= now and not replica['probing']:
+                    replica['probing'] = True
+                    self._counters['probes'] += 1
+                    return replica
+            admitted = [replica for replica in self._replicas if replica['ejected_until'] is None]
+            if not admitted:
+                self._counters['fallbacks'] += 1
+                return None
+            if self.strategy == 'least_latency':
+                # Replicas that have not answered yet count as fastest, so each gets measured
+                return min(admitted, key=lambda replica: replica['pool']._latency or 0.0)
+            self._next += 1
+            return admitted[self._next % len(admitted)]
+
+    def _succeeded(self, replica):
+        with self._lock:
+            if replica['ejected_until'] is not None:
+                self._counters['readmissions'] += 1
+                logger.info('Readmitted read replica {}'.format(replica['pool'].uri))
+            replica.update(failures=0, ejected_until=None, probing=False)
+
+    def _failed(self, replica, error):
+        with self._lock:
+            replica['failures'] += 1
+            if replica['probing'] or (replica['ejected_until'] is None and replica['failures'] >= self.max_failures):
+                replica.update(ejected_until=time.monotonic() + self.eject_seconds, probing=False)
+                self._counters['ejections'] += 1
+                logger.warning('Ejected read replica {} for {}s after {} failures: {}'.format(
+                    replica['pool'].uri, self.eject_seconds, replica['failures'], error))
+
+    def _without_replica(self, error):
+        if self.fallback is None:
+            raise error or PoolError('ldap_no_replicas')
+        with self._lock:
+            self._counters['fallbacks'] += 1
+        return self.fallback
+
+    def _released(self, replica):
+        # Nothing was heard from the replica, the next read after its ejection probes it instead
+        with self._lock:
+            replica['probing'] = False
+
+    def run(self, operation):
+        """Call operation(conn) on a replica, operation must only read"""
+        replica = self._choose()
+        if replica is None:
+            return self._without_replica(None).run(operation)
+        replied = []
+
+        def read(conn):
+            # conn.result is only set again by a reply to this operation
+            conn.result = None
+            try:
+                return operation(conn)
+            finally:
+                replied.append(conn.result is not None)
+
+        try:
+            result = replica['pool'].run(read)
+        except (LDAPCommunicationError, LDAPResponseTimeoutError, LDAPBindError) as e:
+            self._failed(replica, e)
+            return self._without_replica(e).run(operation)
+        except Exception:
+            # A result other than success is still a reply, a pool or caller error says nothing of the replica
+            if replied and replied[-1]:
+                self._succeeded(replica)
+            else:
+                self._released(replica)
+            raise
+        self._succeeded(replica)
+        return result
+
+    def acquire(self, timeout=None):
+        """
+        A connection to a replica for a read spanning several requests, give it back with release
+        or discard. The replica is only credited on release, if the reads on the connection got a reply.
+        """
+        replica = self._choose()
+        if replica is not None:
+            try:
+                conn = replica['pool'].acquire(timeout)
+            except (LDAPCommunicationError, LDAPResponseTimeoutError, LDAPBindError) as e:
+                self._failed(replica, e)
+                replica = None
+                conn = self._without_replica(e).acquire(timeout)
+            except Exception:
+                self._released(replica)
+                raise
+            conn.result = None
+        else:
+            conn = self._without_replica(None).acquire(timeout)
+        with self._lock:
+            self._owners[id(conn)] = replica
+        return conn
+
+    def _owner(self, conn):
+        with self._lock:
+            replica = self._owners.pop(id(conn), None)
+        return replica, (replica['pool'] if replica else self.fallback)
+
+    def release(self, conn):
+        replica, pool = self._owner(conn)
+        replied = conn.result is not None
+        pool.release(conn)
+        if replica is not None:
+            if replied:
+                self._succeeded(replica)
+            else:
+                self._released(replica)
+
+    def discard(self, conn):
+        replica, pool = self._owner(conn)
+        pool.discard(conn)
+        if replica is not None:
+            self._failed(replica, 'connection discarded')
+
+    def last_success_age(self):
+        ages = [age for age in (pool.last_success_age() for pool in self.pools) if age is not None]
+        return min(ages) if ages else None
+
+    def close(self):
+        for pool in self.pools:
+            pool.close()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                'strategy': self.strategy,
+                'replicas': [{
+                    'uri': replica['pool'].uri,
+                    'admitted': replica['ejected_until'] is None,
+                    'failures': replica['failures'],
+                    'ejected_for': None if replica['ejected_until'] is None else max(0.0, replica['ejected_until'] - now),
+                    'latency_ms': None if replica['pool']._latency is None else 1000 * replica['pool']._latency,
+                } for replica in self._replicas],
+            })
+        return stats
+
+
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def _shared_pool(name, uri=None, **kwargs):
+    """
+    Return the process-wide pool called name to uri, by default LDAP_URI, creating it on first use.
+    A forked worker gets its own pools rather than sharing the parent's sockets.
+    """
+    global _pools_pid
+    pid = os.getpid()
+    pool = _pools.get(name) if _pools_pid == pid else None
+    if pool is None:
+        with _pools_lock:
+            if _pools_pid != pid:
+                _pools.clear()
+                _pools_pid = pid
+            pool = _pools.get(name)
+            if pool is None:
+                pool = _pools[name] = ConnectionPool(
+                    uri or settings.LDAP_URI,
+                    settings.LDAP_USERNAME,
+                    settings.LDAP_PW,
+                    idle_timeout=settings.LDAP_POOL_IDLE_TIMEOUT,
+                    health_check_interval=settings.LDAP_POOL_HEALTH_CHECK_INTERVAL,
+                    acquire_timeout=settings.LDAP_POOL_ACQUIRE_TIMEOUT,
+                    connect_timeout=settings.LDAP_CONNECT_TIMEOUT or None,
+                    receive_timeout=settings.LDAP_RECEIVE_TIMEOUT or None,
+                    **kwargs
+                )
+    return pool
+
+
+def get_pool():
+    return _shared_pool('sync', size=settings.LDAP_POOL_SIZE)
+
+
+def get_async_pool():
+    """Pool of ASYNC connections used to pipeline batch operations"""
+    return _shared_pool('async', size=settings.LDAP_PIPELINE_CONNECTIONS, client_strategy=ASYNC)
+
+
+def get_multiplexed_pool():
+    """Pool of ASYNC connections shared by every coroutine of the async views"""
+    return _shared_pool('multiplexed', size=settings.LDAP_ASYNC_CONNECTIONS, client_strategy=ASYNC)
+
+
+_replica_set = None
+_replica_set_pid = None
+_replica_set_lock = threading.Lock()
+
+
+def get_read_pool():
+    """
+    Pool for searches. With LDAP_READ_URIS set this is a ReplicaSet over the replicas
+    that falls back to the LDAP_URI pool, otherwise it is the LDAP_URI pool itself.
+    """
+    global _replica_set, _replica_set_pid
+    if not settings.LDAP_READ_URIS:
+        return get_pool()
+    pid = os.getpid()
+    if _replica_set is None or _replica_set_pid != pid:
+        with _replica_set_lock:
+            if _replica_set is None or _replica_set_pid != pid:
+                _replica_set = ReplicaSet(
+                    [_shared_pool('read:{}'.format(uri), uri=uri, size=settings.LDAP_POOL_SIZE) for uri in settings.LDAP_READ_URIS],
+                    fallback=get_pool(),
+                    strategy=settings.LDAP_READ_STRATEGY,
+                    max_failures=settings.LDAP_REPLICA_EJECT_FAILURES,
+                    eject_seconds=settings.LDAP_REPLICA_EJECT_SECONDS,
+                )
+                _replica_set_pid = pid
+    return _replica_set
+
+
+def replica_stats():
+    """Stats of this process's ReplicaSet, None without read replicas"""
+    replica_set = _replica_set if _replica_set_pid == os.getpid() else None
+    return replica_set.stats() if replica_set else None
+
+
+def pool_stats():
+    return {name: pool.stats() for name, pool in _pools.items()} if _pools_pid == os.getpid() else {}
+
+
+def _pool_metrics():
+    stats = pool_stats()
+    return [
+        ('exclusionlist_ldap_connections', 'gauge', 'Pooled LDAP connections by pool and state.', [
+            ({'pool': name, 'state': state}, pool[state])
+            for name, pool in sorted(stats.items()) for state in ('idle', 'in_use')
+        ]),
+        ('exclusionlist_ldap_pool_events_total', 'counter', 'LDAP pool events by pool and event.', [
+            ({'pool': name, 'event': event}, pool[event])
+            for name, pool in sorted(stats.items())
+            for event in ('created', 'reused', 'rebinds', 'health_checks', 'discarded', 'waits', 'timeouts')
+        ]),
+    ] + _replica_metrics()
+
+
+def _replica_metrics():
+    stats = replica_stats()
+    if stats is None:
+        return []
+    return [
+        ('exclusionlist_ldap_replica_admitted', 'gauge', 'Whether a read replica is taking reads (1) or ejected (0).', [
+            ({'uri': replica['uri']}, int(replica['admitted'])) for replica in stats['replicas']
+        ]),
+        ('exclusionlist_ldap_replica_events_total', 'counter', 'Read routing events by event.', [
+            ({'event': event}, stats[event]) for event in ('reads', 'fallbacks', 'ejections', 'probes', 'readmissions')
+        ]),
+    ]
+
+
+registry.register_collector(_pool_metrics)
@@ -0,0 +1,153 @@
+"""
+Logging pieces for LOG_ASYNC mode, wired up in settings.LOGGING.
+
+QueueingHandler hands records to a writer thread through a bounded queue and
+drops records when the queue is full, so a slow console never holds up a
+request. Records are formatted on the writer thread, which also means log
+arguments are only turned into strings for records that are written out.
+SampleFilter thins out the log lines of successful requests that repeat a key
+during a flood, so an attack on one key cannot crowd out everything else. This module
+is imported while settings are loaded, so it only uses the standard library.
+"""
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+
+class JSONFormatter(logging.Formatter):
+    """One compact JSON object per line"""
+
+    def format(self, record):
+        line = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+            'thread': record.thread,
+        }
+        if record.exc_info:
+            line['exc'] = self.formatException(record.exc_info)
+        return json.dumps(line, separators=(',', ':'), default=str)
+
+
+def sampled(name, data, field):
+    """
+    extra for the log lines of a request for data[field], SampleFilter samples them per name and key.
+    Views leave it off the lines of requests that did not succeed, so those are always written.
+    """
+    key = data.get(field) if isinstance(data, dict) else None
+    return {'sample_key': (name, str(key).lower())} if key is not None else {}
+
+
+class SampleFilter(logging.Filter):
+    """
+    Lets the first burst records for each sample_key through every window seconds,
+    then one in every. Records without a sample_key, warnings and errors are never sampled.
+    """
+
+    def __init__(self, burst=20, every=100, window=1.0):
+        super().__init__()
+        self.burst = burst
+        self.every = every
+        self.window = window
+        self._keys = {}    # (logger, message template, sample_key) -> [window start, count]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        sample_key = getattr(record, 'sample_key', None)
+        if sample_key is None or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg, sample_key)
+        now = time.monotonic()
+        with self._lock:
+            counts = self._keys.get(key)
+            if counts is None or now - counts[0] >= self.window:
+                if len(self._keys) > 10000:
+                    # Too many keys to track under attack, start over
+                    self._keys.clear()
+                counts = self._keys[key] = [now, 0]
+            counts[1] += 1
+            seen = counts[1]
+        return seen <= self.burst or (self.every > 0 and (seen - self.burst) % self.every == 0)
+
+
+class QueueingHandler(logging.Handler):
+    """
+    Queues records for a writer thread that formats them and writes them to stream.
+    When the queue is full the record is dropped, and the writer reports how many were.
+    """
+
+    def __init__(self, stream=None, max_queue=10000, level=logging.NOTSET):
+        super().__init__(level)
+        self.stream = stream or sys.stderr
+        self.queue = queue.Queue(max_queue)
+        self.dropped = 0
+        self._reported = 0
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _writer(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._start_lock:
+                if self._pid != pid:
+                    # A forked worker needs its own queue and thread
+                    if self._pid is not None:
+                        self.queue = queue.Queue(self.queue.maxsize)
+                        self.dropped = self._reported = 0
+                    self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+                    self._thread.start()
+                    self._pid = pid
+
+    def emit(self, record):
+        self._writer()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self._write(record)
+            if self.queue.empty():
+                self._flush()
+
+    def _write(self, record):
+        try:
+            if self.dropped != self._reported:
+                dropped, self._reported = self.dropped - self._reported, self.dropped
+                self.stream.write(self.format(logging.LogRecord(
+                    __name__, logging.WARNING, __file__, 0,
+                    'Log queue full, dropped %d records', (dropped,), None,
+                )) + '\n')
+            self.stream.write(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+    def _flush(self):
+        try:
+            self.stream.flush()
+        except Exception:    # pragma: no cover
+            pass
+
+    def close(self):
+        """Write out what is queued and stop the writer"""
+        if self._thread is not None and self._pid == os.getpid():
+            try:
+                self.queue.put(None, timeout=5)
+            except queue.Full:    # pragma: no cover
+                pass
+            self._thread.join(timeout=5)
+            self._thread = None
+            self._pid = None
+            self._flush()
+        super().close()
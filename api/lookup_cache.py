@@ -0,0 +1,241 @@
+from django.conf import settings
+from django.core.cache import caches
+
+from collections import OrderedDict
+import copy
+import hashlib
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Returned by LookupCache.get when nothing usable is cached
+MISSING = object()
+
+
+class LookupCache(object):
+    """
+    Bounded, thread-safe LRU cache of exclusion list lookups keyed by (ou, name).
+
+    A value of None records a negative (not_found) result. Each OU has its own
+    TTL and an OU with a TTL of 0 is never cached. Names are compared case
+    insensitively, the same way the directory matches umichExcListName.
+    """
+
+    # Calls never wait on I/O, coroutines can make them on the event loop
+    blocking = False
+
+    def __init__(self, max_size=10000, ttls=None):
+        self.max_size = max_size
+        self.ttls = ttls or {}
+        self._data = OrderedDict()    # (ou, name) -> (expires, value)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._counters = {
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'expirations': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    @staticmethod
+    def _key(ou, name):
+        return (ou, name.lower())
+
+    def enabled(self, ou):
+        return self.ttls.get(ou, 0) > 0
+
+    def get(self, ou, name):
+        key = self._key(ou, name)
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._counters['misses'] += 1
+                return MISSING
+            expires, value = item
+            if expires <= now:
+                del self._data[key]
+                self._counters['expirations'] += 1
+                self._counters['misses'] += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self._counters['negative_hits' if value is None else 'hits'] += 1
+        return copy.deepcopy(value)
+
+    def token(self):
+        """Snapshot to pass to set() so a lookup racing an invalidation is not cached"""
+        return self._generation
+
+    def set(self, ou, name, value, token=None):
+        ttl = self.ttls.get(ou, 0)
+        if ttl <= 0:
+            return
+        key = self._key(ou, name)
+        with self._lock:
+            if token is not None and token != self._generation:
+                return
+            self._data[key] = (time.monotonic() + ttl, copy.deepcopy(value))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def invalidate(self, ou, name):
+        key = self._key(ou, name)
+        with self._lock:
+            self._generation += 1
+            if self._data.pop(key, None) is not None:
+                self._counters['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                'size': len(self._data),
+                'max_size': self.max_size,
+            })
+        return stats
+
+
+class SharedLookupCache(object):
+    """
+    Lookup cache kept in a Django cache, shared by every worker that uses the same one.
+    Same interface as LookupCache.
+
+    Each name has a version, the time it was last invalidated, stored next to its
+    entry. An entry is stored with the token taken before the lookup that produced
+    it and is only served while that is newer than the name's version, so a worker
+    caching a lookup that raced another worker's write never brings the old value
+    back. Failures of the cache itself count as misses, the directory still answers.
+    """
+
+    # Calls are round trips to the cache server, coroutines make them off the event loop
+    blocking = True
+
+    def __init__(self, alias='default', ttls=None):
+        self.alias = alias
+        self.ttls = ttls or {}
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+            'errors': 0,
+        }
+
+    @property
+    def _cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def _keys(ou, name):
+        # Names may hold characters memcached does not allow in keys
+        digest = hashlib.sha1('{}\0{}'.format(ou, name.lower()).encode('utf-8')).hexdigest()
+        return 'exclist:entry:{}'.format(digest), 'exclist:version:{}'.format(digest)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _failed(self, operation):
+        self._count('errors')
+        logger.debug('Shared lookup cache {} failed on {}'.format(operation, self.alias), exc_info=True)
+
+    def enabled(self, ou):
+        return self.ttls.get(ou, 0) > 0
+
+    def get(self, ou, name):
+        if not self.enabled(ou):
+            self._count('misses')
+            return MISSING
+        entry_key, version_key = self._keys(ou, name)
+        try:
+            found = self._cache.get_many([entry_key, version_key])
+        except Exception:
+            self._failed('get')
+            return MISSING
+        entry = found.get(entry_key)
+        if entry is None or entry[0] <= found.get(version_key, 0):
+            self._count('misses')
+            return MISSING
+        self._count('negative_hits' if entry[1] is None else 'hits')
+        # Unpickled fresh on every get, so the caller already has its own copy
+        return entry[1]
+
+    def token(self):
+        """Snapshot to pass to set() so a lookup racing an invalidation is not served"""
+        return time.time()
+
+    def set(self, ou, name, value, token=None):
+        ttl = self.ttls.get(ou, 0)
+        if ttl <= 0:
+            return
+        entry_key, version_key = self._keys(ou, name)
+        try:
+            self._cache.set(entry_key, (time.time() if token is None else token, value), ttl)
+        except Exception:
+            self._failed('set')
+
+    def invalidate(self, ou, name):
+        entry_key, version_key = self._keys(ou, name)
+        try:
+            # The version has to outlive any entry read before it
+            self._cache.set(version_key, time.time(), max(self.ttls.values() or [0]) + 1)
+            self._cache.delete(entry_key)
+        except Exception:
+            self._failed('invalidate')
+            return
+        self._count('invalidations')
+
+    def clear(self):
+        """Clears the whole Django cache, give the lookup cache an alias of its own"""
+        try:
+            self._cache.clear()
+        except Exception:
+            self._failed('clear')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['alias'] = self.alias
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Return the process-wide lookup cache, creating it on first use.
+    With EXC_LIST_SHARED_CACHE set it is kept in that Django cache and shared between workers.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if settings.EXC_LIST_SHARED_CACHE:
+                    _cache = SharedLookupCache(
+                        alias=settings.EXC_LIST_SHARED_CACHE,
+                        ttls=settings.EXC_LIST_CACHE_TTLS,
+                    )
+                else:
+                    _cache = LookupCache(
+                        max_size=settings.EXC_LIST_CACHE_SIZE,
+                        ttls=settings.EXC_LIST_CACHE_TTLS,
+                    )
+    return _cache
+
+
+def cache_stats():
+    return get_cache().stats()
@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...benchmark import run_benchmark, parse_mix, DEFAULT_MIX
+
+import json
+import logging
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark add_key, find_key, delete_key and find_umid through the WSGI app against an '
+        'offline backend. Set LOG_LEVEL=WARNING so console logging does not dominate the numbers.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='Requests to time')
+        parser.add_argument('--concurrency', type=int, default=8, help='Client threads')
+        parser.add_argument('--mix', default=','.join('{}={}'.format(k, v) for k, v in DEFAULT_MIX.items()),
+                            help='Endpoint weights, e.g. add_key=2,find_key=5,delete_key=1,find_umid=2')
+        parser.add_argument('--keys', type=int, default=100, help='Distinct keys to spread requests over')
+        parser.add_argument('--latency-ms', type=float, default=0.0, help='Delay added to every backend call')
+        parser.add_argument('--backend', default='api.backends.MockLDAPBackend', help='Backend class to stand in for LDAP')
+        parser.add_argument('--warmup', type=int, default=100, help='Untimed requests sent first')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the request sequence')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='Earlier results file to compare against')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Percent drop in requests/s or rise in p95 that counts as a regression')
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1')
+
+        # Half the finds are misses, keep their 404 warnings off the console
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        results = run_benchmark(
+            requests=options['requests'],
+            concurrency=options['concurrency'],
+            mix=mix,
+            keys=options['keys'],
+            latency=options['latency_ms'] / 1000,
+            backend=options['backend'],
+            warmup=options['warmup'],
+            seed=options['seed'],
+        )
+
+        self.stdout.write('{:<12} {:>8} {:>7} {:>10} {:>9} {:>9} {:>9} {:>8}'.format(
+            'endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'ops/req'))
+        rows = list(results['endpoints'].items()) + [('total', results['total'])]
+        for name, summary in rows:
+            self.stdout.write('{:<12} {:>8} {:>7} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>8.2f}'.format(
+                name, summary['requests'], summary['errors'], summary['rps'],
+                summary['p50_ms'], summary['p95_ms'], summary['p99_ms'], summary['backend_ops_per_request']))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write('Wrote {}'.format(options['output']))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            self._compare(baseline, results, options['threshold'])
+
+    def _compare(self, baseline, results, threshold):
+        regressions = []
+        for name, summary in list(results['endpoints'].items()) + [('total', results['total'])]:
+            before = baseline['total'] if name == 'total' else baseline['endpoints'].get(name)
+            if not before or not before.get('rps') or not before.get('p95_ms'):
+                continue
+            rps = 100 * (summary['rps'] - before['rps']) / before['rps']
+            p95 = 100 * (summary['p95_ms'] - before['p95_ms']) / before['p95_ms']
+            self.stdout.write('{:<12} req/s {:+.1f}%  p95 {:+.1f}%'.format(name, rps, p95))
+            if rps < -threshold or p95 > threshold:
+                regressions.append(name)
+        if regressions:
+            raise CommandError('Regression beyond {}% in {}'.format(threshold, ', '.join(regressions)))
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...backends import ExcListError
+from ...export import export_lines
+from ...serializers import EXPORT_OUS, EXPORT_MAX_PAGE_SIZE
+
+import gzip
+import sys
+
+
+class Command(BaseCommand):
+    help = (
+        'Write every entry of an exclusion list OU as NDJSON, one entry per line, using a paged search. '
+        'Pass the last cookie line written to --cookie to carry on after an interrupted export.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ou', choices=EXPORT_OUS, default='IDProof', help='OU to export')
+        parser.add_argument('--page-size', type=int, default=settings.EXC_LIST_EXPORT_PAGE_SIZE,
+                            help='Entries per paged search request')
+        parser.add_argument('--cookie', help='Resume after the page this cookie came from')
+        parser.add_argument('--output', help='Write to this file instead of stdout')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output')
+
+    def handle(self, *args, **options):
+        if not 1 <= options['page_size'] <= EXPORT_MAX_PAGE_SIZE:
+            raise CommandError('--page-size must be between 1 and {}'.format(EXPORT_MAX_PAGE_SIZE))
+        try:
+            lines = export_lines(options['ou'], options['page_size'], options['cookie'])
+        except ExcListError as e:
+            raise CommandError('Export failed: {}'.format(e.message))
+
+        if options['output']:
+            out = open(options['output'], 'wb')
+        else:
+            out = sys.stdout.buffer
+        try:
+            if options['gzip']:
+                with gzip.GzipFile(fileobj=out, mode='wb') as compressed:
+                    compressed.writelines(lines)
+            else:
+                out.writelines(lines)
+            out.flush()
+        finally:
+            if options['output']:
+                out.close()
@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...backends import ExcListError
+from ...bulk_import import read_csv, read_ndjson, run_import
+from ...serializers import EXPORT_OUS
+
+import gzip
+import io
+import json
+import sys
+
+
+class Command(BaseCommand):
+    help = (
+        'Bring an exclusion list OU in line with a CSV or NDJSON feed of keys or UMIDs. '
+        'Names the OU lacks are added, and with --delete-missing entries the feed does not list are deleted. '
+        'Use --dry-run to list the changes without making them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('feed', help='CSV or NDJSON file, optionally gzipped, or - for stdin')
+        parser.add_argument('--ou', choices=EXPORT_OUS, default='IDProof', help='OU to import into')
+        parser.add_argument('--format', choices=('csv', 'ndjson'),
+                            help='Feed format, taken from the file name when not given')
+        parser.add_argument('--column', default='0',
+                            help='CSV column, an index or a header name when the first row is a header')
+        parser.add_argument('--delete-missing', action='store_true',
+                            help='Delete entries that are not in the feed')
+        parser.add_argument('--dry-run', action='store_true', help='Show the changes without making them')
+        parser.add_argument('--workers', type=int, default=4, help='Batches applied at once')
+        parser.add_argument('--batch-size', type=int, default=100, help='Names per batch')
+        parser.add_argument('--output', help='Write the report to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be at least 1')
+
+        feed = options['feed']
+        name = feed[:-3] if feed.endswith('.gz') else feed
+        fmt = options['format'] or ('csv' if name.endswith('.csv') else 'ndjson' if name.endswith(('.ndjson', '.jsonl')) else None)
+        if fmt is None:
+            raise CommandError('Cannot tell the format of {}, pass --format'.format(feed))
+
+        if feed == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+        elif feed.endswith('.gz'):
+            stream = gzip.open(feed, 'rt', encoding='utf-8', newline='')
+        else:
+            stream = open(feed, encoding='utf-8', newline='')
+
+        column = int(options['column']) if options['column'].isdigit() else options['column']
+        names = read_csv(stream, column) if fmt == 'csv' else read_ndjson(stream)
+
+        def show(change, name):
+            if options['dry_run'] or options['verbosity'] > 1:
+                self.stdout.write('{} {}'.format('+' if change == 'add' else '-', name))
+
+        try:
+            report = run_import(
+                names,
+                options['ou'],
+                delete_missing=options['delete_missing'],
+                dry_run=options['dry_run'],
+                workers=options['workers'],
+                batch_size=options['batch_size'],
+                on_change=show,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        except ExcListError as e:
+            raise CommandError('Import failed: {}'.format(e.message))
+        finally:
+            if feed != '-':
+                stream.close()
+
+        counts = report['counts']
+        self.stdout.write(
+            '{} read, {} invalid, {} duplicate, {} unchanged, {} to add, {} to delete{}'.format(
+                counts['read'], counts['invalid'], counts['duplicate'], counts['unchanged'],
+                counts['add'], counts['delete'], ' (dry run)' if report['dry_run'] else ''))
+        self.stdout.write('{:.2f}s, {:.1f} names read/s, {:.1f} changes applied/s'.format(
+            report['elapsed'], report['read_per_second'] or 0, report['applied_per_second'] or 0))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write('Wrote {}'.format(options['output']))
+
+        if report['failed']:
+            raise CommandError('{} changes failed: {}'.format(len(report['failed']), ', '.join(report['failed'][:20])))
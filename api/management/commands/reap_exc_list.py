@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...backends import ExcListError
+from ...reaper import reaper_from_settings
+
+import json
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete ou=IDProof entries whose umichExcListTimestamp is older than the retention period, '
+        'at a limited rate. Use --dry-run to count them without deleting.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention', type=int, default=settings.EXC_LIST_REAPER_RETENTION,
+                            help='Age in seconds after which an entry expires')
+        parser.add_argument('--rate', type=float, default=settings.EXC_LIST_REAPER_RATE,
+                            help='Deletes per second, 0 for no limit')
+        parser.add_argument('--workers', type=int, default=settings.EXC_LIST_REAPER_WORKERS,
+                            help='Delete batches in flight at once')
+        parser.add_argument('--limit', type=int, help='Stop after this many expired entries')
+        parser.add_argument('--dry-run', action='store_true', help='Count expired entries without deleting them')
+        parser.add_argument('--output', help='Write the report to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['retention'] < 0 or options['rate'] < 0 or options['workers'] < 1:
+            raise CommandError('--retention and --rate must not be negative and --workers must be at least 1')
+
+        reaper = reaper_from_settings(
+            retention=options['retention'],
+            rate=options['rate'],
+            workers=options['workers'],
+            interval=0,
+        )
+        try:
+            report = reaper.run_once(dry_run=options['dry_run'], limit=options['limit'])
+        except ExcListError as e:
+            raise CommandError('Reaping failed: {}'.format(e.message))
+
+        self.stdout.write('{} expired before {}, {} deleted in {:.2f}s{}'.format(
+            report['found'], report['before'], report['deleted'], report['elapsed'],
+            ' (dry run)' if report['dry_run'] else ''))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write('Wrote {}'.format(options['output']))
+
+        if report['failed']:
+            raise CommandError('{} deletes failed: {}'.format(len(report['failed']), ', '.join(report['failed'][:20])))
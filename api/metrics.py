@@ -0,0 +1,211 @@
+"""
+Request, LDAP and error metrics in the Prometheus text exposition format.
+
+Every thread records into its own shard, so recording takes no lock and never
+waits on another request. A scrape merges the shards; shards of threads that
+have exited are folded into a retired shard so their counts are kept.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+import weakref
+
+# Upper bounds in seconds, from a cached lookup up to an LDAP time limit
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Shard(object):
+
+    def __init__(self, thread=None):
+        self.thread = weakref.ref(thread) if thread else None
+        self.values = {}    # (name, labels) -> number, or [bucket counts..., sum] for histograms
+
+    def alive(self):
+        return self.thread is None or self.thread() is not None
+
+
+class Registry(object):
+    """Holds the metric families and the per-thread shards they record into"""
+
+    def __init__(self):
+        self.families = []
+        self.collectors = []
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard()
+        self._lock = threading.Lock()
+
+    def shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def counter(self, name, help, labelnames=()):
+        family = Counter(self, name, help, labelnames)
+        self.families.append(family)
+        return family
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        family = Histogram(self, name, help, labelnames, buckets)
+        self.families.append(family)
+        return family
+
+    def register_collector(self, collector):
+        """
+        collector() is called on every scrape and returns (name, type, help, samples) tuples,
+        where samples is a list of ({label: value}, value) pairs.
+        """
+        self.collectors.append(collector)
+
+    def _merge(self, into, values):
+        for key, value in list(values.items()):
+            if isinstance(value, list):
+                merged = into.get(key)
+                if merged is None:
+                    into[key] = list(value)
+                else:
+                    for i, count in enumerate(value):
+                        merged[i] += count
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def collect(self):
+        """Returns {(name, labels): value} summed over every thread"""
+        with self._lock:
+            alive = []
+            for shard in self._shards:
+                if shard.alive():
+                    alive.append(shard)
+                else:
+                    self._merge(self._retired.values, shard.values)
+            self._shards = alive
+            totals = {}
+            self._merge(totals, self._retired.values)
+        for shard in alive:
+            self._merge(totals, shard.values)
+        return totals
+
+    def render(self):
+        totals = self.collect()
+        lines = []
+        for family in self.families:
+            lines.extend(family.render(totals))
+        for collector in self.collectors:
+            for name, kind, help, samples in collector():
+                lines.append('# HELP {} {}'.format(name, help))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                for labels, value in samples:
+                    lines.append('{}{} {}'.format(name, _labels(labels.items()), _number(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs):
+    pairs = list(pairs)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+
+    def __init__(self, registry, name, help, labelnames):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, *labels, value=1):
+        values = self.registry.shard().values
+        key = (self.name, labels)
+        values[key] = values.get(key, 0) + value
+
+    def render(self, totals):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} counter'.format(self.name)]
+        for (name, labels), value in sorted(totals.items()):
+            if name == self.name:
+                lines.append('{}{} {}'.format(name, _labels(zip(self.labelnames, labels)), _number(value)))
+        return lines
+
+
+class Histogram(object):
+
+    def __init__(self, registry, name, help, labelnames, buckets):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, seconds, *labels):
+        values = self.registry.shard().values
+        key = (self.name, labels)
+        counts = values.get(key)
+        if counts is None:
+            # One count per bucket, one for +Inf, then the sum
+            counts = values[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, seconds)] += 1
+        counts[-1] += seconds
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self, totals):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        for (name, labels), counts in sorted(totals.items()):
+            if name != self.name:
+                continue
+            pairs = list(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(name, _labels(pairs + [('le', _number(bound))]), cumulative))
+            lines.append('{}_sum{} {}'.format(name, _labels(pairs), _number(counts[-1])))
+            lines.append('{}_count{} {}'.format(name, _labels(pairs), cumulative))
+        return lines
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    'exclusionlist_http_requests_total',
+    'HTTP requests by endpoint, method and status code.',
+    ('endpoint', 'method', 'status'),
+)
+http_duration = registry.histogram(
+    'exclusionlist_http_request_duration_seconds',
+    'Time spent handling a request, by endpoint.',
+    ('endpoint',),
+)
+ldap_duration = registry.histogram(
+    'exclusionlist_ldap_operation_duration_seconds',
+    'LDAP round trips by operation: bind, search, modify, add or delete.',
+    ('operation',),
+)
+errors = registry.counter(
+    'exclusionlist_errors_total',
+    'Errors returned by the API, by ExcListError message or unexpected.',
+    ('message',),
+)
+
+
+def count_error(e):
+    errors.inc(getattr(e, 'message', None) or 'unexpected')
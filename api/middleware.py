@@ -0,0 +1,43 @@
+from .metrics import http_requests, http_duration
+
+import asyncio
+import time
+
+# Anything else is counted as 'other' so odd methods cannot grow the label set
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+
+class MetricsMiddleware(object):
+    """
+    Counts and times every request by the URL name it resolved to.
+    Runs natively for both the sync and async views, so it never adds a thread hop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Tell Django this middleware is a coroutine function when the chain is async
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self._record(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, start)
+        return response
+
+    def _record(self, request, response, start):
+        match = getattr(request, 'resolver_match', None)
+        endpoint = match.url_name if match and match.url_name else 'unmatched'
+        http_duration.observe(time.perf_counter() - start, endpoint)
+        method = request.method if request.method in METHODS else 'other'
+        http_requests.inc(endpoint, method, str(response.status_code))
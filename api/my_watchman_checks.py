@@ -1,37 +1,91 @@
 from django.conf import settings
 from watchman.decorators import check
 
-from ldap3 import Server, Connection
+from .backends import get_backend
+from .circuit_breaker import get_breaker
+from .ldap_pool import replica_stats
+import threading
+import time
 import traceback
 
+# (monotonic time of the check, response) of the last check in this process
+_last_check = None
+_check_lock = threading.Lock()
+
+
 @check
 def ldap():
     """
     Custom watchman check to make sure we can contact the ldap server
+    The result is cached for LDAP_HEALTH_CHECK_TTL seconds and only one probe runs at a time,
+    other callers get the previous result while it does.
     """
+    global _last_check
+    last_check = _last_check
+    if last_check and time.monotonic() - last_check[0] < settings.LDAP_HEALTH_CHECK_TTL:
+        return {
+            'ldap': _cached(last_check),
+        }
 
+    if not _check_lock.acquire(blocking=last_check is None):
+        return {
+            'ldap': _cached(last_check),
+        }
+    try:
+        response = _check()
+        _last_check = (time.monotonic(), response)
+    finally:
+        _check_lock.release()
+
+    return {
+        'ldap': response,
+    }
+
+
+def _cached(last_check):
+    return dict(last_check[1], cached_for=round(time.monotonic() - last_check[0], 3))
+
+
+def _check():
+    backend = get_backend()
+    pool = backend.pool
     response = {
         'ok': True,
+        'backend': type(backend).__name__,
+        'breaker': get_breaker().state,
     }
 
     try:
-        # Just test the connection
-        server = Server(settings.LDAP_URI)
-        conn = Connection(
-            server,
-            settings.LDAP_USERNAME,
-            settings.LDAP_PW,
-            auto_bind=True,
-        )
-        conn.unbind()
-    except Exception as e:    # pragma: no cover
+        age = pool.last_success_age() if pool else None
+        if age is not None and age < settings.LDAP_HEALTH_CHECK_TTL:
+            # Requests are getting through, no need to add a probe of our own
+            response['checked'] = 'recent_traffic'
+        else:
+            # Probe on a pooled connection rather than binding a new one
+            start = time.perf_counter()
+            backend.ping()
+            response['checked'] = 'probe'
+            response['probe_ms'] = round(1000 * (time.perf_counter() - start), 3)
+        if pool:
+            stats = pool.stats()
+            response.update({
+                'pool_size': stats['size'],
+                'pool_in_use': stats['in_use'],
+                'pool_idle': stats['idle'],
+                'last_success_age': stats['last_success_age'],
+                'latency_ms': stats['latency_ms'],
+            })
+        replicas = replica_stats()
+        if replicas:
+            # Reads fall back to the master, so an ejected replica does not fail the check
+            response['replicas_admitted'] = sum(replica['admitted'] for replica in replicas['replicas'])
+            response['replicas'] = len(replicas['replicas'])
+    except Exception as e:
         response = {
             'ok': False,
+            'backend': type(backend).__name__,
             'error': str(e),
             'stacktrace': traceback.format_exc(),
         }
 
-
-    return {
-        'ldap': response,
-    }
+    return response
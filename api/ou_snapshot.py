@@ -0,0 +1,185 @@
+from django.conf import settings
+from ldap3 import SUBTREE
+from .backends import get_backend, exc_list_base
+
+import copy
+import os
+import threading
+import time
+import traceback
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class OUSnapshot(object):
+    """
+    In-memory replica of one exclusion list OU.
+
+    A background thread loads the whole OU with a paged search, then pulls
+    entries changed since the newest modifyTimestamp it has seen. Deletes do
+    not show up in a modifyTimestamp search, so the OU is reloaded in full
+    every full_reload_interval seconds.
+    """
+
+    def __init__(self, ou, pool, refresh_interval=60, full_reload_interval=900,
+                 max_staleness=300, page_size=500):
+        self.ou = ou
+        self.base = exc_list_base(ou)
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self.max_staleness = max_staleness
+        self.page_size = page_size
+
+        self._entries = {}    # lowercased umichExcListName -> attributes
+        self._lock = threading.Lock()
+        self._high_water = None    # newest modifyTimestamp seen, as returned by the server
+        self._last_sync = None
+        self._last_full_load = None
+        self._loaded = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _fetch(self, search_filter, high_water=None):
+        """Run a paged search and return {name: attributes} plus the newest modifyTimestamp"""
+        def search(conn):
+            entries = {}
+            newest = high_water
+            results = conn.extend.standard.paged_search(
+                self.base,
+                search_filter,
+                search_scope=SUBTREE,
+                attributes=['*', 'modifyTimestamp'],
+                paged_size=self.page_size,
+                time_limit=settings.LDAP_TIME_LIMIT,
+                generator=True,
+            )
+            for result in results:
+                if result['type'] != 'searchResEntry':
+                    continue
+                raw = result['raw_attributes']
+                if raw.get('modifyTimestamp'):
+                    stamp = raw['modifyTimestamp'][0].decode('utf-8')
+                    if newest is None or stamp > newest:
+                        newest = stamp
+                attrs = {}
+                for name, values in result['attributes'].items():
+                    if name == 'modifyTimestamp':
+                        continue
+                    attrs[name] = values if isinstance(values, list) else [values]
+                if attrs.get('umichExcListName'):
+                    entries[str(attrs['umichExcListName'][0]).lower()] = attrs
+            return entries, newest
+
+        return self.pool.run(search)
+
+    def load(self):
+        start = time.monotonic()
+        entries, high_water = self._fetch('(umichExcListName=*)')
+        with self._lock:
+            self._entries = entries
+            self._high_water = high_water
+            self._last_sync = self._last_full_load = time.monotonic()
+        self._loaded.set()
+        logger.info('Loaded {} entries from ou={} in {:.3f}s'.format(
+            len(entries), self.ou, time.monotonic() - start))
+
+    def refresh(self):
+        if self._high_water is None:
+            return self.load()
+        entries, high_water = self._fetch(
+            '(&(umichExcListName=*)(modifyTimestamp>={}))'.format(self._high_water),
+            self._high_water,
+        )
+        with self._lock:
+            self._entries.update(entries)
+            self._high_water = high_water
+            self._last_sync = time.monotonic()
+        logger.debug('Refreshed {} entries from ou={}'.format(len(entries), self.ou))
+
+    def sync(self):
+        """Full load when due, otherwise an incremental refresh"""
+        if self._last_full_load is None or \
+                time.monotonic() - self._last_full_load >= self.full_reload_interval:
+            self.load()
+        else:
+            self.refresh()
+
+    def wait_loaded(self, timeout=None):
+        """Block until the first full load is done, returns False on timeout"""
+        return self._loaded.wait(timeout)
+
+    def put(self, name, attrs):
+        """Keep an entry this process just wrote, so it is served before the next refresh"""
+        attrs = copy.deepcopy(attrs)
+        with self._lock:
+            self._entries[name.lower()] = attrs
+
+    def discard(self, name):
+        with self._lock:
+            self._entries.pop(name.lower(), None)
+
+    def fresh(self):
+        last_sync = self._last_sync
+        return last_sync is not None and time.monotonic() - last_sync <= self.max_staleness
+
+    def get(self, name):
+        attrs = self._entries.get(name.lower())
+        return copy.deepcopy(attrs)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync()
+            except Exception:
+                logger.error('Snapshot sync of ou={} failed\n{}'.format(self.ou, traceback.format_exc()))
+            self._stop.wait(self.refresh_interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='snapshot-{}'.format(self.ou), daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        last_sync = self._last_sync
+        return {
+            'ou': self.ou,
+            'entries': len(self._entries),
+            'fresh': self.fresh(),
+            'age': None if last_sync is None else time.monotonic() - last_sync,
+            'high_water': self._high_water,
+        }
+
+
+_snapshot = None
+_snapshot_pid = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot():
+    """
+    Return the Admin OU snapshot for this process, starting its loader on first use.
+    Returns None when EXC_LIST_SNAPSHOT_ENABLED is off or the backend has no directory to copy.
+    """
+    global _snapshot, _snapshot_pid
+    if not settings.EXC_LIST_SNAPSHOT_ENABLED or get_backend().pool is None:
+        return None
+    pid = os.getpid()
+    if _snapshot is None or _snapshot_pid != pid:
+        with _snapshot_lock:
+            if _snapshot is None or _snapshot_pid != pid:
+                _snapshot = OUSnapshot(
+                    'Admin',
+                    get_backend().read_pool,
+                    refresh_interval=settings.EXC_LIST_SNAPSHOT_REFRESH_INTERVAL,
+                    full_reload_interval=settings.EXC_LIST_SNAPSHOT_FULL_RELOAD_INTERVAL,
+                    max_staleness=settings.EXC_LIST_SNAPSHOT_MAX_STALENESS,
+                    page_size=settings.EXC_LIST_SNAPSHOT_PAGE_SIZE,
+                )
+                _snapshot.start()
+                _snapshot_pid = pid
+    return _snapshot
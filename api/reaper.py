@@ -0,0 +1,216 @@
+"""
+Expiry of stale brute-force entries.
+
+Entries whose umichExcListTimestamp is older than the retention period are
+found with a server-side filter over a paged search and deleted in batches
+from a few worker threads. A token bucket caps deletes per second, so a large
+backlog drains steadily instead of competing with login traffic. The reaper
+runs from the reap_exc_list command, from cron for instance, or every
+EXC_LIST_REAPER_INTERVAL seconds in a background thread of the serving
+processes. Every process runs that thread but only the one holding the lease
+reaps: each interval the threads race to add a lock key to the
+EXC_LIST_REAPER_LEASE cache with the interval as its timeout, and the losers
+skip the round. The lease only elects one reaper if that cache is shared
+between the workers; with a per-process cache leave the interval at 0 and run
+the command from cron instead.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from .backends import get_backend
+from .exc_list_manager import exc_list_delete_keys
+from .metrics import registry
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Admin holds manual lockouts, which never expire
+REAPABLE_OUS = ('IDProof',)
+
+reaped = registry.counter(
+    'exclusionlist_reaped_entries_total',
+    'Expired entries deleted by the reaper, by OU.',
+    ('ou',),
+)
+
+
+class RateLimiter(object):
+    """Token bucket handing out up to rate tokens a second, with a burst of one second's worth"""
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self._tokens = self.rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n=1):
+        """Block until n tokens are available and take them"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= n
+            # Going into debt keeps the lock short, the caller sleeps the debt off
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+class Reaper(object):
+
+    def __init__(self, ou='IDProof', retention=2592000, rate=50, workers=2, page_size=500, interval=0, lease=None):
+        if ou not in REAPABLE_OUS:
+            raise ValueError('Entries in ou={} do not expire'.format(ou))
+        self.ou = ou
+        self.retention = retention
+        self.rate = rate
+        self.workers = workers
+        self.page_size = page_size
+        self.interval = interval
+        self.lease = lease
+
+        self._owner = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self._last_run = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self, dry_run=False, limit=None):
+        """
+        Delete entries older than the retention period, at most limit of them.
+        With dry_run only count them. Returns the counts and timings.
+        """
+        start = time.monotonic()
+        before = time.gmtime(time.time() - self.retention)
+        batch_size = max(1, min(self.page_size, int(self.rate) or self.page_size))
+        limiter = RateLimiter(self.rate)
+        found = deleted = 0
+        failed = []
+
+        def delete(batch):
+            results, elapsed = exc_list_delete_keys(batch, self.ou)
+            done = [name for name, result in results.items() if result['message'] in ('success', 'noSuchObject')]
+            reaped.inc(self.ou, value=len(done))
+            return len(done), [name for name in batch if name not in done]
+
+        def finished(futures):
+            nonlocal deleted
+            for future in futures:
+                count, failures = future.result()
+                deleted += count
+                failed.extend(failures)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='reaper') as executor:
+            in_flight = set()
+            for names in get_backend().expired(self.ou, before, self.page_size):
+                if limit is not None:
+                    names = names[:max(0, limit - found)]
+                found += len(names)
+                if not dry_run:
+                    for i in range(0, len(names), batch_size):
+                        batch = names[i:i + batch_size]
+                        limiter.acquire(len(batch))
+                        if len(in_flight) >= 2 * self.workers:
+                            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                            finished(done)
+                        in_flight.add(executor.submit(delete, batch))
+                if limit is not None and found >= limit:
+                    break
+            finished(in_flight)
+
+        self._last_run = time.monotonic()
+        elapsed = self._last_run - start
+        logger.info('Reaped {} of {} expired entries from ou={} in {:.3f}s'.format(deleted, found, self.ou, elapsed))
+        return {
+            'ou': self.ou,
+            'before': time.strftime('%Y%m%d%H%M%SZ', before),
+            'dry_run': dry_run,
+            'found': found,
+            'deleted': deleted,
+            'failed': sorted(failed),
+            'elapsed': elapsed,
+            'deleted_per_second': deleted / elapsed if elapsed else None,
+        }
+
+    def run_if_leader(self):
+        """
+        Reap if this process takes the lease for the next interval, returns the report
+        of run_once or None when another process holds it. Without a lease cache it always reaps.
+        """
+        if self.lease:
+            key = 'reaper:{}'.format(self.ou)
+            if not caches[self.lease].add(key, self._owner, timeout=self.interval):
+                logger.debug('Reaper lease for ou={} held by {}'.format(self.ou, caches[self.lease].get(key)))
+                return None
+        return self.run_once()
+
+    def _run(self):
+        # Workers started together should not all reap at the same moment
+        self._stop.wait(random.uniform(0, self.interval))
+        while not self._stop.is_set():
+            try:
+                self.run_if_leader()
+            except Exception:
+                logger.error('Reaping ou={} failed\n{}'.format(self.ou, traceback.format_exc()))
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='reaper-{}'.format(self.ou), daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        last_run = self._last_run
+        return {
+            'ou': self.ou,
+            'retention': self.retention,
+            'last_run_age': None if last_run is None else time.monotonic() - last_run,
+        }
+
+
+def reaper_from_settings(**overrides):
+    options = {
+        'retention': settings.EXC_LIST_REAPER_RETENTION,
+        'rate': settings.EXC_LIST_REAPER_RATE,
+        'workers': settings.EXC_LIST_REAPER_WORKERS,
+        'page_size': settings.EXC_LIST_EXPORT_PAGE_SIZE,
+        'interval': settings.EXC_LIST_REAPER_INTERVAL,
+        'lease': settings.EXC_LIST_REAPER_LEASE,
+    }
+    options.update(overrides)
+    return Reaper('IDProof', **options)
+
+
+_reaper = None
+_reaper_pid = None
+_reaper_lock = threading.Lock()
+
+
+def start_reaper(**kwargs):
+    """
+    Start the periodic reaper in this process once, if EXC_LIST_REAPER_INTERVAL is set.
+    Connected to request_started, so it only runs in processes that serve requests.
+    """
+    global _reaper, _reaper_pid
+    if settings.EXC_LIST_REAPER_INTERVAL <= 0:
+        return None
+    pid = os.getpid()
+    if _reaper is None or _reaper_pid != pid:
+        with _reaper_lock:
+            if _reaper is None or _reaper_pid != pid:
+                _reaper = reaper_from_settings()
+                _reaper.start()
+                _reaper_pid = pid
+    return _reaper
@@ -1,14 +1,83 @@
+from django.conf import settings
 from rest_framework import serializers
 from django.core.validators import RegexValidator
+import re
 
+# Shared with the fast path views, which check plain requests without a serializer
+UMID = re.compile(r'^\d{8,8}$')
+ATTRIBUTE_NAME = re.compile(r'^[A-Za-z][A-Za-z0-9-]*$')
+FORMATS = ('full', 'compact')
+EXPORT_OUS = ('IDProof', 'Admin')
+EXPORT_MAX_PAGE_SIZE = 5000
 
-class ExcListUMIDSerializer(serializers.Serializer):
+
+def split_fields(value):
+    """Split repeated and comma separated attribute names, returns None if any name is invalid"""
+    names = [name.strip() for item in value for name in item.split(',') if name.strip()]
+    if not all(ATTRIBUTE_NAME.match(name) for name in names):
+        return None
+    return names
+
+
+class ExcListResultSerializer(serializers.Serializer):
+    """
+    Optional shaping of the entries returned by the find and add endpoints.
+    fields limits the attributes fetched and returned, as repeated values or comma separated.
+    format=compact flattens single values and returns counters as integers.
+    """
+    fields = serializers.ListField(child=serializers.CharField(), required=False)
+    format = serializers.ChoiceField(choices=FORMATS, default='full')
+
+    def validate_fields(self, value):
+        names = split_fields(value)
+        if names is None:
+            raise serializers.ValidationError('Enter a valid attribute name.')
+        return names or None
+
+
+class ExcListUMIDSerializer(ExcListResultSerializer):
     umid = serializers.CharField(
         required=True,
-        validators=[RegexValidator(r'^\d{8,8}$', 'Enter a valid UMID.')],
+        validators=[RegexValidator(UMID, 'Enter a valid UMID.')],
     )
 
 
-class ExcListKeySerializer(serializers.Serializer):
+class ExcListKeySerializer(ExcListResultSerializer):
     key = serializers.CharField(required=True)
 
+
+class ExcListKeysSerializer(ExcListResultSerializer):
+    keys = serializers.ListField(child=serializers.CharField(), required=True)
+
+    def validate_keys(self, value):
+        if not value:
+            raise serializers.ValidationError('Enter at least one key.')
+        if len(value) > settings.EXC_LIST_BATCH_MAX_KEYS:
+            raise serializers.ValidationError(
+                'Enter at most {} keys.'.format(settings.EXC_LIST_BATCH_MAX_KEYS))
+        return value
+
+
+class ExcListCheckSerializer(ExcListResultSerializer):
+    umid = serializers.CharField(
+        required=False,
+        validators=[RegexValidator(UMID, 'Enter a valid UMID.')],
+    )
+    keys = serializers.ListField(child=serializers.CharField(), required=False)
+
+    def validate_keys(self, value):
+        if len(value) > settings.EXC_LIST_BATCH_MAX_KEYS:
+            raise serializers.ValidationError(
+                'Enter at most {} keys.'.format(settings.EXC_LIST_BATCH_MAX_KEYS))
+        return value
+
+    def validate(self, data):
+        if not data.get('umid') and not data.get('keys'):
+            raise serializers.ValidationError('Enter a UMID or at least one key.')
+        return data
+
+
+class ExcListExportSerializer(serializers.Serializer):
+    ou = serializers.ChoiceField(choices=EXPORT_OUS, default='IDProof')
+    page_size = serializers.IntegerField(min_value=1, max_value=EXPORT_MAX_PAGE_SIZE, required=False)
+    cookie = serializers.CharField(required=False)
@@ -0,0 +1,143 @@
+"""
+Single-flight coalescing of identical lookups.
+
+While a search for a name is in flight, other callers asking for the same name
+wait for it and share its result or exception instead of sending their own, so
+N concurrent lookups of a key under attack cost one directory search. Nothing
+is kept once the search returns, so unlike a cache this never serves an answer
+older than the round trip the caller waited on. A write forgets the search in
+flight for its key, so callers arriving after the write start a fresh one.
+"""
+from django.conf import settings
+
+from .metrics import registry
+
+import asyncio
+import copy
+import os
+import threading
+
+coalesced = registry.counter(
+    'exclusionlist_single_flight_total',
+    'Lookups that went to the backend (leader) or shared a lookup already in flight (shared).',
+    ('outcome',),
+)
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Calls in flight, keyed by key. tag tells apart calls for the same key that
+    cannot stand in for each other, such as searches for different attributes;
+    a caller whose tag differs from the call in flight makes its own call.
+    """
+
+    def __init__(self):
+        self._calls = {}    # key -> (tag, _Call or asyncio.Task)
+        self._lock = threading.Lock()
+        self._counters = {
+            'leaders': 0,
+            'shared': 0,
+        }
+
+    def _join(self, key, tag, new, compatible):
+        """Returns the call to wait on and whether this caller makes it"""
+        with self._lock:
+            current = self._calls.get(key)
+            if current is not None and current[0] == tag and compatible(current[1]):
+                self._counters['shared'] += 1
+                coalesced.inc('shared')
+                return current[1], False
+            call = new()
+            if current is None:
+                self._calls[key] = (tag, call)
+            self._counters['leaders'] += 1
+            coalesced.inc('leader')
+            return call, True
+
+    def _finish(self, key, call):
+        with self._lock:
+            current = self._calls.get(key)
+            if current is not None and current[1] is call:
+                del self._calls[key]
+
+    def do(self, key, fn, tag=None):
+        """Return fn(), or what the call of fn for key already in flight in another thread returns"""
+        call, leader = self._join(key, tag, _Call, lambda call: isinstance(call, _Call))
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            # Every waiter gets its own copy to change
+            return copy.deepcopy(call.result)
+
+        try:
+            result = fn()
+            # The waiters copy the result once it is set, after the leader may have changed its own
+            call.result = copy.deepcopy(result)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(key, call)
+            call.done.set()
+        return result
+
+    async def do_async(self, key, fn, tag=None):
+        """await fn(), or share the await of fn for key already in flight on this event loop"""
+        loop = asyncio.get_running_loop()
+        task, leader = self._join(
+            key, tag, lambda: loop.create_task(fn()), lambda call: isinstance(call, asyncio.Task) and call.get_loop() is loop,
+        )
+        if leader:
+            task.add_done_callback(lambda task: self._done(key, task))
+        # The search runs as its own task, so a caller that goes away does not cancel it for the others
+        result = await asyncio.shield(task)
+        # Every caller gets its own copy, the task result is left as it came back for those still waiting
+        return copy.deepcopy(result)
+
+    def _done(self, key, task):
+        self._finish(key, task)
+        if not task.cancelled():
+            # Retrieved here in case every caller went away before it finished
+            task.exception()
+
+    def forget(self, key):
+        """Callers for key from now on start a new call rather than join the one in flight"""
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+
+_flights = None
+_flights_pid = None
+_flights_lock = threading.Lock()
+
+
+def get_flights():
+    """
+    Return the process-wide single-flight table, or None when EXC_LIST_SINGLE_FLIGHT is off.
+    A forked worker gets its own, it cannot wait on a thread of its parent's.
+    """
+    global _flights, _flights_pid
+    if not settings.EXC_LIST_SINGLE_FLIGHT:
+        return None
+    pid = os.getpid()
+    if _flights is None or _flights_pid != pid:
+        with _flights_lock:
+            if _flights is None or _flights_pid != pid:
+                _flights = SingleFlight()
+                _flights_pid = pid
+    return _flights
@@ -0,0 +1,129 @@
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from .. import async_exc_list_manager as manager, circuit_breaker, lookup_cache
+from ..backends import MemoryBackend, set_backend
+from ..circuit_breaker import CircuitBreaker, ExcListUnavailable
+from ..exc_list_manager import ExcListError
+from ..lookup_cache import SharedLookupCache
+
+import asyncio
+import os
+import threading
+import time
+import logging
+
+
+class AsyncExcListTests(SimpleTestCase):
+
+    # Disable logging
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    # Reenable logging
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    # Test finds on umid
+    async def test_find_umid(self):
+        umid = '00133700'
+
+        # Find an existing entry
+        entry = await manager.exc_list_find_umid(umid)
+        self.assertEqual(entry['umichExcListName'][0], umid)
+
+        # Find a non-existent entry
+        with self.assertRaises(ExcListError) as context:
+            await manager.exc_list_find_umid('00111100')
+        self.assertEqual(context.exception.message, 'not_found')
+
+    # Test concurrent adds share the multiplexed connections
+    async def test_add_key_concurrent(self):
+        key = 'add-me-asynchronously'
+
+        # Start with nothing
+        await manager.exc_list_delete_key(key)
+
+        await asyncio.gather(*[manager.exc_list_add_key(key) for i in range(10)])
+        entry = await manager.exc_list_find_key(key)
+        self.assertEqual(entry['umichExcListBadAttempts'][0], '10')
+
+        # Delete the entry
+        response = await manager.exc_list_delete_key(key)
+        self.assertEqual(response['message'], 'success')
+
+        with self.assertRaises(ExcListError) as context:
+            await manager.exc_list_find_key(key)
+        self.assertEqual(context.exception.message, 'not_found')
+
+
+class AsyncOffLoopTests(SimpleTestCase):
+
+    # Disable logging, use an in-memory backend that records the threads it is called on,
+    # a shared lookup cache and a breaker of its own
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.backend = MemoryBackend(settings.EXC_LIST_BACKEND_LDIF)
+        self.threads = []
+        search = self.backend.search
+
+        def recorded(name, ou, attributes=None):
+            self.threads.append(threading.get_ident())
+            return search(name, ou, attributes)
+
+        self.backend.search = recorded
+        self.previous = set_backend(self.backend)
+        self.breaker = CircuitBreaker(max_in_flight=1, in_flight_wait=5)
+        circuit_breaker._breaker = self.breaker
+        circuit_breaker._breaker_pid = os.getpid()
+        circuit_breaker._breaker_backend = self.backend
+        self.cache = SharedLookupCache('exclist', ttls={'Admin': 300, 'IDProof': 5})
+        self.cache.clear()
+        cache_get = self.cache.get
+
+        def cache_recorded(ou, name):
+            self.threads.append(threading.get_ident())
+            return cache_get(ou, name)
+
+        self.cache.get = cache_recorded
+        self.previous_cache, lookup_cache._cache = lookup_cache._cache, self.cache
+
+    # Reenable logging and put the backend and cache back, the backend gets a breaker of its own again
+    def tearDown(self):
+        lookup_cache._cache = self.previous_cache
+        self.cache.clear()
+        set_backend(self.previous)
+        logging.disable(logging.NOTSET)
+
+    # Test the shared cache and a backend without multiplexed connections are called off the loop
+    async def test_off_loop(self):
+        self.backend.increment('off-loop-key', 'IDProof')
+        entry = await manager.exc_list_find_key('off-loop-key')
+        self.assertEqual(entry['umichExcListBadAttempts'], ['1'])
+        self.assertEqual(len(self.threads), 2)
+        self.assertNotIn(threading.get_ident(), self.threads)
+
+        response = await manager.exc_list_delete_key('off-loop-key')
+        self.assertEqual(response['message'], 'success')
+        self.assertIsNone(self.backend.search('off-loop-key', 'IDProof'))
+
+    # Test a delete finding every in-flight slot taken is turned away at once, not after in_flight_wait
+    async def test_delete_does_not_wait(self):
+        held, release = threading.Event(), threading.Event()
+
+        def hold():
+            with self.breaker.guard():
+                held.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        try:
+            held.wait(5)
+            start = time.monotonic()
+            with self.assertRaises(ExcListUnavailable):
+                await manager.exc_list_delete_key('off-loop-key')
+            self.assertLess(time.monotonic() - start, 1)
+        finally:
+            release.set()
+            thread.join()
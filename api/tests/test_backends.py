@@ -0,0 +1,140 @@
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from ldap3 import Connection
+from ldap3.core.exceptions import LDAPSocketReceiveError
+
+from ..backends import ExcListBackend, MemoryBackend, MockLDAPBackend, read_ldif
+
+from unittest import mock
+import time
+import logging
+
+
+class MemoryBackendTests(SimpleTestCase):
+
+    # Disable logging and load the fixture
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.backend = MemoryBackend(settings.EXC_LIST_BACKEND_LDIF)
+
+    # Reenable logging
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    # Test the fixture is parsed and only exclusion list entries are loaded
+    def test_seed(self):
+        dns = [dn for dn, attrs in read_ldif(settings.EXC_LIST_BACKEND_LDIF)]
+        self.assertIn('ou=Admin,ou=ExclusionList,dc=umich,dc=edu', dns)
+
+        entry = self.backend.search('00133700', 'Admin')
+        self.assertEqual(entry['umichExcListManualLockout'][0], 'TRUE')
+        self.assertIsNone(self.backend.search('00133700', 'IDProof'))
+
+    # Test create, increment and delete of a key
+    def test_increment_delete(self):
+        key = 'this-is-a-Memory-test'
+        self.assertEqual(self.backend.increment(key, 'IDProof'),
+                         {'dn': 'umichExcListName={},ou=IDProof,ou=ExclusionList,dc=umich,dc=edu'.format(key)})
+        entry = self.backend.increment(key.upper(), 'IDProof', delta=2)
+        self.assertEqual(entry['umichExcListName'][0], key)
+        self.assertEqual(entry['umichExcListBadAttempts'][0], '3')
+
+        self.assertEqual(list(self.backend.search_many([key.upper(), 'missing'], 'IDProof')), [key.lower()])
+        self.assertEqual(self.backend.delete(key, 'IDProof'), 'success')
+        self.assertEqual(self.backend.delete(key, 'IDProof'), 'noSuchObject')
+
+    # Test results handed out are copies
+    def test_copies(self):
+        entry = self.backend.search('00133700', 'Admin')
+        entry['umichExcListManualLockout'] = ['FALSE']
+        self.assertEqual(self.backend.search('00133700', 'Admin')['umichExcListManualLockout'][0], 'TRUE')
+
+
+@override_settings(LDAP_USERNAME='cn=admin,dc=umich,dc=edu', LDAP_PW='secret')
+class MockLDAPBackendTests(SimpleTestCase):
+
+    # Disable logging and seed the mock directory
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.backend = MockLDAPBackend(settings.EXC_LIST_BACKEND_LDIF)
+
+    # Reenable logging
+    def tearDown(self):
+        for pool in (self.backend.pool, self.backend.async_pool, self.backend.multiplexed_pool):
+            pool.close()
+        logging.disable(logging.NOTSET)
+
+    # Test the fixture entries are searchable
+    def test_search(self):
+        entry = self.backend.search('00133700', 'Admin')
+        self.assertEqual(entry['umichExcListManualLockout'][0], 'TRUE')
+        self.assertIsNone(self.backend.search('00111100', 'Admin'))
+
+    # Test filter characters in a name are matched literally
+    def test_search_escaped(self):
+        self.assertIsNone(self.backend.search('0013370*', 'Admin'))
+        self.assertIsNone(self.backend.search('00133700)(umichExcListName=*', 'Admin'))
+
+    # Test searches fetch only the attributes asked for
+    def test_search_attributes(self):
+        entry = self.backend.search('00133700', 'Admin', ['umichExcListManualLockout'])
+        self.assertEqual(list(entry), ['umichExcListManualLockout'])
+        entries = self.backend.search_many(['00133700'], 'Admin', ['umichExcListName'])
+        self.assertEqual(list(entries['00133700']), ['umichExcListName'])
+
+    # Test one subtree search answers for each OU only the names asked of it
+    def test_search_ous(self):
+        self.backend.increment('00133700', 'IDProof')
+        self.backend.increment('ous-Mock-key', 'IDProof')
+        names = [('Admin', '00133700'), ('IDProof', 'OUS-mock-key'), ('IDProof', 'ous-missing')]
+        found = self.backend.search_ous(names)
+        self.assertEqual(sorted(found), [('Admin', '00133700'), ('IDProof', 'ous-mock-key')])
+        self.assertEqual(found[('Admin', '00133700')]['umichExcListName'], ['00133700'])
+        self.assertEqual(found, ExcListBackend.search_ous(self.backend, names))
+
+    # Test a paged export walks the whole OU
+    def test_export(self):
+        keys = ['export-Mock-test-{}'.format(n) for n in range(3)]
+        self.backend.increment_many(keys, 'IDProof')
+        pages = list(self.backend.export('IDProof', page_size=2))
+        self.assertIsNotNone(pages[0][1])
+        self.assertIsNone(pages[-1][1])
+        names = [attrs['umichExcListName'][0] for entries, cookie in pages for dn, attrs in entries]
+        self.assertEqual(sorted(names), keys)
+        self.assertEqual(self.backend.pool.stats()['in_use'], 0)
+        self.backend.delete_many(keys, 'IDProof')
+
+    # Test expired entries are found with a timestamp filter
+    def test_expired(self):
+        self.assertEqual(list(self.backend.expired('Admin', time.gmtime())), [['00133700']])
+        self.assertEqual(list(self.backend.expired('Admin', time.gmtime(0))), [[]])
+
+    # Test single and pipelined increments
+    def test_increment(self):
+        key = 'this-is-a-Mock-test'
+        self.assertIn('dn', self.backend.increment(key, 'IDProof'))
+        self.assertEqual(self.backend.increment(key, 'IDProof')['umichExcListBadAttempts'][0], '2')
+
+        results = self.backend.increment_many([key, 'another-Mock-test'], 'IDProof')
+        self.assertEqual(results[key]['umichExcListBadAttempts'][0], '3')
+        self.assertIn('dn', results['another-Mock-test'])
+
+        results = self.backend.delete_many([key, 'another-Mock-test'], 'IDProof')
+        self.assertEqual(results[key]['message'], 'success')
+        self.assertIsNone(self.backend.search(key, 'IDProof'))
+
+    # Test an increment whose reply is lost is not sent a second time
+    def test_increment_reply_lost(self):
+        key = 'lost-Mock-reply'
+        self.backend.increment(key, 'IDProof')
+        modify = Connection.modify
+
+        def applied_then_lost(conn, *args, **kwargs):
+            modify(conn, *args, **kwargs)
+            raise LDAPSocketReceiveError('timed out')
+
+        with mock.patch.object(Connection, 'modify', applied_then_lost):
+            with self.assertRaises(LDAPSocketReceiveError):
+                self.backend.increment(key, 'IDProof')
+        self.assertEqual(self.backend.search(key, 'IDProof')['umichExcListBadAttempts'], ['2'])
+        self.backend.delete(key, 'IDProof')
@@ -0,0 +1,42 @@
+from django.test import SimpleTestCase
+
+from ..benchmark import run_benchmark, parse_mix, percentile
+
+import logging
+
+
+class BenchmarkTests(SimpleTestCase):
+
+    # Disable logging
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    # Reenable logging
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    # Test the mix parser
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('add_key=2, find_umid'), {'add_key': 2.0, 'find_umid': 1.0})
+        with self.assertRaises(ValueError):
+            parse_mix('add_key=1,bogus=1')
+        with self.assertRaises(ValueError):
+            parse_mix('add_key=0')
+
+    # Test nearest-rank percentiles
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertIsNone(percentile([], 50))
+
+    # Test a small run against the in-memory backend
+    def test_run(self):
+        results = run_benchmark(requests=40, concurrency=4, keys=5, backend='api.backends.MemoryBackend')
+
+        self.assertEqual(results['total']['requests'], 40)
+        self.assertEqual(results['total']['errors'], 0)
+        self.assertEqual(sum(summary['requests'] for summary in results['endpoints'].values()), 40)
+        self.assertEqual(results['endpoints']['add_key']['backend_ops_per_request'], 1.0)
+        self.assertIsNotNone(results['total']['p99_ms'])
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from ..backends import MemoryBackend, set_backend
+from ..bulk_import import read_csv, read_ndjson, run_import
+from ..lookup_cache import get_cache
+
+from io import StringIO
+import logging
+
+
+class BulkImportTests(SimpleTestCase):
+
+    # Disable logging and import into an in-memory backend
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.backend = MemoryBackend(settings.EXC_LIST_BACKEND_LDIF)
+        self.backend.increment('already-there', 'IDProof')
+        self.backend.increment('not-in-feed', 'IDProof')
+        self.previous = set_backend(self.backend)
+        get_cache().clear()
+
+    # Reenable logging and put the backend back
+    def tearDown(self):
+        set_backend(self.previous)
+        get_cache().clear()
+        logging.disable(logging.NOTSET)
+
+    # Test names are read from CSV columns and the NDJSON shapes
+    def test_readers(self):
+        self.assertEqual(list(read_csv(StringIO('a,b\n c ,d\n'))), ['a', 'c'])
+        self.assertEqual(list(read_csv(StringIO('id,key\n1,k1\n2,k2\n'), 'key')), ['k1', 'k2'])
+        with self.assertRaises(ValueError):
+            list(read_csv(StringIO('id\n1\n'), 'key'))
+
+        feed = StringIO(
+            '"plain"\n'
+            '{"key": "object"}\n'
+            '\n'
+            '{"dn": "x", "attributes": {"umichExcListName": ["exported"]}}\n'
+            '{"cookie": null, "entries": 1}\n'
+        )
+        self.assertEqual(list(read_ndjson(feed)), ['plain', 'object', 'exported'])
+
+    # Test a dry run reports the diff and changes nothing
+    def test_dry_run(self):
+        changes = []
+        report = run_import(['new-one', 'ALREADY-there', 'new-one', ''], 'IDProof', delete_missing=True,
+                            dry_run=True, on_change=lambda change, name: changes.append((change, name)))
+        self.assertEqual(changes, [('add', 'new-one'), ('delete', 'not-in-feed')])
+        self.assertEqual(report['counts'], {
+            'read': 4, 'invalid': 1, 'duplicate': 1, 'unchanged': 1, 'add': 1, 'delete': 1,
+        })
+        self.assertIsNone(self.backend.search('new-one', 'IDProof'))
+        self.assertIsNotNone(self.backend.search('not-in-feed', 'IDProof'))
+
+    # Test adds and deletes are applied in batches
+    def test_apply(self):
+        names = ['bulk-{}'.format(n) for n in range(25)] + ['already-there']
+        report = run_import(iter(names), 'IDProof', delete_missing=True, workers=3, batch_size=4)
+        self.assertEqual(report['failed'], [])
+        self.assertEqual(report['counts']['add'], 25)
+        for name in names:
+            self.assertIsNotNone(self.backend.search(name, 'IDProof'))
+        self.assertIsNone(self.backend.search('not-in-feed', 'IDProof'))
+
+        # UMIDs are checked before they go into Admin
+        report = run_import(['00999900', '123'], 'Admin')
+        self.assertEqual((report['counts']['add'], report['counts']['invalid']), (1, 1))
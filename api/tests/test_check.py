@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.test import SimpleTestCase
+from django.urls import reverse
+
+from ..backends import MemoryBackend, set_backend
+from ..benchmark import LatencyBackend
+from ..lookup_cache import get_cache
+
+import logging
+
+
+class CheckTests(SimpleTestCase):
+
+    # Disable logging, cache both OUs and count the calls to an in-memory backend
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.backend = LatencyBackend(MemoryBackend(settings.EXC_LIST_BACKEND_LDIF))
+        self.previous = set_backend(self.backend)
+        self.ttls, get_cache().ttls = get_cache().ttls, {'Admin': 300, 'IDProof': 5}
+        get_cache().clear()
+
+    # Reenable logging and put the backend and cache back
+    def tearDown(self):
+        set_backend(self.previous)
+        get_cache().ttls = self.ttls
+        get_cache().clear()
+        logging.disable(logging.NOTSET)
+
+    # Test a umid and keys are checked with one backend call and a verdict per OU
+    def test_check(self):
+        self.backend.increment('check-key', 'IDProof')
+        data = {'umid': '00133700', 'keys': ['check-key', 'check-missing'], 'fields': ['umichExcListBadAttempts'], 'format': 'compact'}
+        response = self.client.post(reverse('check'), data, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'Admin': {
+                'listed': True,
+                'results': {'00133700': {}},
+            },
+            'IDProof': {
+                'listed': True,
+                'results': {
+                    'check-key': {'umichExcListBadAttempts': 1},
+                    'check-missing': {'message': 'not_found', 'status': 404},
+                },
+            },
+        })
+        self.assertEqual(self.backend.calls['search_ous'], 1)
+
+        # Answered from the cache the second time, an OU nothing is asked of is left out
+        response = self.client.post(reverse('check'), {'keys': ['check-missing']})
+        self.assertEqual(response.json(), {
+            'IDProof': {'listed': False, 'results': {'check-missing': {'message': 'not_found', 'status': 404}}},
+        })
+        self.assertEqual(self.backend.calls['search_ous'], 1)
+
+    # Test 400 without a umid or keys, or with a bad umid
+    def test_invalid(self):
+        response = self.client.post(reverse('check'), {})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'non_field_errors': ['Enter a UMID or at least one key.']})
+
+        response = self.client.post(reverse('check'), {'umid': 'abc', 'keys': ['k']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'umid': ['Enter a valid UMID.']})
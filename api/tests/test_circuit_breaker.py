@@ -0,0 +1,182 @@
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from ldap3.core.exceptions import LDAPSocketOpenError
+
+from .. import circuit_breaker
+from ..backends import MemoryBackend, LDAPBackend, ExcListError, ExcListDirectoryError, DIRECTORY_DISTRESS, \
+    exc_list_error, set_backend
+from ..circuit_breaker import CircuitBreaker, ExcListUnavailable, CLOSED, OPEN, HALF_OPEN, get_breaker
+from ..ldap_pool import PoolError
+from ..lookup_cache import get_cache
+
+import os
+import threading
+import logging
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    # Disable logging
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    # Reenable logging
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def failed_call(self, breaker):
+        with self.assertRaises(LDAPSocketOpenError):
+            with breaker.guard():
+                raise LDAPSocketOpenError('refused')
+
+    # Test the breaker opens after consecutive failures and fails fast with a Retry-After
+    def test_open(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        self.failed_call(breaker)
+        with breaker.guard():
+            pass
+        self.failed_call(breaker)
+        self.assertEqual(breaker.state, CLOSED)
+        self.failed_call(breaker)
+        self.assertEqual(breaker.state, OPEN)
+
+        with self.assertRaises(ExcListUnavailable) as context:
+            with breaker.guard():
+                raise AssertionError('the call must not be made')
+        self.assertEqual(context.exception.message, 'ldap_unavailable')
+        self.assertEqual(context.exception.retry_after, 30)
+        self.assertEqual(breaker.stats()['rejected_open'], 1)
+
+    # Test one probe is let through half open, a failure reopens and a success closes
+    def test_half_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        self.failed_call(breaker)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.failed_call(breaker)
+        self.assertEqual(breaker.stats()['opened'], 2)
+
+        with breaker.guard():
+            # Other calls are turned away while the probe is out
+            with self.assertRaises(ExcListUnavailable):
+                with breaker.guard():
+                    pass
+        self.assertEqual(breaker.state, CLOSED)
+
+    # Test calls past max_in_flight are turned away as busy
+    def test_max_in_flight(self):
+        breaker = CircuitBreaker(max_in_flight=1, in_flight_wait=0.01)
+        held, release = threading.Event(), threading.Event()
+
+        def hold():
+            with breaker.guard():
+                held.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait(5)
+        with self.assertRaises(ExcListUnavailable) as context:
+            with breaker.guard():
+                pass
+        self.assertEqual(context.exception.message, 'ldap_busy')
+        with self.assertRaises(ExcListUnavailable):
+            with breaker.guard(blocking=False):
+                pass
+        release.set()
+        thread.join()
+        with breaker.guard():
+            pass
+        self.assertEqual(breaker.stats()['rejected_busy'], 2)
+
+    # Test an exhausted pool is turned away as busy without counting against the directory
+    def test_pool_exhausted(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        with self.assertRaises(ExcListUnavailable) as context:
+            with breaker.guard():
+                raise PoolError('ldap_pool_exhausted')
+        self.assertEqual(context.exception.message, 'ldap_busy')
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.stats()['rejected_busy'], 1)
+
+    # Test each result that says the directory is in distress counts as a failure, other results as answers
+    def test_directory_distress(self):
+        for description in DIRECTORY_DISTRESS:
+            with self.subTest(description=description):
+                breaker = CircuitBreaker(failure_threshold=1)
+                with self.assertRaises(ExcListDirectoryError):
+                    with breaker.guard():
+                        raise exc_list_error(description)
+                self.assertEqual(breaker.state, OPEN)
+
+        breaker = CircuitBreaker(failure_threshold=1)
+        with self.assertRaises(ExcListError):
+            with breaker.guard():
+                raise exc_list_error('insufficientAccessRights')
+        self.assertEqual(breaker.state, CLOSED)
+
+    # Test a search the directory was too busy to answer raises instead of finding no entry
+    def test_search_distress(self):
+        class Busy(object):
+            entries = []
+            result = {'description': 'busy'}
+
+            def search(self, *args, **kwargs):
+                pass
+
+        backend = LDAPBackend()
+        with self.assertRaises(ExcListDirectoryError):
+            backend._search(Busy(), 'key', 'IDProof')
+        Busy.result = {'description': 'success'}
+        self.assertEqual(backend._search(Busy(), 'key', 'IDProof'), '')
+
+    # Test the in-flight cap is held to the pool size unless the async views multiplex connections
+    @override_settings(LDAP_MAX_IN_FLIGHT=64, LDAP_POOL_SIZE=10, EXC_LIST_ASYNC_VIEWS=False)
+    def test_max_in_flight_pool_size(self):
+        circuit_breaker._breaker = None
+        self.assertEqual(get_breaker().max_in_flight, 10)
+        with override_settings(EXC_LIST_ASYNC_VIEWS=True):
+            circuit_breaker._breaker = None
+            self.assertEqual(get_breaker().max_in_flight, 64)
+        circuit_breaker._breaker = None
+
+
+class CircuitBreakerViewTests(SimpleTestCase):
+
+    # Disable logging, cache both OUs, use an in-memory backend and a breaker that opens on the first failure
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.backend = MemoryBackend(settings.EXC_LIST_BACKEND_LDIF)
+        self.previous = set_backend(self.backend)
+        circuit_breaker._breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        circuit_breaker._breaker_pid = os.getpid()
+        circuit_breaker._breaker_backend = self.backend
+        self.ttls, get_cache().ttls = get_cache().ttls, {'Admin': 300, 'IDProof': 5}
+        get_cache().clear()
+
+    # Reenable logging and put the backend and cache back, the backend gets a breaker of its own again
+    def tearDown(self):
+        set_backend(self.previous)
+        get_cache().ttls = self.ttls
+        get_cache().clear()
+        logging.disable(logging.NOTSET)
+
+    # Test the views answer 503 with Retry-After once the directory fails, cached entries are still served
+    def test_unavailable(self):
+        url = reverse('find_key')
+        self.assertEqual(self.client.post(url, {'key': 'cached-key'}).status_code, 404)
+
+        def down(*args, **kwargs):
+            raise LDAPSocketOpenError('refused')
+
+        self.backend.search = down
+        self.assertEqual(self.client.post(url, {'key': 'breaker-key'}).status_code, 500)
+
+        response = self.client.post(url, {'key': 'breaker-key'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {'message': 'ldap_unavailable', 'status': 503})
+        self.assertEqual(response['Retry-After'], '60')
+
+        response = self.client.post(reverse('add_key'), {'key': 'breaker-key'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.client.post(url, {'key': 'cached-key'}).status_code, 404)
@@ -1,7 +1,8 @@
 from django.test import SimpleTestCase
 
-from ..exc_list_manager import exc_list_find_umid, exc_list_find_key, exc_list_add_key, exc_list_delete_key, ExcListError
+from ..exc_list_manager import exc_list_find_umid, exc_list_find_key, exc_list_find_keys, exc_list_add_key, exc_list_add_keys, exc_list_delete_key, exc_list_delete_keys, exc_list_project, exc_list_compact, ExcListError
 
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 
@@ -47,6 +48,20 @@ class ExcListTests(SimpleTestCase):
             exc_list_find_key(key)
         self.assertEqual(context.exception.message, 'not_found')
 
+    # Test batch finds on keys
+    def test_find_keys(self):
+        key = 'find-me-in-a-batch'
+
+        # Create one of the entries
+        exc_list_add_key(key)
+
+        entries = exc_list_find_keys([key, 'do-not-find-me'])
+        self.assertEqual(entries[key]['umichExcListName'][0], key)
+        self.assertIsNone(entries['do-not-find-me'])
+
+        # Cleanup
+        exc_list_delete_key(key)
+
     # Test adds on key
     def test_add_key(self):
         key = 'add-me'
@@ -68,6 +83,22 @@ class ExcListTests(SimpleTestCase):
         # Cleanup
         exc_list_delete_key(key)
 
+    # Test concurrent adds do not lose increments
+    def test_add_key_concurrent(self):
+        key = 'add-me-concurrently'
+
+        # Start with nothing
+        exc_list_delete_key(key)
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            list(executor.map(exc_list_add_key, [key] * 10))
+
+        entry = exc_list_find_key(key)
+        self.assertEqual(entry['umichExcListBadAttempts'][0], '10')
+
+        # Cleanup
+        exc_list_delete_key(key)
+
     # Test deletes on key
     def test_delete_key(self):
         key = 'delete-me'
@@ -83,3 +114,39 @@ class ExcListTests(SimpleTestCase):
         entry = exc_list_delete_key(key)
         self.assertEqual(entry['message'], 'noSuchObject')
 
+    # Test batch adds and deletes on keys
+    def test_add_delete_keys(self):
+        keys = ['batch-me-1', 'batch-me-2', 'batch-me-3']
+
+        # Start with one existing entry
+        exc_list_delete_keys(keys)
+        exc_list_add_key(keys[0])
+
+        results, elapsed = exc_list_add_keys(keys)
+        self.assertEqual(results[keys[0]]['umichExcListBadAttempts'][0], '2')
+        self.assertTrue(results[keys[1]]['dn'])
+        self.assertTrue(results[keys[2]]['dn'])
+        self.assertGreater(elapsed, 0)
+
+        results, elapsed = exc_list_delete_keys(keys + ['batch-me-not'])
+        self.assertEqual(results[keys[0]]['message'], 'success')
+        self.assertEqual(results['batch-me-not']['message'], 'noSuchObject')
+
+    # Test fields projection and the compact format
+    def test_fields_compact(self):
+        key = 'project-me'
+        exc_list_add_key(key)
+        exc_list_add_key(key)
+
+        entry = exc_list_find_key(key, fields=['umichexclistbadattempts'])
+        self.assertEqual(list(entry), ['umichExcListBadAttempts'])
+        self.assertEqual(exc_list_compact(entry), {'umichExcListBadAttempts': 2})
+
+        results = exc_list_find_keys([key, 'project-me-not'], fields=['umichExcListName'])
+        self.assertEqual(results[key], {'umichExcListName': [key]})
+        self.assertIsNone(results['project-me-not'])
+
+        # Messages and new entries pass through untouched
+        self.assertEqual(exc_list_project({'dn': 'x'}, ['umichExcListName']), {'dn': 'x'})
+        self.assertEqual(exc_list_compact({'message': 'success'}), {'message': 'success'})
+        exc_list_delete_key(key)
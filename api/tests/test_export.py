@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.test import SimpleTestCase
+from django.urls import reverse
+
+from ..backends import MemoryBackend, ExcListError, set_backend
+from ..export import export_lines
+
+from io import BytesIO
+import gzip
+import json
+import logging
+
+
+class ExportTests(SimpleTestCase):
+
+    # Disable logging and export from an in-memory backend with a few entries
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        backend = MemoryBackend(settings.EXC_LIST_BACKEND_LDIF)
+        for n in range(5):
+            backend.increment('export-key-{}'.format(n), 'IDProof')
+        self.previous = set_backend(backend)
+
+    # Reenable logging and put the backend back
+    def tearDown(self):
+        set_backend(self.previous)
+        logging.disable(logging.NOTSET)
+
+    def read(self, lines):
+        return [json.loads(line) for line in lines]
+
+    # Test entries, resume cookies and the closing line
+    def test_export_lines(self):
+        lines = self.read(export_lines('IDProof', page_size=2))
+        names = [line['attributes']['umichExcListName'][0] for line in lines if 'dn' in line]
+        self.assertEqual(names, ['export-key-{}'.format(n) for n in range(5)])
+        cookies = [line['cookie'] for line in lines if 'cookie' in line]
+        self.assertEqual(len(cookies), 3)
+        self.assertEqual(lines[-1], {'cookie': None, 'entries': 5})
+
+        # Resume after the second page
+        lines = self.read(export_lines('IDProof', page_size=2, cookie=cookies[1]))
+        self.assertEqual([line['attributes']['umichExcListName'][0] for line in lines if 'dn' in line],
+                         ['export-key-4'])
+
+        with self.assertRaises(ExcListError) as context:
+            export_lines('IDProof', cookie='a')
+        self.assertEqual(context.exception.message, 'invalid_cookie')
+
+    # Test the endpoint streams NDJSON and gzips it on request
+    def test_export_view(self):
+        response = self.client.get(reverse('export'), {'ou': 'Admin'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = self.read(b''.join(response.streaming_content).splitlines())
+        self.assertEqual(lines[0]['attributes']['umichExcListName'], ['00133700'])
+
+        response = self.client.get(reverse('export'), {'page_size': 2}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.GzipFile(fileobj=BytesIO(b''.join(response.streaming_content))).read()
+        self.assertEqual(self.read(body.splitlines())[-1], {'cookie': None, 'entries': 5})
+
+    # Test 400 on an unknown OU or a malformed cookie
+    def test_bad_request(self):
+        response = self.client.get(reverse('export'), {'ou': 'People'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('export'), {'cookie': 'a'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], 'invalid_cookie')
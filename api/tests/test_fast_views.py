@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.test import SimpleTestCase, RequestFactory
+
+from .. import fast_views, views
+from ..backends import MemoryBackend, set_backend
+from ..lookup_cache import get_cache
+
+import json
+import logging
+
+
+class FastViewTests(SimpleTestCase):
+
+    # Disable logging and serve from an in-memory copy of the fixture
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.factory = RequestFactory()
+        self.previous = set_backend(MemoryBackend(settings.EXC_LIST_BACKEND_LDIF))
+        get_cache().clear()
+
+    # Reenable logging and put the backend back
+    def tearDown(self):
+        set_backend(self.previous)
+        get_cache().clear()
+        logging.disable(logging.NOTSET)
+
+    def post(self, view, data, json_body=False):
+        if json_body:
+            request = self.factory.post('/', json.dumps(data), content_type='application/json')
+        else:
+            request = self.factory.post('/', data)
+        return view(request)
+
+    # Test the fast views answer exactly as the DRF views do
+    def test_same_contract(self):
+        cases = [
+            ('find_umid', {'umid': '00133700'}),
+            ('find_umid', {'umid': '00133700', 'fields': 'umichExcListManualLockout', 'format': 'compact'}),
+            ('find_umid', {'umid': '00111100'}),
+            ('find_umid', {'umid': 'abc123'}),
+            ('find_key', {}),
+            ('find_key', {'key': '  '}),
+            ('find_key', {'key': 'fast-key', 'fields': '(cn=*)'}),
+            ('find_key', {'key': 'fast-key', 'format': 'terse'}),
+            ('add_key', {'key': 'fast-key'}),
+            ('add_key', {'key': 'fast-key', 'format': 'compact'}),
+            ('find_key', {'key': 'fast-key', 'fields': 'umichExcListBadAttempts', 'format': 'compact'}),
+            ('delete_key', {'key': 'fast-key'}),
+        ]
+        for name, data in cases:
+            for json_body in (False, True):
+                # Both views start without the entry, so an add creates it in each
+                views.delete_key(self.factory.post('/', {'key': 'fast-key'}))
+                drf = self.post(getattr(views, name), data, json_body)
+                drf.render()
+                views.delete_key(self.factory.post('/', {'key': 'fast-key'}))
+                fast = self.post(getattr(fast_views, name), data, json_body)
+                self.assertEqual((fast.status_code, fast.content), (drf.status_code, drf.content), (name, data))
+                self.assertEqual(fast['Content-Type'], 'application/json')
+
+    # Test JSON values the fast checks leave to the serializer
+    def test_serializer_fallback(self):
+        response = self.post(fast_views.find_umid, {'umid': 133700}, json_body=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), {'umid': ['Enter a valid UMID.']})
+
+        response = self.post(fast_views.find_key, ['not', 'a', 'dict'], json_body=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('non_field_errors', json.loads(response.content))
+
+    # Test methods and bodies that are rejected before validation
+    def test_rejected(self):
+        response = fast_views.find_key(self.factory.get('/'))
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response['Allow'], 'POST, OPTIONS')
+
+        # OPTIONS is answered as DRF answers it
+        fast, drf = fast_views.find_key(self.factory.options('/')), views.find_key(self.factory.options('/'))
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.rendered_content, drf.rendered_content)
+
+        response = fast_views.find_key(self.factory.post('/', '{"key":', content_type='application/json'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', json.loads(response.content)['detail'])
+
+        response = fast_views.find_key(self.factory.post('/', 'key', content_type='text/plain'))
+        self.assertEqual(response.status_code, 415)
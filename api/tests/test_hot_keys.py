@@ -0,0 +1,109 @@
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+from .. import hot_keys
+from ..backends import MemoryBackend, set_backend
+from ..exc_list_manager import exc_list_find_key, exc_list_add_key, exc_list_delete_key, get_write_buffer, ExcListError
+from ..hot_keys import HotKeyThrottle, ExcListThrottled, UNKNOWN
+from ..lookup_cache import get_cache
+
+import logging
+
+
+class HotKeyThrottleTests(SimpleTestCase):
+
+    # Test a key is admitted up to its burst, then throttled
+    def test_admit(self):
+        throttle = HotKeyThrottle(rate=0.001, burst=3)
+        self.assertEqual([throttle.admit('IDProof', 'k') for n in range(4)], [True, True, True, False])
+        self.assertTrue(throttle.admit('IDProof', 'other'))
+        self.assertFalse(throttle.admit('IDProof', 'K'))    # case insensitive
+        self.assertGreaterEqual(throttle.retry_after('IDProof', 'k'), 1)
+
+    # Test answers are only kept for keys with a bucket, and cold keys are evicted
+    def test_remember_evict(self):
+        throttle = HotKeyThrottle(rate=1, burst=1, max_keys=2)
+        throttle.remember('IDProof', 'a', {'umichExcListName': ['a']})
+        self.assertIs(throttle.last('IDProof', 'a'), UNKNOWN)
+
+        throttle.admit('IDProof', 'a')
+        throttle.remember('IDProof', 'a', None)
+        self.assertIsNone(throttle.last('IDProof', 'a'))
+        throttle.admit('IDProof', 'b')
+        throttle.admit('IDProof', 'c')
+        self.assertIs(throttle.last('IDProof', 'a'), UNKNOWN)
+        self.assertEqual(throttle.stats()['evictions'], 1)
+
+
+@override_settings(EXC_LIST_HOT_KEY_RATE=0.001, EXC_LIST_HOT_KEY_BURST=2)
+class HotKeyManagerTests(SimpleTestCase):
+
+    # Disable logging and the lookup cache and throttle an in-memory backend
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.backend = MemoryBackend(settings.EXC_LIST_BACKEND_LDIF)
+        self.previous = set_backend(self.backend)
+        hot_keys._throttle = None
+        self.ttls, get_cache().ttls = get_cache().ttls, {}
+
+    # Reenable logging and put the backend and throttle back
+    def tearDown(self):
+        get_write_buffer().flush()
+        set_backend(self.previous)
+        hot_keys._throttle = None
+        get_cache().ttls = self.ttls
+        get_cache().clear()
+        logging.disable(logging.NOTSET)
+
+    # Test hot finds are answered from the last result
+    def test_find(self):
+        key = 'hot-find-key'
+        for n in range(2):
+            with self.assertRaises(ExcListError) as context:
+                exc_list_find_key(key)
+            self.assertEqual(context.exception.message, 'not_found')
+
+        # The backend is not asked again, so the new entry is not seen yet
+        self.backend.increment(key, 'IDProof')
+        with self.assertRaises(ExcListError) as context:
+            exc_list_find_key(key)
+        self.assertEqual(context.exception.message, 'not_found')
+
+        hot_keys._throttle = None
+        self.assertEqual(exc_list_find_key(key)['umichExcListBadAttempts'], ['1'])
+
+        # Projected lookups are not remembered, so there is nothing to answer with
+        hot_keys._throttle = None
+        for n in range(2):
+            exc_list_find_key(key, fields=['umichExcListName'])
+        with self.assertRaises(ExcListThrottled):
+            exc_list_find_key(key)
+
+    # Test hot adds are buffered and counted
+    def test_add(self):
+        key = 'hot-add-key'
+        exc_list_add_key(key)
+        exc_list_add_key(key)
+        self.assertEqual(exc_list_add_key(key)['umichExcListBadAttempts'], ['3'])
+        self.assertEqual(exc_list_add_key(key)['umichExcListBadAttempts'], ['4'])
+        self.assertEqual(self.backend.search(key, 'IDProof')['umichExcListBadAttempts'], ['2'])
+
+        get_write_buffer().flush()
+        self.assertEqual(self.backend.search(key, 'IDProof')['umichExcListBadAttempts'], ['4'])
+        self.assertEqual(exc_list_add_key(key)['umichExcListBadAttempts'], ['5'])
+
+        # A delete is remembered, so further adds have nothing to answer with
+        exc_list_delete_key(key)
+        with self.assertRaises(ExcListThrottled):
+            exc_list_add_key(key)
+
+    # Test the views answer 429 with Retry-After
+    def test_view(self):
+        data = {'key': 'hot-view-key', 'fields': 'umichExcListName'}
+        for n in range(2):
+            self.assertEqual(self.client.post(reverse('find_key'), data).status_code, 404)
+        response = self.client.post(reverse('find_key'), data)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['message'], 'hot_key')
+        self.assertIn('Retry-After', response)
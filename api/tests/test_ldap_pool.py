@@ -0,0 +1,221 @@
+from django.test import SimpleTestCase
+from ldap3 import Server, Connection, MOCK_SYNC
+from ldap3.core.exceptions import LDAPCommunicationError, LDAPSocketOpenError, LDAPSocketReceiveError
+
+from ..ldap_pool import ConnectionPool, PoolError, ReplicaSet
+
+import logging
+
+ADMIN_DN = 'cn=admin,dc=umich,dc=edu'
+ADMIN_PW = 'secret'
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    # Disable logging and seed a mock directory
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.pool = ConnectionPool(
+            'ldap://mock', ADMIN_DN, ADMIN_PW,
+            size=2,
+            acquire_timeout=0.1,
+            server=Server('mock'),
+            client_strategy=MOCK_SYNC,
+        )
+        seeder = Connection(self.pool.server, ADMIN_DN, ADMIN_PW, client_strategy=MOCK_SYNC)
+        seeder.strategy.add_entry(ADMIN_DN, {'userPassword': ADMIN_PW, 'objectClass': 'person'})
+
+    # Reenable logging
+    def tearDown(self):
+        self.pool.close()
+        logging.disable(logging.NOTSET)
+
+    # Connections are reused instead of rebinding
+    def test_reuse(self):
+        first = self.pool.run(lambda conn: conn)
+        second = self.pool.run(lambda conn: conn)
+        self.assertIs(first, second)
+        stats = self.pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['idle'], 1)
+        self.assertEqual(stats['in_use'], 0)
+
+    # The pool never opens more than size connections
+    def test_exhausted(self):
+        held = [self.pool.acquire(), self.pool.acquire()]
+        with self.assertRaises(PoolError) as context:
+            self.pool.acquire()
+        self.assertEqual(context.exception.message, 'ldap_pool_exhausted')
+        for conn in held:
+            self.pool.release(conn)
+        self.assertEqual(self.pool.stats()['timeouts'], 1)
+
+    # A connection that was closed underneath us is rebound
+    def test_rebind_closed(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        conn.unbind()
+        fresh = self.pool.acquire()
+        self.assertIsNot(fresh, conn)
+        self.assertTrue(fresh.bound)
+        self.pool.release(fresh)
+        self.assertEqual(self.pool.stats()['rebinds'], 1)
+
+    # Idle connections past the timeout are replaced
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = 0
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        fresh = self.pool.acquire()
+        self.assertIsNot(fresh, conn)
+        self.pool.release(fresh)
+        self.assertEqual(self.pool.stats()['open'], 1)
+
+    # A read is retried on a fresh bind, a write only when it never reached the server
+    def test_retry(self):
+        calls = []
+
+        def operation(error):
+            def run(conn):
+                calls.append(conn)
+                if len(calls) == 1:
+                    raise error('lost')
+                return 'done'
+            return run
+
+        self.assertEqual(self.pool.run(operation(LDAPSocketReceiveError)), 'done')
+        calls.clear()
+        self.assertEqual(self.pool.run(operation(LDAPSocketOpenError), retry=False), 'done')
+        calls.clear()
+        with self.assertRaises(LDAPSocketReceiveError):
+            self.pool.run(operation(LDAPSocketReceiveError), retry=False)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.pool.stats()['discarded'], 1)
+
+
+class ReplicaSetTests(SimpleTestCase):
+
+    # Disable logging and seed a mock directory for the master and each replica
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.master = self.mock_pool('ldap://master')
+        self.replicas = [self.mock_pool('ldap://replica-a'), self.mock_pool('ldap://replica-b')]
+        self.down = set()
+
+    # Reenable logging
+    def tearDown(self):
+        for pool in [self.master] + self.replicas:
+            pool.close()
+        logging.disable(logging.NOTSET)
+
+    def mock_pool(self, uri):
+        pool = ConnectionPool(uri, ADMIN_DN, ADMIN_PW, size=2, acquire_timeout=0.1, server=Server('mock'), client_strategy=MOCK_SYNC)
+        seeder = Connection(pool.server, ADMIN_DN, ADMIN_PW, client_strategy=MOCK_SYNC)
+        seeder.strategy.add_entry(ADMIN_DN, {'userPassword': ADMIN_PW, 'objectClass': 'person'})
+        return pool
+
+    def read(self, conn):
+        # The URI of the pool the connection came from, failing for the pools in self.down
+        uri = next(pool.uri for pool in [self.master] + self.replicas if pool.server is conn.server)
+        if uri in self.down:
+            raise LDAPCommunicationError('down')
+        return uri
+
+    # Test reads take the replicas in turn and never go to the master while they are up
+    def test_round_robin(self):
+        replica_set = ReplicaSet(self.replicas, fallback=self.master)
+        uris = [replica_set.run(self.read) for i in range(4)]
+        self.assertEqual(sorted(uris), ['ldap://replica-a'] * 2 + ['ldap://replica-b'] * 2)
+        self.assertNotEqual(uris[0], uris[1])
+
+    # Test least_latency prefers the replica with the lower moving average
+    def test_least_latency(self):
+        replica_set = ReplicaSet(self.replicas, fallback=self.master, strategy='least_latency')
+        self.replicas[0]._latency = 0.050
+        self.replicas[1]._latency = 0.005
+        self.assertEqual(replica_set.run(self.read), 'ldap://replica-b')
+
+    # Test a failing replica is ejected, its reads go to the master, and it is readmitted after a good probe
+    def test_eject_and_readmit(self):
+        replica_set = ReplicaSet(self.replicas[:1], fallback=self.master, max_failures=2, eject_seconds=60)
+        self.down.add('ldap://replica-a')
+        self.assertEqual(replica_set.run(self.read), 'ldap://master')
+        self.assertTrue(replica_set.stats()['replicas'][0]['admitted'])
+        self.assertEqual(replica_set.run(self.read), 'ldap://master')
+        self.assertFalse(replica_set.stats()['replicas'][0]['admitted'])
+
+        # While ejected the replica is not tried at all
+        self.down.clear()
+        self.assertEqual(replica_set.run(self.read), 'ldap://master')
+
+        # A failed probe ejects it again straight away
+        replica_set._replicas[0]['ejected_until'] = 0
+        self.down.add('ldap://replica-a')
+        self.assertEqual(replica_set.run(self.read), 'ldap://master')
+        self.assertFalse(replica_set.stats()['replicas'][0]['admitted'])
+
+        replica_set._replicas[0]['ejected_until'] = 0
+        self.down.clear()
+        self.assertEqual(replica_set.run(self.read), 'ldap://replica-a')
+        stats = replica_set.stats()
+        self.assertTrue(stats['replicas'][0]['admitted'])
+        self.assertEqual((stats['ejections'], stats['probes'], stats['readmissions']), (2, 2, 1))
+
+    # Test only a reply readmits a probed replica, pool and caller errors leave it ejected
+    def test_probe_needs_reply(self):
+        replica_set = ReplicaSet(self.replicas[:1], fallback=self.master, max_failures=1, eject_seconds=60)
+        replica_set._replicas[0]['ejected_until'] = 0
+
+        def broken(conn):
+            raise ValueError('caller bug')
+
+        with self.assertRaises(ValueError):
+            replica_set.run(broken)
+        replica = replica_set._replicas[0]
+        self.assertEqual((replica['ejected_until'], replica['probing']), (0, False))
+
+        held = [self.replicas[0].acquire(), self.replicas[0].acquire()]
+        with self.assertRaises(PoolError):
+            replica_set.run(self.read)
+        for conn in held:
+            self.replicas[0].release(conn)
+        self.assertEqual((replica['ejected_until'], replica['probing']), (0, False))
+
+        # A probe connection given back unused is no reply either
+        replica_set.release(replica_set.acquire())
+        self.assertEqual((replica['ejected_until'], replica['probing']), (0, False))
+
+        def not_found(conn):
+            conn.search('ou=missing,dc=umich,dc=edu', '(objectClass=*)')
+            raise ValueError(conn.result['description'])
+
+        with self.assertRaises(ValueError):
+            replica_set.run(not_found)
+        self.assertIsNone(replica['ejected_until'])
+        self.assertEqual(replica_set.stats()['readmissions'], 1)
+
+    # Test a connection held across requests readmits its replica once a read on it got a reply
+    def test_acquire_probe(self):
+        replica_set = ReplicaSet(self.replicas[:1], fallback=self.master, eject_seconds=60)
+        replica_set._replicas[0]['ejected_until'] = 0
+        conn = replica_set.acquire()
+        conn.search('ou=missing,dc=umich,dc=edu', '(objectClass=*)')
+        replica_set.release(conn)
+        self.assertTrue(replica_set.stats()['replicas'][0]['admitted'])
+
+    # Test connections held across requests go back to the pool they came from
+    def test_acquire_release(self):
+        replica_set = ReplicaSet(self.replicas, fallback=self.master)
+        conns = [replica_set.acquire(), replica_set.acquire()]
+        self.assertEqual(sorted(self.read(conn) for conn in conns), ['ldap://replica-a', 'ldap://replica-b'])
+        for conn in conns:
+            replica_set.release(conn)
+        self.assertEqual([pool.stats()['idle'] for pool in self.replicas], [1, 1])
+        self.assertEqual(self.master.stats()['open'], 0)
+
+    # Test without a fallback the replica's error is raised
+    def test_no_fallback(self):
+        replica_set = ReplicaSet(self.replicas[:1])
+        self.down.add('ldap://replica-a')
+        with self.assertRaises(LDAPCommunicationError):
+            replica_set.run(self.read)
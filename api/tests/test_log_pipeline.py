@@ -0,0 +1,110 @@
+from django.conf import settings
+from django.test import SimpleTestCase
+from django.urls import reverse
+
+from ..backends import MemoryBackend, set_backend
+from ..log_pipeline import JSONFormatter, SampleFilter, QueueingHandler, sampled
+
+import io
+import json
+import logging
+import threading
+
+
+def _record(msg='Return status_code=%s', args=(200,), level=logging.INFO, key=None):
+    record = logging.LogRecord('api.views', level, __file__, 1, msg, args, None, func='find_key')
+    record.__dict__.update(sampled('/find/', {'key': key}, 'key'))
+    return record
+
+
+class BlockingStream(io.StringIO):
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, text):
+        self.release.wait(5)
+        return super().write(text)
+
+
+class LogPipelineTests(SimpleTestCase):
+
+    # Test records become one JSON object per line
+    def test_json(self):
+        line = json.loads(JSONFormatter().format(_record()))
+        self.assertEqual(line['msg'], 'Return status_code=200')
+        self.assertEqual(line['level'], 'INFO')
+        self.assertEqual(line['logger'], 'api.views')
+
+    # Test repeats of a key are sampled after the burst, other keys, unkeyed records and warnings are not
+    def test_sample(self):
+        sample = SampleFilter(burst=3, every=10, window=60)
+        passed = [sample.filter(_record(key='Hot')) for i in range(33)]
+        self.assertEqual(passed.count(True), 6)
+        self.assertTrue(sample.filter(_record(key='cold')))
+        self.assertFalse(sample.filter(_record(key='hot')))
+        self.assertTrue(all(sample.filter(_record()) for i in range(10)))
+        self.assertTrue(all(sample.filter(_record(level=logging.WARNING, key='hot')) for i in range(10)))
+
+    # Test records are written by the writer thread
+    def test_queue(self):
+        stream = io.StringIO()
+        handler = QueueingHandler(stream=stream)
+        handler.setFormatter(JSONFormatter())
+        handler.handle(_record())
+        handler.close()
+        self.assertEqual(json.loads(stream.getvalue())['msg'], 'Return status_code=200')
+
+    # Test a full queue drops records and reports the count
+    def test_drop(self):
+        stream = BlockingStream()
+        handler = QueueingHandler(stream=stream, max_queue=1)
+        for i in range(5):
+            handler.handle(_record())
+        stream.release.set()
+        handler.close()
+
+        self.assertGreaterEqual(handler.dropped, 3)
+        self.assertIn('Log queue full, dropped', stream.getvalue())
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class SampledViewTests(SimpleTestCase):
+
+    # Collect the sampled records of the single-key views, which use an in-memory backend
+    def setUp(self):
+        self.previous = set_backend(MemoryBackend(settings.EXC_LIST_BACKEND_LDIF))
+        self.handler = ListHandler()
+        self.handler.addFilter(SampleFilter(burst=1, every=0, window=60))
+        self.logger = logging.getLogger('api')
+        self.level = self.logger.level
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+    # Remove the handler and put the backend back
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+        set_backend(self.previous)
+
+    def returned(self):
+        return [record.args[0] for record in self.handler.records if record.msg.startswith('Return')]
+
+    # Test successful repeats of a key are sampled out while failed requests are always logged
+    def test_sampled_per_key(self):
+        for i in range(3):
+            self.client.post(reverse('find_umid'), {'umid': '00133700'})
+            self.client.post(reverse('find_umid'), {'umid': '00111100'})
+        self.assertEqual(self.returned(), [200, 404, 404, 404])
+        self.client.post(reverse('find_umid'), {'umid': '00133701'})
+        self.assertEqual(len(self.returned()), 5)
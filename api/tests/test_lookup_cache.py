@@ -0,0 +1,109 @@
+from django.test import SimpleTestCase, override_settings
+
+from ..lookup_cache import LookupCache, SharedLookupCache, MISSING
+
+import shutil
+import tempfile
+import time
+
+
+class LookupCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = LookupCache(max_size=2, ttls={'Admin': 60, 'IDProof': 60, 'Off': 0})
+
+    # Test hits, negative hits and misses
+    def test_get_set(self):
+        self.assertIs(self.cache.get('Admin', '00133700'), MISSING)
+        self.cache.set('Admin', '00133700', {'umichExcListName': ['00133700']})
+        self.cache.set('Admin', '00111100', None)
+
+        self.assertEqual(self.cache.get('Admin', '00133700'), {'umichExcListName': ['00133700']})
+        self.assertIsNone(self.cache.get('Admin', '00111100'))
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['negative_hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    # Test names are case insensitive and callers get their own copy
+    def test_case_insensitive_copy(self):
+        self.cache.set('IDProof', 'Find-Me', {'umichExcListBadAttempts': ['1']})
+        entry = self.cache.get('IDProof', 'find-me')
+        entry['umichExcListBadAttempts'][0] = '2'
+        self.assertEqual(self.cache.get('IDProof', 'FIND-ME'), {'umichExcListBadAttempts': ['1']})
+
+    # Test least recently used entries are evicted
+    def test_eviction(self):
+        self.cache.set('IDProof', 'a', None)
+        self.cache.set('IDProof', 'b', None)
+        self.cache.get('IDProof', 'a')
+        self.cache.set('IDProof', 'c', None)
+
+        self.assertIs(self.cache.get('IDProof', 'b'), MISSING)
+        self.assertIsNone(self.cache.get('IDProof', 'a'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    # Test expiry and OUs with caching turned off
+    def test_ttl(self):
+        self.cache.ttls['IDProof'] = 0.01
+        self.cache.set('IDProof', 'a', None)
+        self.cache.set('Off', 'b', None)
+        time.sleep(0.02)
+
+        self.assertIs(self.cache.get('IDProof', 'a'), MISSING)
+        self.assertIs(self.cache.get('Off', 'b'), MISSING)
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+    # Test a lookup that raced an invalidation is not cached
+    def test_invalidate(self):
+        self.cache.set('IDProof', 'a', None)
+        token = self.cache.token()
+        self.cache.invalidate('IDProof', 'a')
+        self.cache.set('IDProof', 'a', {'stale': ['1']}, token)
+
+        self.assertIs(self.cache.get('IDProof', 'a'), MISSING)
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+
+class SharedLookupCacheTests(SimpleTestCase):
+
+    # Two caches over one file based Django cache stand in for two workers
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(CACHES={
+            'exclist': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': self.directory},
+        })
+        self.settings.enable()
+        ttls = {'Admin': 60, 'IDProof': 60, 'Off': 0}
+        self.worker = SharedLookupCache('exclist', dict(ttls))
+        self.other = SharedLookupCache('exclist', dict(ttls))
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    # Test a lookup cached by one worker is a hit in another, names are case insensitive
+    def test_shared(self):
+        self.worker.set('IDProof', 'Find-Me', {'umichExcListBadAttempts': ['1']})
+        self.worker.set('Admin', '00111100', None)
+        self.worker.set('Off', 'b', None)
+
+        self.assertEqual(self.other.get('IDProof', 'find-me'), {'umichExcListBadAttempts': ['1']})
+        self.assertIsNone(self.other.get('Admin', '00111100'))
+        self.assertIs(self.other.get('Off', 'b'), MISSING)
+        self.assertEqual(self.other.stats()['hits'], 1)
+        self.assertEqual(self.other.stats()['negative_hits'], 1)
+
+    # Test an invalidation in one worker reaches the other, and a lookup that raced it is not served
+    def test_invalidate(self):
+        self.worker.set('IDProof', 'a', None)
+        token = self.worker.token()
+        self.other.invalidate('IDProof', 'a')
+        self.assertIs(self.worker.get('IDProof', 'a'), MISSING)
+
+        self.worker.set('IDProof', 'a', {'stale': ['1']}, token)
+        self.assertIs(self.other.get('IDProof', 'a'), MISSING)
+
+        self.worker.set('IDProof', 'a', {'fresh': ['1']}, self.worker.token())
+        self.assertEqual(self.other.get('IDProof', 'a'), {'fresh': ['1']})
@@ -0,0 +1,90 @@
+from django.test import SimpleTestCase
+from django.urls import reverse
+
+from ..metrics import Registry
+
+import logging
+import threading
+
+
+class RegistryTests(SimpleTestCase):
+
+    # Disable logging
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.registry = Registry()
+        self.requests = self.registry.counter('test_requests_total', 'Requests.', ('endpoint',))
+        self.duration = self.registry.histogram('test_duration_seconds', 'Duration.', ('operation',), buckets=(0.1, 1.0))
+
+    # Reenable logging
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    # Test counts from other threads survive the threads exiting
+    def test_threads(self):
+        def work():
+            for i in range(100):
+                self.requests.inc('find_key')
+
+        threads = [threading.Thread(target=work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.requests.inc('add_key', value=2)
+
+        totals = self.registry.collect()
+        self.assertEqual(totals[('test_requests_total', ('find_key',))], 400)
+        self.assertEqual(totals[('test_requests_total', ('add_key',))], 2)
+        self.assertEqual(self.registry.collect()[('test_requests_total', ('find_key',))], 400)
+
+    # Test histogram buckets render cumulatively
+    def test_histogram(self):
+        self.duration.observe(0.05, 'search')
+        self.duration.observe(0.5, 'search')
+        self.duration.observe(5, 'search')
+
+        text = self.registry.render()
+        self.assertIn('# TYPE test_duration_seconds histogram', text)
+        self.assertIn('test_duration_seconds_bucket{operation="search",le="0.1"} 1', text)
+        self.assertIn('test_duration_seconds_bucket{operation="search",le="1.0"} 2', text)
+        self.assertIn('test_duration_seconds_bucket{operation="search",le="+Inf"} 3', text)
+        self.assertIn('test_duration_seconds_count{operation="search"} 3', text)
+        self.assertIn('test_duration_seconds_sum{operation="search"} 5.55', text)
+
+    # Test collectors and label escaping
+    def test_collector(self):
+        self.registry.register_collector(lambda: [
+            ('test_connections', 'gauge', 'Connections.', [({'pool': 'a"b'}, 3)]),
+        ])
+        self.assertIn('test_connections{pool="a\\"b"} 3', self.registry.render())
+
+
+class MetricsViewTests(SimpleTestCase):
+
+    # Disable logging
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    # Reenable logging
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    # Test requests show up in the scrape
+    def test_metrics(self):
+        self.client.post(reverse('add_key'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('exclusionlist_http_requests_total{endpoint="add_key",method="POST",status="400"}',
+                      response.content.decode())
+        self.assertIn('# TYPE exclusionlist_ldap_operation_duration_seconds histogram', response.content.decode())
+
+    # Test POST not allowed
+    def test_post(self):
+        response = self.client.post(reverse('metrics'))
+        self.assertEqual(response.status_code, 405)
+
+    # Test the scrape and readiness paths end in a slash like the other routes
+    def test_paths(self):
+        self.assertEqual(reverse('metrics'), '/metrics/')
+        self.assertEqual(reverse('ready'), '/ready/')
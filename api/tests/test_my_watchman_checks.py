@@ -1,13 +1,18 @@
+from django.conf import settings
 from django.test import SimpleTestCase
 
+from .. import my_watchman_checks
+from ..backends import MemoryBackend, set_backend
+
 import logging
 
 
 class HealthCheckTests(SimpleTestCase):
 
-    # Disable logging
+    # Disable logging and forget earlier checks
     def setUp(self):
         logging.disable(logging.CRITICAL)
+        my_watchman_checks._last_check = None
 
     # Reenable logging
     def tearDown(self):
@@ -23,3 +28,38 @@ class HealthCheckTests(SimpleTestCase):
     def test_health(self):
         response = self.client.get('/health/')
         self.assertEqual(response.status_code, 200)
+
+    # Test a second check inside the TTL reuses the first result
+    def test_cached(self):
+        first = self.client.get('/health/').json()['ldap']
+        second = self.client.get('/health/').json()['ldap']
+        self.assertNotIn('cached_for', first)
+        self.assertIn('cached_for', second)
+        self.assertEqual(first['ok'], second['ok'])
+
+
+class OfflineHealthCheckTests(SimpleTestCase):
+
+    # Disable logging, forget earlier checks and use an in-memory backend
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        my_watchman_checks._last_check = None
+        self.previous = set_backend(MemoryBackend(settings.EXC_LIST_BACKEND_LDIF))
+
+    # Reenable logging, put the backend back and forget its check
+    def tearDown(self):
+        set_backend(self.previous)
+        my_watchman_checks._last_check = None
+        logging.disable(logging.NOTSET)
+
+    # Test the check probes the configured backend rather than binding to LDAP_URI
+    def test_health(self):
+        response = self.client.get('/health/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['ldap'], {
+            'ok': True,
+            'backend': 'MemoryBackend',
+            'breaker': 'closed',
+            'checked': 'probe',
+            'probe_ms': response.json()['ldap']['probe_ms'],
+        })
@@ -0,0 +1,112 @@
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from ldap3 import Server, Connection, MOCK_SYNC
+
+from .. import ou_snapshot
+from ..backends import MockLDAPBackend, set_backend
+from ..exc_list_manager import exc_list_add_key, exc_list_add_keys, exc_list_find_umid
+from ..ldap_pool import ConnectionPool
+from ..ou_snapshot import OUSnapshot
+
+import os
+import logging
+
+ADMIN_DN = 'cn=admin,dc=umich,dc=edu'
+ADMIN_PW = 'secret'
+BASE = 'ou=Admin,ou=ExclusionList,dc=umich,dc=edu'
+
+
+class OUSnapshotTests(SimpleTestCase):
+
+    # Disable logging and seed a mock directory
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        server = Server('mock')
+        self.seeder = Connection(server, ADMIN_DN, ADMIN_PW, client_strategy=MOCK_SYNC)
+        self.seeder.strategy.add_entry(ADMIN_DN, {'userPassword': ADMIN_PW, 'objectClass': 'person'})
+        self.seeder.strategy.add_entry(BASE, {'objectClass': 'organizationalUnit'})
+        for umid in ('00133700', '00133701', '00133702'):
+            self._add(umid, '20180101000000Z')
+
+        # Mock strategies only decode attribute values when names are checked
+        self.pool = ConnectionPool('ldap://mock', ADMIN_DN, ADMIN_PW,
+                                   server=server, client_strategy=MOCK_SYNC, check_names=True)
+        self.snapshot = OUSnapshot('Admin', self.pool, page_size=2)
+
+    # Reenable logging
+    def tearDown(self):
+        self.pool.close()
+        logging.disable(logging.NOTSET)
+
+    def _add(self, umid, timestamp):
+        self.seeder.strategy.add_entry('umichExcListName={},{}'.format(umid, BASE), {
+            'objectClass': ['top', 'umichExcListText'],
+            'umichExcListName': umid,
+            'modifyTimestamp': timestamp,
+        })
+
+    # Test a full paged load
+    def test_load(self):
+        self.assertFalse(self.snapshot.fresh())
+        self.snapshot.sync()
+
+        self.assertTrue(self.snapshot.fresh())
+        self.assertEqual(self.snapshot.stats()['entries'], 3)
+        self.assertIn('umichExcListName', self.snapshot.get('00133701'))
+        self.assertNotIn('modifyTimestamp', self.snapshot.get('00133701'))
+        self.assertIsNone(self.snapshot.get('00111100'))
+
+    # Test incremental refresh picks up newer entries
+    def test_refresh(self):
+        self.snapshot.sync()
+        self._add('00133703', '20180102000000Z')
+        self.snapshot.sync()
+
+        self.assertIsNotNone(self.snapshot.get('00133703'))
+        self.assertEqual(self.snapshot.stats()['high_water'], '20180102000000Z')
+
+    # Test staleness bound and local deletes
+    def test_stale_and_discard(self):
+        self.snapshot.sync()
+        self.snapshot.discard('00133700')
+        self.assertIsNone(self.snapshot.get('00133700'))
+
+        self.snapshot.max_staleness = -1
+        self.assertFalse(self.snapshot.fresh())
+
+
+@override_settings(LDAP_USERNAME=ADMIN_DN, LDAP_PW=ADMIN_PW, EXC_LIST_SNAPSHOT_ENABLED=True,
+                   EXC_LIST_WRITE_BEHIND=False)
+class OUSnapshotManagerTests(SimpleTestCase):
+
+    # Disable logging and serve ou=Admin from a loaded snapshot of a mock directory
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.backend = MockLDAPBackend(settings.EXC_LIST_BACKEND_LDIF)
+        self.previous = set_backend(self.backend)
+        self.snapshot = OUSnapshot('Admin', self.backend.read_pool)
+        self.snapshot.sync()
+        self.previous_snapshot = ou_snapshot._snapshot, ou_snapshot._snapshot_pid
+        ou_snapshot._snapshot, ou_snapshot._snapshot_pid = self.snapshot, os.getpid()
+
+    # Reenable logging and put the backend and snapshot back
+    def tearDown(self):
+        ou_snapshot._snapshot, ou_snapshot._snapshot_pid = self.previous_snapshot
+        set_backend(self.previous)
+        for pool in (self.backend.pool, self.backend.async_pool, self.backend.multiplexed_pool):
+            pool.close()
+        logging.disable(logging.NOTSET)
+
+    # Test an Admin add is found straight away, before the snapshot refreshes
+    def test_add_then_find(self):
+        self.assertIsNone(self.snapshot.get('00133799'))
+        exc_list_add_key('00133799', 'Admin')
+        self.assertEqual(exc_list_find_umid('00133799')['umichExcListBadAttempts'], ['1'])
+        exc_list_add_key('00133799', 'Admin')
+        self.assertEqual(exc_list_find_umid('00133799')['umichExcListBadAttempts'], ['2'])
+
+    # Test batch Admin adds are found straight away
+    def test_add_keys_then_find(self):
+        exc_list_add_keys(['00133798', '00133799'], 'Admin')
+        self.assertEqual(exc_list_find_umid('00133798')['umichExcListName'], ['00133798'])
+        self.assertEqual(exc_list_find_umid('00133799')['umichExcListBadAttempts'], ['1'])
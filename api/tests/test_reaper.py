@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.test import SimpleTestCase
+
+from ..backends import MemoryBackend, exc_list_timestamp, set_backend
+from ..lookup_cache import get_cache
+from ..reaper import Reaper, RateLimiter
+
+import time
+import logging
+
+
+class ReaperTests(SimpleTestCase):
+
+    # Disable logging and reap an in-memory backend with old and new entries
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.backend = MemoryBackend(settings.EXC_LIST_BACKEND_LDIF)
+        old = [exc_list_timestamp(time.gmtime(time.time() - 7200))]
+        for n in range(7):
+            self.backend.increment('old-key-{}'.format(n), 'IDProof')
+            self.backend._entries[('IDProof', 'old-key-{}'.format(n))]['umichExcListTimestamp'] = old
+        self.backend.increment('new-key', 'IDProof')
+        self.previous = set_backend(self.backend)
+        get_cache().clear()
+
+    # Reenable logging and put the backend back
+    def tearDown(self):
+        set_backend(self.previous)
+        get_cache().clear()
+        logging.disable(logging.NOTSET)
+
+    # Test only entries past the retention period are deleted
+    def test_run_once(self):
+        reaper = Reaper(retention=3600, rate=0, workers=2, page_size=3)
+        report = reaper.run_once(dry_run=True)
+        self.assertEqual((report['found'], report['deleted']), (7, 0))
+
+        report = reaper.run_once()
+        self.assertEqual((report['found'], report['deleted'], report['failed']), (7, 7, []))
+        self.assertIsNone(self.backend.search('old-key-0', 'IDProof'))
+        self.assertIsNotNone(self.backend.search('new-key', 'IDProof'))
+
+    # Test the limit and that Admin is never reaped
+    def test_limit(self):
+        report = Reaper(retention=3600, rate=0, page_size=5).run_once(limit=4)
+        self.assertEqual((report['found'], report['deleted']), (4, 4))
+        with self.assertRaises(ValueError):
+            Reaper('Admin')
+
+    # Test only the process holding the lease reaps in an interval, another takes it once it lapses
+    def test_lease(self):
+        first = Reaper(retention=3600, rate=0, interval=60, lease='exclist')
+        second = Reaper(retention=3600, rate=0, interval=60, lease='exclist')
+        second._owner = 'other-host:1'
+        try:
+            self.assertEqual(first.run_if_leader()['deleted'], 7)
+            self.assertIsNone(second.run_if_leader())
+            self.assertIsNone(first.run_if_leader())
+
+            caches['exclist'].delete('reaper:IDProof')
+            self.assertEqual(second.run_if_leader()['found'], 0)
+            self.assertEqual(caches['exclist'].get('reaper:IDProof'), 'other-host:1')
+        finally:
+            caches['exclist'].delete('reaper:IDProof')
+
+    # Test the rate limit holds deletes back
+    def test_rate_limiter(self):
+        limiter = RateLimiter(100)
+        start = time.monotonic()
+        for n in range(15):
+            limiter.acquire(10)
+        self.assertGreaterEqual(time.monotonic() - start, 0.45)
@@ -1,6 +1,6 @@
 from django.test import SimpleTestCase
 
-from ..serializers import ExcListUMIDSerializer, ExcListKeySerializer
+from ..serializers import ExcListUMIDSerializer, ExcListKeySerializer, ExcListKeysSerializer
 
 
 class UMIDSerializerTests(SimpleTestCase):
@@ -46,3 +46,53 @@ class KeySerializerTests(SimpleTestCase):
         self.assertFalse(serializer.is_valid())
         self.assertEqual(serializer.errors['key'], ['This field is required.'])
 
+
+class KeysSerializerTests(SimpleTestCase):
+
+    # Test validation
+    def test_valid_data(self):
+        keys = ['username', 'user@example.com', 'device-0001']
+        serializer = ExcListKeysSerializer(data={
+            'keys': keys,
+        })
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.validated_data['keys'], keys)
+
+    # Test for all required fields
+    def test_blank_data(self):
+        serializer = ExcListKeysSerializer(data={})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['keys'], ['This field is required.'])
+
+    # Test for an empty list
+    def test_empty_list(self):
+        serializer = ExcListKeysSerializer(data={
+            'keys': [],
+        })
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['keys'], ['Enter at least one key.'])
+
+
+class ResultSerializerTests(SimpleTestCase):
+
+    # Test repeated and comma separated fields
+    def test_fields(self):
+        serializer = ExcListKeySerializer(data={
+            'key': 'my-key',
+            'fields': ['umichExcListBadAttempts, umichExcListTimestamp', 'umichExcListName'],
+        })
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.validated_data['fields'],
+                         ['umichExcListBadAttempts', 'umichExcListTimestamp', 'umichExcListName'])
+        self.assertEqual(serializer.validated_data['format'], 'full')
+
+    # Test invalid attribute names and formats
+    def test_invalid_data(self):
+        serializer = ExcListUMIDSerializer(data={
+            'umid': '00123400',
+            'fields': ['(objectClass=*)'],
+            'format': 'terse',
+        })
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['fields'], ['Enter a valid attribute name.'])
+        self.assertIn('format', serializer.errors)
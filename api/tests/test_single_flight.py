@@ -0,0 +1,183 @@
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+from .. import exc_list_manager
+from ..backends import MemoryBackend, set_backend
+from ..exc_list_manager import exc_list_find_key, exc_list_delete_key, ExcListError
+from ..lookup_cache import get_cache
+from ..single_flight import SingleFlight, get_flights
+from ..write_behind import IncrementBuffer
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+import threading
+import time
+import logging
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('Timed out waiting')
+        time.sleep(0.001)
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.gate = threading.Event()
+        self.calls = 0
+
+    def call(self, result=None, error=None):
+        def fn():
+            self.calls += 1
+            self.gate.wait(5)
+            if error:
+                raise error
+            return result
+        return fn
+
+    def concurrently(self, n, fn, key='k'):
+        def do():
+            try:
+                return self.flights.do(key, fn)
+            except ValueError as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            futures = [executor.submit(do) for i in range(n)]
+            wait_for(lambda: self.flights.stats()['shared'] == n - 1)
+            self.gate.set()
+            return [future.result() for future in futures]
+
+    # Test concurrent callers share one call and each gets its own copy of the result
+    def test_shared_result(self):
+        results = self.concurrently(5, self.call({'umichExcListName': ['k']}))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{'umichExcListName': ['k']}] * 5)
+        self.assertEqual(len({id(result) for result in results}), 5)
+        self.assertEqual(self.flights.stats(), {'leaders': 1, 'shared': 4, 'in_flight': 0})
+
+    # Test a caller changing its result in place does not change what the others get
+    def test_result_changed(self):
+        def do():
+            result = self.flights.do('k', self.call({'n': 1}))
+            result['n'] += 1
+            return result
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            futures = [executor.submit(do) for i in range(5)]
+            wait_for(lambda: self.flights.stats()['shared'] == 4)
+            self.gate.set()
+            self.assertEqual([future.result() for future in futures], [{'n': 2}] * 5)
+
+    # Test the exception of the call is raised to every caller
+    def test_shared_exception(self):
+        error = ValueError('down')
+        results = self.concurrently(3, self.call(error=error))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [error] * 3)
+
+    # Test callers after forget, or with another tag, make their own call
+    def test_forget_and_tag(self):
+        leader = threading.Thread(target=self.flights.do, args=('k', self.call('old')))
+        leader.start()
+        wait_for(lambda: self.calls == 1)
+        self.assertEqual(self.flights.do('k', lambda: 'other', tag=('cn',)), 'other')
+        self.flights.forget('k')
+        self.assertEqual(self.flights.do('k', lambda: 'new'), 'new')
+        self.gate.set()
+        leader.join()
+        self.assertEqual(self.flights.stats(), {'leaders': 3, 'shared': 0, 'in_flight': 0})
+
+    # Test coroutines on one loop share one await
+    def test_async(self):
+        async def search():
+            self.calls += 1
+            await asyncio.sleep(0.01)
+            return ['k']
+
+        async def main():
+            return await asyncio.gather(*[self.flights.do_async('k', search) for i in range(4)])
+
+        results = asyncio.run(main())
+        self.assertEqual(results, [['k']] * 4)
+        self.assertEqual(len({id(result) for result in results}), 4)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flights.stats()['in_flight'], 0)
+
+
+class SingleFlightManagerTests(SimpleTestCase):
+
+    # Disable logging and the lookup cache and hold the answers of an in-memory backend at a gate
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.backend = MemoryBackend(settings.EXC_LIST_BACKEND_LDIF)
+        self.gate = threading.Event()
+        self.searches = 0
+        search = self.backend.search
+
+        def gated(name, ou, attributes=None):
+            self.searches += 1
+            result = search(name, ou, attributes)
+            self.gate.wait(5)
+            return result
+
+        self.backend.search = gated
+        self.previous = set_backend(self.backend)
+        self.ttls, get_cache().ttls = get_cache().ttls, {}
+
+    # Reenable logging and put the backend and cache back
+    def tearDown(self):
+        set_backend(self.previous)
+        get_cache().ttls = self.ttls
+        get_cache().clear()
+        logging.disable(logging.NOTSET)
+
+    # Test concurrent find_key misses for a key cost one search
+    def test_find_key(self):
+        self.backend.increment('flight-key', 'IDProof')
+        shared = get_flights().stats()['shared']
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            futures = [executor.submit(exc_list_find_key, 'Flight-Key') for i in range(6)]
+            wait_for(lambda: get_flights().stats()['shared'] - shared == 5)
+            self.gate.set()
+            results = [future.result() for future in futures]
+        self.assertEqual(self.searches, 1)
+        self.assertEqual({result['umichExcListBadAttempts'][0] for result in results}, {'1'})
+
+        # A search started before a delete is not joined after it
+        self.gate.clear()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            before = executor.submit(exc_list_find_key, 'flight-key')
+            wait_for(lambda: self.searches == 2)
+            exc_list_delete_key('flight-key')
+            after = executor.submit(exc_list_find_key, 'flight-key')
+            wait_for(lambda: self.searches == 3)
+            self.gate.set()
+            self.assertEqual(before.result()['umichExcListBadAttempts'], ['1'])
+            with self.assertRaises(ExcListError):
+                after.result()
+
+    # Test increments still in the write-behind buffer are added once to each caller's result
+    @override_settings(EXC_LIST_WRITE_BEHIND=True)
+    def test_find_key_pending(self):
+        self.backend.increment('pending-key', 'IDProof', 5)
+        buffer = IncrementBuffer(lambda key, ou, delta: None)
+        for i in range(3):
+            buffer.add('pending-key', 'IDProof')
+        previous = exc_list_manager._write_buffer, exc_list_manager._write_buffer_pid
+        exc_list_manager._write_buffer, exc_list_manager._write_buffer_pid = buffer, os.getpid()
+        try:
+            shared = get_flights().stats()['shared']
+            with ThreadPoolExecutor(max_workers=6) as executor:
+                futures = [executor.submit(exc_list_find_key, 'pending-key') for i in range(6)]
+                wait_for(lambda: get_flights().stats()['shared'] - shared == 5)
+                self.gate.set()
+                results = [future.result() for future in futures]
+        finally:
+            exc_list_manager._write_buffer, exc_list_manager._write_buffer_pid = previous
+        self.assertEqual([result['umichExcListBadAttempts'] for result in results], [['8']] * 6)
@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.test import SimpleTestCase
 from django.urls import reverse
 
+from ..backends import MemoryBackend, ExcListError, set_backend
+
 import logging
 
 
@@ -109,6 +112,46 @@ class BruteForceListFindTests(SimpleTestCase):
         self.assertEqual(response.json()['status'], 404)
 
 
+class BruteForceListBatchFindTests(SimpleTestCase):
+
+    # Disable logging
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    # Reenable logging
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    # Test GET not allowed
+    def test_get(self):
+        response = self.client.get(reverse('find_keys'))
+        self.assertEqual(response.status_code, 405)
+
+    # Test 400 on empty post
+    def test_bad_request(self):
+        response = self.client.post(reverse('find_keys'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('This field is required.', str(response.content))
+
+    # Test 200 with a hit and a miss
+    def test_find_keys(self):
+        key = 'this-is-a-BATCH-FIND-Test'
+        missing = 'do-not-find-me'
+
+        # Create the entry so we can find it
+        self.client.post(reverse('delete_key'), {'key': key})
+        self.client.post(reverse('add_key'), {'key': key})
+
+        response = self.client.post(reverse('find_keys'), {'keys': [key, missing]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[key]['umichExcListName'][0], key)
+        self.assertEqual(response.json()[missing]['message'], 'not_found')
+        self.assertEqual(response.json()[missing]['status'], 404)
+
+        # Cleanup after ourselves
+        self.client.post(reverse('delete_key'), {'key': key})
+
+
 class BruteForceListDeleteTests(SimpleTestCase):
 
     # Disable logging
@@ -151,6 +194,66 @@ class BruteForceListDeleteTests(SimpleTestCase):
         self.assertEqual(response.json()['message'], 'noSuchObject')
 
 
+class BruteForceListBatchWriteTests(SimpleTestCase):
+
+    # Disable logging
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    # Reenable logging
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    # Test GET not allowed
+    def test_get(self):
+        self.assertEqual(self.client.get(reverse('add_keys')).status_code, 405)
+        self.assertEqual(self.client.get(reverse('delete_keys')).status_code, 405)
+
+    # Test 400 on empty post
+    def test_bad_request(self):
+        for name in ('add_keys', 'delete_keys'):
+            response = self.client.post(reverse(name))
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('This field is required.', str(response.content))
+
+    # Test 200 successful batch add and delete
+    def test_add_delete_keys(self):
+        data = {
+            'keys': ['this-is-a-BATCH-Test-1', 'this-is-a-BATCH-Test-2'],
+        }
+
+        # Delete the entries in case they exist
+        self.client.post(reverse('delete_keys'), data)
+
+        response = self.client.post(reverse('add_keys'), data)
+        self.assertEqual(response.status_code, 200)
+        for key in data['keys']:
+            self.assertTrue(response.json()['results'][key]['dn'])
+
+        response = self.client.post(reverse('delete_keys'), data)
+        self.assertEqual(response.status_code, 200)
+        for key in data['keys']:
+            self.assertEqual(response.json()['results'][key]['message'], 'success')
+
+
+    # Test 502 with the message when the directory refuses the whole batch
+    def test_batch_error(self):
+        backend = MemoryBackend(settings.EXC_LIST_BACKEND_LDIF)
+
+        def refused(keys, ou):
+            raise ExcListError('insufficientAccessRights')
+
+        backend.increment_many = backend.delete_many = refused
+        previous = set_backend(backend)
+        try:
+            for name in ('add_keys', 'delete_keys'):
+                response = self.client.post(reverse(name), {'keys': ['this-is-a-BATCH-Test-1']})
+                self.assertEqual(response.status_code, 502)
+                self.assertEqual(response.json(), {'message': 'insufficientAccessRights', 'status': 502})
+        finally:
+            set_backend(previous)
+
+
 class UMIDExcListFindTests(SimpleTestCase):
 
     # Disable logging
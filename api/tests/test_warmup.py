@@ -0,0 +1,106 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.signals import request_started
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from ldap3 import Server, Connection, MOCK_SYNC
+
+from .. import warmup
+from ..backends import LDAPBackend, MemoryBackend, set_backend
+from ..ldap_pool import ConnectionPool
+from ..warmup import Warmup
+
+import os
+import logging
+
+ADMIN_DN = 'cn=admin,dc=umich,dc=edu'
+ADMIN_PW = 'secret'
+
+
+class WarmupTests(SimpleTestCase):
+
+    # Disable logging and use a directory backend over a mock pool
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.pool = ConnectionPool('ldap://mock', ADMIN_DN, ADMIN_PW, size=4,
+                                   server=Server('mock'), client_strategy=MOCK_SYNC)
+        self.seeder = Connection(self.pool.server, ADMIN_DN, ADMIN_PW, client_strategy=MOCK_SYNC)
+        self.previous = set_backend(LDAPBackend(pool=self.pool))
+
+    # Reenable logging and put the backend back
+    def tearDown(self):
+        set_backend(self.previous)
+        self.pool.close()
+        logging.disable(logging.NOTSET)
+
+    # Test the warm-up leaves bound connections idle in the pool and records its steps
+    @override_settings(EXC_LIST_ASYNC_VIEWS=False)
+    def test_run(self):
+        self.seeder.strategy.add_entry(ADMIN_DN, {'userPassword': ADMIN_PW, 'objectClass': 'person'})
+        process = Warmup(connections=2, preload_snapshot=False, timeout=5)
+        self.assertFalse(process.ready())
+        process.run()
+
+        stats = process.stats()
+        self.assertTrue(stats['ready'])
+        self.assertEqual(list(stats['steps']), ['backend', 'bind', 'snapshot'])
+        self.assertEqual(stats['errors'], {})
+        self.assertEqual(self.pool.stats()['idle'], 2)
+        self.assertEqual(self.pool.stats()['created'], 2)
+
+    # Test a step that keeps failing is retried until the timeout, then the process reports ready
+    def test_timeout(self):
+        process = Warmup(connections=2, preload_snapshot=False, timeout=0.2, retry_interval=0.05)
+        process.run()
+
+        stats = process.stats()
+        self.assertTrue(stats['ready'])
+        self.assertNotIn('bind', stats['steps'])
+        self.assertIn('bind', stats['errors'])
+
+
+class ReadyViewTests(SimpleTestCase):
+
+    # Disable logging and use an in-memory backend
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.previous = set_backend(MemoryBackend(settings.EXC_LIST_BACKEND_LDIF))
+
+    # Reenable logging, put the backend back and forget the warm-up
+    def tearDown(self):
+        set_backend(self.previous)
+        warmup._warmup = warmup._warmup_pid = None
+        logging.disable(logging.NOTSET)
+
+    # Test ready answers 503 until the warm-up of the process has finished
+    @override_settings(EXC_LIST_WARMUP=True)
+    def test_ready(self):
+        warmup._warmup = Warmup(preload_snapshot=False)
+        warmup._warmup_pid = os.getpid()
+        response = self.client.get(reverse('ready'))
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.json()['ready'])
+
+        warmup._warmup.run()
+        response = self.client.get(reverse('ready'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['ready'])
+        self.assertIn('exclusionlist_ready 1', self.client.get(reverse('metrics')).content.decode('utf-8'))
+
+    # Test the app only starts the warm-up with the first request, never while loading
+    @override_settings(EXC_LIST_WARMUP=True)
+    def test_started_by_request(self):
+        apps.get_app_config('api').ready()
+        try:
+            self.assertIsNone(warmup._warmup)
+            request_started.send(sender=self.__class__)
+            self.assertTrue(warmup._warmup.wait(5))
+        finally:
+            request_started.disconnect(dispatch_uid='api.warmup.start_warmup')
+
+    # Test a process without warm-up is always ready
+    @override_settings(EXC_LIST_WARMUP=False)
+    def test_no_warmup(self):
+        response = self.client.get(reverse('ready'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'ready': True})
@@ -0,0 +1,141 @@
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+from .. import exc_list_manager
+from ..backends import MemoryBackend, set_backend, exc_list_dn
+from ..exc_list_manager import exc_list_add_key, exc_list_find_key, _exc_list_flush_increment
+from ..lookup_cache import get_cache, MISSING
+from ..write_behind import IncrementBuffer
+
+import os
+import logging
+
+
+class IncrementBufferTests(SimpleTestCase):
+
+    # Disable logging and record flushed deltas
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.flushed = []
+        self.fail = False
+        self.buffer = IncrementBuffer(self._flush, max_keys=2)
+
+    # Reenable logging
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def _flush(self, key, ou, delta):
+        if self.fail:
+            raise RuntimeError('directory down')
+        self.flushed.append((key, ou, delta))
+        return {'umichExcListName': [key], 'umichExcListBadAttempts': [str(delta)]}
+
+    # Test increments for the same key coalesce into one write
+    def test_coalesce(self):
+        for i in range(5):
+            self.assertTrue(self.buffer.add('Hot-Key', 'IDProof'))
+        self.assertEqual(self.buffer.pending('hot-key', 'IDProof')[0], 5)
+
+        self.buffer.flush()
+        self.assertEqual(self.flushed, [('Hot-Key', 'IDProof', 5)])
+        self.assertEqual(self.buffer.pending('hot-key', 'IDProof')[0], 0)
+        self.assertEqual(self.buffer.stats()['coalesced'], 4)
+
+    # Test the buffer is bounded
+    def test_overflow(self):
+        self.assertTrue(self.buffer.add('a', 'IDProof'))
+        self.assertTrue(self.buffer.add('b', 'IDProof'))
+        self.assertFalse(self.buffer.add('c', 'IDProof'))
+        self.assertTrue(self.buffer.add('a', 'IDProof'))
+        self.assertEqual(self.buffer.stats()['overflows'], 1)
+
+    # Test failed flushes are kept for the next interval
+    def test_failed_flush(self):
+        self.buffer.add('a', 'IDProof')
+        self.fail = True
+        self.buffer.flush()
+        self.buffer.add('a', 'IDProof')
+        self.assertEqual(self.buffer.pending('a', 'IDProof')[0], 2)
+
+        self.fail = False
+        self.buffer.stop()
+        self.assertEqual(self.flushed, [('a', 'IDProof', 2)])
+        self.assertEqual(self.buffer.stats()['failures'], 1)
+
+    # Test deletes drop buffered deltas
+    def test_discard(self):
+        self.buffer.add('a', 'IDProof')
+        self.buffer.discard('A', 'IDProof')
+        self.buffer.flush()
+        self.assertEqual(self.flushed, [])
+
+    # Test the entry written by a flush is known with no delta left, and an older read does not replace it
+    def test_known(self):
+        self.assertEqual(self.buffer.known('a', 'IDProof'), (MISSING, 0, None))
+        self.buffer.add('a', 'IDProof')
+        self.buffer.remember('a', 'IDProof', None, replace=False)
+        self.assertEqual(self.buffer.known('A', 'IDProof')[:2], (None, 1))
+
+        self.buffer.flush()
+        attrs = {'umichExcListName': ['a'], 'umichExcListBadAttempts': ['1']}
+        self.assertEqual(self.buffer.known('a', 'IDProof'), (attrs, 0, None))
+        self.buffer.remember('a', 'IDProof', None, replace=False)
+        self.assertEqual(self.buffer.known('a', 'IDProof')[0], attrs)
+
+        self.buffer.discard('a', 'IDProof')
+        self.assertIs(self.buffer.known('a', 'IDProof')[0], MISSING)
+
+    # Test only max_keys entries are kept, the least recently remembered go first
+    def test_known_bounded(self):
+        for key in ('a', 'b', 'c'):
+            self.buffer.remember(key, 'IDProof', None)
+        self.assertIs(self.buffer.known('a', 'IDProof')[0], MISSING)
+        self.assertIsNone(self.buffer.known('c', 'IDProof')[0])
+
+
+class WriteBehindManagerTests(SimpleTestCase):
+
+    # Disable logging and the lookup cache, count the searches of an in-memory backend
+    # and buffer into an unstarted buffer that flushes on demand
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.backend = MemoryBackend(settings.EXC_LIST_BACKEND_LDIF)
+        self.searches = 0
+        search = self.backend.search
+
+        def counted(name, ou, attributes=None):
+            self.searches += 1
+            return search(name, ou, attributes)
+
+        self.backend.search = counted
+        self.previous = set_backend(self.backend)
+        self.ttls, get_cache().ttls = get_cache().ttls, {}
+        self.buffer = IncrementBuffer(_exc_list_flush_increment)
+        self.previous_buffer = exc_list_manager._write_buffer, exc_list_manager._write_buffer_pid
+        exc_list_manager._write_buffer, exc_list_manager._write_buffer_pid = self.buffer, os.getpid()
+
+    # Reenable logging and put the backend, cache and buffer back
+    def tearDown(self):
+        exc_list_manager._write_buffer, exc_list_manager._write_buffer_pid = self.previous_buffer
+        get_cache().ttls = self.ttls
+        set_backend(self.previous)
+        logging.disable(logging.NOTSET)
+
+    # Test buffered adds search once for a new key, and not at all once a flush has written it
+    @override_settings(EXC_LIST_WRITE_BEHIND=True)
+    def test_add_key_searches(self):
+        self.assertEqual(exc_list_add_key('buffered-key'), {'dn': exc_list_dn('buffered-key', 'IDProof')})
+        for i in range(9):
+            response = exc_list_add_key('buffered-key')
+        self.assertEqual(response['umichExcListBadAttempts'], ['10'])
+        self.assertEqual(self.searches, 1)
+
+        self.buffer.flush()
+        for i in range(5):
+            response = exc_list_add_key('buffered-key')
+        self.assertEqual(response['umichExcListBadAttempts'], ['15'])
+        self.assertEqual(self.searches, 1)
+
+        self.buffer.flush()
+        self.assertEqual(self.backend.search('buffered-key', 'IDProof')['umichExcListBadAttempts'], ['15'])
+        self.assertEqual(exc_list_find_key('buffered-key')['umichExcListBadAttempts'], ['15'])
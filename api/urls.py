@@ -1,10 +1,25 @@
+from django.conf import settings
 from django.conf.urls import url
 from django.urls import path
 from . import views
 
+# The four single-key endpoints can be served by the async views under ASGI,
+# or by the fast path views that skip DRF
+if settings.EXC_LIST_ASYNC_VIEWS:
+    from . import async_views as single_views
+elif settings.EXC_LIST_FAST_VIEWS:
+    from . import fast_views as single_views
+else:
+    single_views = views
+
 urlpatterns = [
-    path('bruteforcelist/add/', views.add_key, name='add_key'),
-    path('bruteforcelist/find/', views.find_key, name='find_key'),
-    path('bruteforcelist/delete/', views.delete_key, name='delete_key'),
-    path('umidexclist/find/', views.find_umid, name='find_umid'),
+    path('bruteforcelist/add/', single_views.add_key, name='add_key'),
+    path('bruteforcelist/add/batch/', views.add_keys, name='add_keys'),
+    path('bruteforcelist/find/', single_views.find_key, name='find_key'),
+    path('bruteforcelist/find/batch/', views.find_keys, name='find_keys'),
+    path('bruteforcelist/delete/', single_views.delete_key, name='delete_key'),
+    path('bruteforcelist/delete/batch/', views.delete_keys, name='delete_keys'),
+    path('umidexclist/find/', single_views.find_umid, name='find_umid'),
+    path('check/', views.check, name='check'),
+    path('export/', views.export, name='export'),
 ]
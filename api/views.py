@@ -2,14 +2,46 @@ from django.shortcuts import render
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .serializers import ExcListUMIDSerializer, ExcListKeySerializer
-from .exc_list_manager import exc_list_find_umid, exc_list_find_key, exc_list_add_key, exc_list_delete_key, ExcListError
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from django.views.decorators.http import require_GET
+from .serializers import ExcListUMIDSerializer, ExcListKeySerializer, ExcListKeysSerializer, ExcListCheckSerializer, ExcListExportSerializer
+from .exc_list_manager import exc_list_find_umid, exc_list_find_key, exc_list_find_keys, exc_list_check, exc_list_add_key, exc_list_add_keys, exc_list_delete_key, exc_list_delete_keys, exc_list_compact, ExcListError
+from .export import export_lines
+from .circuit_breaker import ExcListUnavailable
+from .hot_keys import ExcListThrottled
+from .metrics import registry, count_error
+from .log_pipeline import sampled
+from .warmup import start_warmup
 import logging
+import re
 import traceback
 
 logger = logging.getLogger(__name__)
 
 
+def _retry_later(e):
+    """The response for an ExcListThrottled or ExcListUnavailable, the client should come back after retry_after"""
+    count_error(e)
+    code = status.HTTP_429_TOO_MANY_REQUESTS if isinstance(e, ExcListThrottled) else status.HTTP_503_SERVICE_UNAVAILABLE
+    return Response({
+        "message": e.message,
+        "status": code,
+        },
+        status=code,
+        headers={'Retry-After': str(e.retry_after)},
+    )
+
+
+def _shape(entry, options):
+    # format=compact is applied last, after any fields projection
+    if options['format'] == 'compact':
+        return exc_list_compact(entry)
+    return entry
+
+
 @api_view(['POST'])
 def find_umid(request):
     """
@@ -17,19 +49,26 @@ def find_umid(request):
     Returns the entry as a json string if a match is found
     """
     try:
-        logger.info('<RESTRequest: {} \'{}\' data={}>'.format(request.method, request.path, request.data))
+        logger.info('<RESTRequest: %s \'%s\' data=%s>', request.method, request.path, request.data,
+                    extra=sampled(request.path, request.data, 'umid'))
         serializer = ExcListUMIDSerializer(data=request.data)
 
         if serializer.is_valid():
-            result = exc_list_find_umid(serializer.data['umid'])
+            options = serializer.validated_data
+            result = _shape(exc_list_find_umid(options['umid'], options.get('fields')), options)
             # Return 200 on a successful match
             response = Response(result)
         else:
             # Return a 400 on invalid input
             response = Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    # Return a 429 for a hot key or a 503 while the directory is failing, both with a Retry-After
+    except (ExcListThrottled, ExcListUnavailable) as e:
+        response = _retry_later(e)
+
     # Return a 404 on a failed match
     except ExcListError as e:
+        count_error(e)
         response = Response({
             "message": e.message,
             "status": 404,
@@ -39,10 +78,12 @@ def find_umid(request):
 
     # Return a 500 on any unexpected exceptions
     except Exception as e:    # pragma: no cover
+        count_error(e)
         response = Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         logger.error(traceback.format_exc())
 
-    logger.info('Return status_code={} response={}'.format(response.status_code, response.data))
+    logger.info('Return status_code=%s response=%s', response.status_code, response.data,
+                extra=sampled(request.path, request.data, 'umid') if response.status_code < 300 else None)
     return response
 
 
@@ -53,20 +94,27 @@ def find_key(request):
     Returns the entry as a json string if a match is found
     """
     try:
-        logger.info('<RESTRequest: {} \'{}\' data={}>'.format(request.method, request.path, request.data))
+        logger.info('<RESTRequest: %s \'%s\' data=%s>', request.method, request.path, request.data,
+                    extra=sampled(request.path, request.data, 'key'))
         serializer = ExcListKeySerializer(data=request.data)
 
         if serializer.is_valid():
             #result = exc_list_find(serializer.data)
-            result = exc_list_find_key(serializer.data['key'])
+            options = serializer.validated_data
+            result = _shape(exc_list_find_key(options['key'], fields=options.get('fields')), options)
             # Return 200 on a successful match
             response = Response(result)
         else:
             # Return a 400 on invalid input
             response = Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    # Return a 429 for a hot key or a 503 while the directory is failing, both with a Retry-After
+    except (ExcListThrottled, ExcListUnavailable) as e:
+        response = _retry_later(e)
+
     # Return a 404 on a failed match
     except ExcListError as e:
+        count_error(e)
         response = Response({
             "message": e.message,
             "status": 404,
@@ -76,10 +124,90 @@ def find_key(request):
 
     # Return a 500 on any unexpected exceptions
     except Exception as e:    # pragma: no cover
+        count_error(e)
+        response = Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        logger.error(traceback.format_exc())
+
+    logger.info('Return status_code=%s response=%s', response.status_code, response.data,
+                extra=sampled(request.path, request.data, 'key') if response.status_code < 300 else None)
+    return response
+
+
+@api_view(['POST'])
+def find_keys(request):
+    """
+    API endpoint that searches the exclusion list for several keys in one request
+    Returns a map of key to entry, or to a not_found message when there is no match
+    """
+    try:
+        logger.info('<RESTRequest: %s \'%s\' data=%s>', request.method, request.path, request.data)
+        serializer = ExcListKeysSerializer(data=request.data)
+
+        if serializer.is_valid():
+            options = serializer.validated_data
+            results = exc_list_find_keys(options['keys'], fields=options.get('fields'))
+            # Return 200 with a per-key result
+            response = Response({
+                key: _shape(entry, options) if entry is not None else {"message": "not_found", "status": 404}
+                for key, entry in results.items()
+            })
+        else:
+            # Return a 400 on invalid input
+            response = Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    # Return a 429 for a hot key or a 503 while the directory is failing, both with a Retry-After
+    except (ExcListThrottled, ExcListUnavailable) as e:
+        response = _retry_later(e)
+
+    # Return a 500 on any unexpected exceptions
+    except Exception as e:    # pragma: no cover
+        count_error(e)
         response = Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         logger.error(traceback.format_exc())
 
-    logger.info('Return status_code={} response={}'.format(response.status_code, response.data))
+    logger.info('Return status_code=%s response=%s', response.status_code, response.data)
+    return response
+
+
+@api_view(['POST'])
+def check(request):
+    """
+    API endpoint that checks an optional umid against ou=Admin and any number of keys against ou=IDProof
+    Returns a verdict per OU, whether any name is listed, and the entry or not_found for each name
+    """
+    try:
+        logger.info('<RESTRequest: %s \'%s\' data=%s>', request.method, request.path, request.data)
+        serializer = ExcListCheckSerializer(data=request.data)
+
+        if serializer.is_valid():
+            options = serializer.validated_data
+            results = exc_list_check(options.get('umid'), options.get('keys', []), fields=options.get('fields'))
+            # Return 200 with the verdict and per-name result of each OU asked about
+            response = Response({
+                ou: {
+                    "listed": any(entry is not None for entry in entries.values()),
+                    "results": {
+                        name: _shape(entry, options) if entry is not None else {"message": "not_found", "status": 404}
+                        for name, entry in entries.items()
+                    },
+                }
+                for ou, entries in results.items()
+            })
+        else:
+            # Return a 400 on invalid input
+            response = Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    # Return a 429 for a hot key or a 503 while the directory is failing, both with a Retry-After
+    except (ExcListThrottled, ExcListUnavailable) as e:
+        response = _retry_later(e)
+
+    # Return a 500 on any unexpected exceptions
+    except Exception as e:    # pragma: no cover
+        count_error(e)
+        response = Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        logger.error(traceback.format_exc())
+
+    logger.info('Return status_code=%s response=%s', response.status_code, response.data)
     return response
 
 
@@ -91,23 +219,78 @@ def add_key(request):
     Returns 200 on a successful add
     """
     try:
-        logger.info('<RESTRequest: {} \'{}\' data={}>'.format(request.method, request.path, request.data))
+        logger.info('<RESTRequest: %s \'%s\' data=%s>', request.method, request.path, request.data,
+                    extra=sampled(request.path, request.data, 'key'))
         serializer = ExcListKeySerializer(data=request.data)
 
         if serializer.is_valid():
-            result = exc_list_add_key(serializer.data['key'])
+            options = serializer.validated_data
+            result = _shape(exc_list_add_key(options['key'], fields=options.get('fields')), options)
             # Return 200 on a successful add
             response = Response(result)
         else:
             # Return a 400 on invalid input
             response = Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    # Return a 429 for a hot key or a 503 while the directory is failing, both with a Retry-After
+    except (ExcListThrottled, ExcListUnavailable) as e:
+        response = _retry_later(e)
+
     # Return a 500 on any unexpected exceptions
     except Exception as e:    # pragma: no cover
+        count_error(e)
         response = Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         logger.error(traceback.format_exc())
 
-    logger.info('Return status_code={} response={}'.format(response.status_code, response.data))
+    logger.info('Return status_code=%s response=%s', response.status_code, response.data,
+                extra=sampled(request.path, request.data, 'key') if response.status_code < 300 else None)
+    return response
+
+
+@api_view(['POST'])
+def add_keys(request):
+    """
+    API endpoint that increments bad attempts for several keys in one request
+    Creates the exc list entries that do not exist
+    Returns 200 with the result for each key and the total time taken
+    """
+    try:
+        logger.info('<RESTRequest: %s \'%s\' data=%s>', request.method, request.path, request.data)
+        serializer = ExcListKeysSerializer(data=request.data)
+
+        if serializer.is_valid():
+            options = serializer.validated_data
+            results, elapsed = exc_list_add_keys(options['keys'], fields=options.get('fields'))
+            # Return 200 with a per-key result and the total time
+            response = Response({
+                "results": {key: _shape(entry, options) for key, entry in results.items()},
+                "elapsed": elapsed,
+            })
+        else:
+            # Return a 400 on invalid input
+            response = Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    # Return a 429 for a hot key or a 503 while the directory is failing, both with a Retry-After
+    except (ExcListThrottled, ExcListUnavailable) as e:
+        response = _retry_later(e)
+
+    # Return a 502 when the directory turns the whole batch down
+    except ExcListError as e:
+        count_error(e)
+        response = Response({
+            "message": e.message,
+            "status": 502,
+            },
+            status=status.HTTP_502_BAD_GATEWAY
+        )
+
+    # Return a 500 on any unexpected exceptions
+    except Exception as e:    # pragma: no cover
+        count_error(e)
+        response = Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        logger.error(traceback.format_exc())
+
+    logger.info('Return status_code=%s response=%s', response.status_code, response.data)
     return response
 
 
@@ -118,7 +301,8 @@ def delete_key(request):
     Returns 200 on a successful delete
     """
     try:
-        logger.info('<RESTRequest: {} \'{}\' data={}>'.format(request.method, request.path, request.data))
+        logger.info('<RESTRequest: %s \'%s\' data=%s>', request.method, request.path, request.data,
+                    extra=sampled(request.path, request.data, 'key'))
         serializer = ExcListKeySerializer(data=request.data)
 
         if serializer.is_valid():
@@ -129,11 +313,121 @@ def delete_key(request):
             # Return a 400 on invalid input
             response = Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    # Return a 429 for a hot key or a 503 while the directory is failing, both with a Retry-After
+    except (ExcListThrottled, ExcListUnavailable) as e:
+        response = _retry_later(e)
+
+    # Return a 500 on any unexpected exceptions
+    except Exception as e:    # pragma: no cover
+        count_error(e)
+        response = Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        logger.error(traceback.format_exc())
+
+    logger.info('Return status_code=%s response=%s', response.status_code, response.data,
+                extra=sampled(request.path, request.data, 'key') if response.status_code < 300 else None)
+    return response
+
+
+@api_view(['POST'])
+def delete_keys(request):
+    """
+    API endpoint that deletes the exc list entries for several keys in one request
+    Returns 200 with the result for each key and the total time taken
+    """
+    try:
+        logger.info('<RESTRequest: %s \'%s\' data=%s>', request.method, request.path, request.data)
+        serializer = ExcListKeysSerializer(data=request.data)
+
+        if serializer.is_valid():
+            results, elapsed = exc_list_delete_keys(serializer.data['keys'])
+            # Return 200 with a per-key result and the total time
+            response = Response({
+                "results": results,
+                "elapsed": elapsed,
+            })
+        else:
+            # Return a 400 on invalid input
+            response = Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    # Return a 429 for a hot key or a 503 while the directory is failing, both with a Retry-After
+    except (ExcListThrottled, ExcListUnavailable) as e:
+        response = _retry_later(e)
+
+    # Return a 502 when the directory turns the whole batch down
+    except ExcListError as e:
+        count_error(e)
+        response = Response({
+            "message": e.message,
+            "status": 502,
+            },
+            status=status.HTTP_502_BAD_GATEWAY
+        )
+
     # Return a 500 on any unexpected exceptions
     except Exception as e:    # pragma: no cover
+        count_error(e)
         response = Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         logger.error(traceback.format_exc())
 
-    logger.info('Return status_code={} response={}'.format(response.status_code, response.data))
+    logger.info('Return status_code=%s response=%s', response.status_code, response.data)
     return response
 
+
+@require_GET
+def export(request):
+    """
+    API endpoint that streams every entry of an OU as NDJSON, gzipped when the client accepts it
+    Takes ou, page_size and a cookie from an earlier export to resume after that page
+    """
+    logger.info('<ExportRequest: %s \'%s\' params=%s>', request.method, request.path, request.GET)
+    serializer = ExcListExportSerializer(data=request.GET)
+    if not serializer.is_valid():
+        # Return a 400 on invalid input
+        return JsonResponse(serializer.errors, status=400)
+
+    options = serializer.validated_data
+    try:
+        lines = export_lines(
+            options['ou'],
+            options.get('page_size', settings.EXC_LIST_EXPORT_PAGE_SIZE),
+            options.get('cookie'),
+        )
+    # Return a 400 on a cookie the directory does not accept
+    except ExcListError as e:
+        count_error(e)
+        return JsonResponse({"message": e.message, "status": 400}, status=400)
+
+    # Return a 500 on any unexpected exceptions
+    except Exception as e:    # pragma: no cover
+        count_error(e)
+        logger.error(traceback.format_exc())
+        return JsonResponse({"message": str(e)}, status=500)
+
+    if re.search(r'\bgzip\b', request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        response = StreamingHttpResponse(compress_sequence(lines), content_type='application/x-ndjson')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response['Content-Disposition'] = 'attachment; filename="exclusionlist-{}.ndjson"'.format(options['ou'])
+    return response
+
+
+@require_GET
+def metrics(request):
+    """
+    Prometheus scrape endpoint, request and LDAP latency histograms plus error and connection counts
+    """
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@require_GET
+def ready(request):
+    """
+    Readiness probe, 503 until this process has warmed up. Liveness is watchman's, under health/
+    """
+    warmup = start_warmup()
+    if warmup is None:
+        return JsonResponse({'ready': True})
+    stats = warmup.stats()
+    return JsonResponse(stats, status=200 if stats['ready'] else 503)
@@ -0,0 +1,170 @@
+"""
+Warm-up of a serving process before it takes traffic.
+
+A fresh worker pays for constructing the backend, the first binds and a cold
+Admin snapshot on its first requests. The warm-up does that work in a
+background thread started by the first request the process gets, usually the
+readiness probe, so management commands never run it: it builds the backend,
+binds connections in each LDAP pool and waits for the first load of the Admin
+snapshot, timing every step. The ready endpoint answers 503 until it has
+finished. A step that fails is retried until timeout; past that the process
+reports ready anyway, since keeping every worker out of rotation while the
+directory is down would turn an outage of the directory into an outage of the
+whole service, and the circuit breaker already answers for it.
+"""
+from django.conf import settings
+
+from .backends import get_backend
+from .metrics import registry
+from .ou_snapshot import get_snapshot
+
+import os
+import threading
+import time
+import traceback
+import logging
+
+logger = logging.getLogger(__name__)
+
+STEPS = ('backend', 'bind', 'snapshot')
+
+
+class Warmup(object):
+
+    def __init__(self, connections=2, preload_snapshot=True, timeout=60, retry_interval=1):
+        self.connections = connections
+        self.preload_snapshot = preload_snapshot
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+
+        self._steps = {}     # step -> seconds it took
+        self._errors = {}    # step -> last error
+        self._started = None
+        self._finished = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _pools(self, backend):
+        pools = [backend.pool]
+        read_pool = backend.read_pool
+        if read_pool is not backend.pool:
+            pools.extend(getattr(read_pool, 'pools', [read_pool]))
+        if settings.EXC_LIST_ASYNC_VIEWS:
+            pools.append(backend.multiplexed_pool)
+        return pools
+
+    def _backend(self, deadline):
+        get_backend()
+
+    def _bind(self, deadline):
+        """Open connections in every pool the requests will use, they go back idle and bound"""
+        backend = get_backend()
+        if backend.pool is None:
+            return
+        for pool in self._pools(backend):
+            conns = []
+            try:
+                for i in range(min(self.connections, pool.size)):
+                    conns.append(pool.acquire(max(0, deadline - time.monotonic())))
+            finally:
+                for conn in conns:
+                    pool.release(conn)
+
+    def _snapshot(self, deadline):
+        snapshot = get_snapshot() if self.preload_snapshot else None
+        if snapshot is not None and not snapshot.wait_loaded(max(0, deadline - time.monotonic())):
+            raise TimeoutError('ou={} was not loaded in time'.format(snapshot.ou))
+
+    def run(self):
+        """Run every step, retrying a failed one until timeout, then mark the process ready"""
+        self._started = time.monotonic()
+        deadline = self._started + self.timeout
+        for step in STEPS:
+            while True:
+                start = time.monotonic()
+                try:
+                    getattr(self, '_{}'.format(step))(deadline)
+                except Exception as e:
+                    with self._lock:
+                        self._errors[step] = str(e)
+                    if time.monotonic() + self.retry_interval >= deadline:
+                        logger.error('Warm-up step {} gave up\n{}'.format(step, traceback.format_exc()))
+                        break
+                    logger.warning('Warm-up step {} failed, retrying: {}'.format(step, e))
+                    time.sleep(self.retry_interval)
+                else:
+                    with self._lock:
+                        self._steps[step] = time.monotonic() - start
+                        self._errors.pop(step, None)
+                    break
+        self._finished = time.monotonic()
+        self._ready.set()
+        logger.info('Warmed up in {:.3f}s: {}'.format(self._finished - self._started, ', '.join(
+            '{} {:.3f}s'.format(step, seconds) for step, seconds in self.stats()['steps'].items())))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name='warmup', daemon=True)
+            self._thread.start()
+
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def stats(self):
+        started, finished = self._started, self._finished
+        with self._lock:
+            return {
+                'ready': self.ready(),
+                'elapsed': None if started is None else (finished or time.monotonic()) - started,
+                'steps': {step: self._steps[step] for step in STEPS if step in self._steps},
+                'errors': dict(self._errors),
+            }
+
+
+_warmup = None
+_warmup_pid = None
+_warmup_lock = threading.Lock()
+
+
+def start_warmup(**kwargs):
+    """
+    Start the warm-up of this process once, or return None when EXC_LIST_WARMUP is off.
+    Connected to request_started, so it only runs in processes that serve requests.
+    """
+    global _warmup, _warmup_pid
+    if not settings.EXC_LIST_WARMUP:
+        return None
+    pid = os.getpid()
+    if _warmup is None or _warmup_pid != pid:
+        with _warmup_lock:
+            if _warmup is None or _warmup_pid != pid:
+                _warmup = Warmup(
+                    connections=settings.EXC_LIST_WARMUP_CONNECTIONS,
+                    preload_snapshot=settings.EXC_LIST_WARMUP_SNAPSHOT,
+                    timeout=settings.EXC_LIST_WARMUP_TIMEOUT,
+                )
+                _warmup.start()
+                _warmup_pid = pid
+    return _warmup
+
+
+def _warmup_metrics():
+    warmup = _warmup if _warmup_pid == os.getpid() else None
+    if warmup is None:
+        return []
+    stats = warmup.stats()
+    return [
+        ('exclusionlist_ready', 'gauge', 'Whether this process has finished warming up.', [
+            ({}, int(stats['ready'])),
+        ]),
+        ('exclusionlist_warmup_seconds', 'gauge', 'Time each warm-up step took, by step.', [
+            ({'step': step}, seconds) for step, seconds in stats['steps'].items()
+        ]),
+    ]
+
+
+registry.register_collector(_warmup_metrics)
@@ -0,0 +1,168 @@
+from .lookup_cache import MISSING
+
+from collections import OrderedDict
+import threading
+import time
+import traceback
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementBuffer(object):
+    """
+    Coalesces bad-attempt increments per key and writes them out on an interval.
+
+    flush(key, ou, delta) is called once per buffered key per interval. Deltas
+    that fail to flush are put back and retried on the next interval. While a
+    delta is being written it still counts as pending, so readers never see an
+    increment disappear between the buffer and the directory.
+
+    The last entry known for each key is kept as well, up to max_keys of them,
+    so an add can be answered with that entry plus the pending delta without a
+    search. flush returns the entry after its write, or None when it cannot
+    tell, which replaces the known entry in the same step as the delta stops
+    being pending.
+    """
+
+    def __init__(self, flush, interval=1.0, max_keys=10000):
+        self._flush = flush
+        self.interval = interval
+        self.max_keys = max_keys
+
+        self._pending = {}      # (ou, lowercased key) -> [key, delta, first_seen]
+        self._in_flight = {}
+        self._entries = OrderedDict()    # (ou, lowercased key) -> last entry known, None for no entry
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._counters = {
+            'increments': 0,
+            'coalesced': 0,
+            'overflows': 0,
+            'flushes': 0,
+            'flushed_keys': 0,
+            'failures': 0,
+        }
+
+    def add(self, key, ou, delta=1):
+        """Buffer an increment, returns False if the buffer is full and the caller should write through"""
+        name = (ou, key.lower())
+        with self._lock:
+            item = self._pending.get(name)
+            if item is None:
+                if len(self._pending) >= self.max_keys:
+                    self._counters['overflows'] += 1
+                    return False
+                self._pending[name] = [key, delta, time.gmtime()]
+            else:
+                item[1] += delta
+                self._counters['coalesced'] += 1
+            self._counters['increments'] += 1
+        return True
+
+    def pending(self, key, ou):
+        """Returns the delta not yet visible in the directory and when the key was first buffered"""
+        with self._lock:
+            return self._pending_locked((ou, key.lower()))
+
+    def _pending_locked(self, name):
+        delta = 0
+        first_seen = None
+        for items in (self._in_flight, self._pending):
+            item = items.get(name)
+            if item is not None:
+                delta += item[1]
+                first_seen = first_seen or item[2]
+        return delta, first_seen
+
+    def known(self, key, ou):
+        """Returns the last entry known for the key or MISSING, with the pending delta and first_seen"""
+        name = (ou, key.lower())
+        with self._lock:
+            attrs = self._entries.get(name, MISSING)
+            delta, first_seen = self._pending_locked(name)
+        return attrs, delta, first_seen
+
+    def remember(self, key, ou, attrs, replace=True):
+        """
+        Keep attrs as the entry of the key, None for no entry. With replace False
+        an entry already known, maybe written since attrs were read, is kept.
+        """
+        with self._lock:
+            self._remember_locked((ou, key.lower()), attrs, replace)
+
+    def _remember_locked(self, name, attrs, replace=True):
+        if name in self._entries:
+            if not replace:
+                return
+            self._entries.move_to_end(name)
+        self._entries[name] = attrs
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+
+    def discard(self, key, ou):
+        with self._lock:
+            self._pending.pop((ou, key.lower()), None)
+            self._entries.pop((ou, key.lower()), None)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._in_flight = dict(batch)
+            if not batch:
+                return
+
+            failed = 0
+            for name, item in list(batch.items()):
+                key, delta, first_seen = item
+                try:
+                    attrs = self._flush(key, name[0], delta)
+                except Exception:
+                    failed += 1
+                    logger.error('Write-behind flush of key={} delta={} failed\n{}'.format(
+                        key, delta, traceback.format_exc()))
+                    with self._lock:
+                        # Put the delta back, ahead of anything buffered since
+                        del self._in_flight[name]
+                        newer = self._pending.get(name)
+                        if newer is not None:
+                            item[1] += newer[1]
+                        self._pending[name] = item
+                else:
+                    with self._lock:
+                        del self._in_flight[name]
+                        if attrs is None:
+                            self._entries.pop(name, None)
+                        else:
+                            self._remember_locked(name, attrs)
+
+            with self._lock:
+                self._counters['flushes'] += 1
+                self._counters['flushed_keys'] += len(batch) - failed
+                self._counters['failures'] += failed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread and write out whatever is still buffered"""
+        self._stop.set()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                'buffered_keys': len(self._pending),
+                'max_keys': self.max_keys,
+            })
+        return stats
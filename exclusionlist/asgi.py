@@ -0,0 +1,17 @@
+"""
+ASGI config for exclusionlist project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Set EXC_LIST_ASYNC_VIEWS so the API routes to the async views.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "exclusionlist.settings")
+
+application = get_asgi_application()
@@ -40,6 +40,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -66,6 +67,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'exclusionlist.wsgi.application'
 
+ASGI_APPLICATION = 'exclusionlist.asgi.application'
+
 
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
@@ -100,6 +103,8 @@ STATIC_URL = '/static/'
 
 
 # Logging configuration
+LOG_LEVEL = config('LOG_LEVEL', default='DEBUG')
+LOG_ASYNC = config('LOG_ASYNC', default=False, cast=bool)
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -113,41 +118,183 @@ LOGGING = {
         'simple': {
             'format': '%(name)s %(levelname)s %(message)s'
         },
+        'json': {
+            '()': 'api.log_pipeline.JSONFormatter',
+        },
+    },
+    'filters': {
+        'sample': {
+            '()': 'api.log_pipeline.SampleFilter',
+            'burst': config('LOG_SAMPLE_BURST', default='20', cast=int),
+            'every': config('LOG_SAMPLE_EVERY', default='100', cast=int),
+        },
     },
     'handlers': {
         'console': {
-            'level': config('LOG_LEVEL', default='DEBUG'),
+            'level': LOG_LEVEL,
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
         },
     },
+    # Loggers share the handler level so disabled records are never built
     'loggers': {
         'django': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': True,
         },
         'api': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': True,
         },
         'watchman': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': True,
         },
     },
 }
 
+# Off the request path: JSON lines written by a background thread from a bounded queue,
+# the lines of successful requests sampled per key once LOG_SAMPLE_BURST a second have gone out
+if LOG_ASYNC:
+    LOGGING['handlers']['console'] = {
+        'level': LOG_LEVEL,
+        'class': 'api.log_pipeline.QueueingHandler',
+        'max_queue': config('LOG_QUEUE_SIZE', default='10000', cast=int),
+        'formatter': 'json',
+        'filters': ['sample'],
+    }
+
 
 # LDAP
 LDAP_URI = config('LDAP_URI')
 LDAP_USERNAME = config('LDAP_USERNAME')
 LDAP_PW = config('LDAP_PW')
 LDAP_TIME_LIMIT = config('LDAP_TIME_LIMIT', default='10', cast=int)
+# Seconds to wait for a connection to open and for each reply, 0 waits as long as the OS does
+LDAP_CONNECT_TIMEOUT = config('LDAP_CONNECT_TIMEOUT', default='3', cast=float)
+LDAP_RECEIVE_TIMEOUT = config('LDAP_RECEIVE_TIMEOUT', default='5', cast=float)
+# 'auto' uses Modify-Increment (RFC 4525) when the server supports it, 'compare' always uses compare-and-retry
+LDAP_INCREMENT_MODE = config('LDAP_INCREMENT_MODE', default='auto')
+LDAP_INCREMENT_RETRIES = config('LDAP_INCREMENT_RETRIES', default='5', cast=int)
+
+# Store behind the exc_list_* functions, see api/backends.py. The mock and in-memory backends load EXC_LIST_BACKEND_LDIF
+EXC_LIST_BACKEND = config('EXC_LIST_BACKEND', default='api.backends.LDAPBackend')
+EXC_LIST_BACKEND_LDIF = config('EXC_LIST_BACKEND_LDIF', default=os.path.join(BASE_DIR, 'api', 'fixtures', 'exclusionlist.ldif'))
+
+# Write-behind buffering of bad-attempt increments, flushed every interval seconds
+EXC_LIST_WRITE_BEHIND = config('EXC_LIST_WRITE_BEHIND', default=False, cast=bool)
+EXC_LIST_WRITE_BEHIND_INTERVAL = config('EXC_LIST_WRITE_BEHIND_INTERVAL', default='1.0', cast=float)
+EXC_LIST_WRITE_BEHIND_MAX_KEYS = config('EXC_LIST_WRITE_BEHIND_MAX_KEYS', default='10000', cast=int)
+
+# Batch endpoints, keys per request and names per OR-filter search
+EXC_LIST_BATCH_MAX_KEYS = config('EXC_LIST_BATCH_MAX_KEYS', default='1000', cast=int)
+EXC_LIST_BATCH_CHUNK_SIZE = config('EXC_LIST_BATCH_CHUNK_SIZE', default='50', cast=int)
+
+# Entries per paged search request for the export, import and expiry reaper
+EXC_LIST_EXPORT_PAGE_SIZE = config('EXC_LIST_EXPORT_PAGE_SIZE', default='500', cast=int)
+
+# Expiry of ou=IDProof entries by umichExcListTimestamp. Retention is in seconds, rate is
+# deletes per second, and an interval of 0 leaves reaping to the reap_exc_list command, run it
+# from cron. With an interval the serving processes take turns through a lease kept in the
+# EXC_LIST_REAPER_LEASE cache alias, which must be shared between them for only one to reap
+EXC_LIST_REAPER_RETENTION = config('EXC_LIST_REAPER_RETENTION', default='2592000', cast=int)
+EXC_LIST_REAPER_RATE = config('EXC_LIST_REAPER_RATE', default='50', cast=float)
+EXC_LIST_REAPER_WORKERS = config('EXC_LIST_REAPER_WORKERS', default='2', cast=int)
+EXC_LIST_REAPER_INTERVAL = config('EXC_LIST_REAPER_INTERVAL', default='0', cast=int)
+EXC_LIST_REAPER_LEASE = config('EXC_LIST_REAPER_LEASE', default='exclist')
+
+# LDAP connection pool
+LDAP_POOL_SIZE = config('LDAP_POOL_SIZE', default='10', cast=int)
+LDAP_POOL_IDLE_TIMEOUT = config('LDAP_POOL_IDLE_TIMEOUT', default='300', cast=int)
+LDAP_POOL_HEALTH_CHECK_INTERVAL = config('LDAP_POOL_HEALTH_CHECK_INTERVAL', default='30', cast=int)
+LDAP_POOL_ACQUIRE_TIMEOUT = config('LDAP_POOL_ACQUIRE_TIMEOUT', default='5', cast=int)
+
+# Read replicas, comma separated URIs. Searches go to them and writes to LDAP_URI, the master.
+# LDAP_READ_STRATEGY is 'round_robin' or 'least_latency'. A replica failing EJECT_FAILURES reads in a
+# row is left out for EJECT_SECONDS, then readmitted if a probe read succeeds
+LDAP_READ_URIS = config('LDAP_READ_URIS', default='', cast=Csv())
+LDAP_READ_STRATEGY = config('LDAP_READ_STRATEGY', default='round_robin')
+LDAP_REPLICA_EJECT_FAILURES = config('LDAP_REPLICA_EJECT_FAILURES', default='3', cast=int)
+LDAP_REPLICA_EJECT_SECONDS = config('LDAP_REPLICA_EJECT_SECONDS', default='30', cast=int)
+
+# Async connections and requests in flight per connection for batch writes
+LDAP_PIPELINE_CONNECTIONS = config('LDAP_PIPELINE_CONNECTIONS', default='4', cast=int)
+LDAP_PIPELINE_WINDOW = config('LDAP_PIPELINE_WINDOW', default='64', cast=int)
+
+# Async views, serve with exclusionlist.asgi and set EXC_LIST_ASYNC_VIEWS
+EXC_LIST_ASYNC_VIEWS = config('EXC_LIST_ASYNC_VIEWS', default=False, cast=bool)
+LDAP_ASYNC_CONNECTIONS = config('LDAP_ASYNC_CONNECTIONS', default='4', cast=int)
+
+# Plain Django views for the four single-key endpoints, skipping DRF request wrapping,
+# negotiation and serializers. EXC_LIST_ASYNC_VIEWS takes precedence
+EXC_LIST_FAST_VIEWS = config('EXC_LIST_FAST_VIEWS', default=False, cast=bool)
+
+# Django caches. The defaults keep everything in the process, point EXC_LIST_CACHE_BACKEND at
+# django.core.cache.backends.memcached.PyMemcacheCache with EXC_LIST_CACHE_LOCATION=127.0.0.1:11211
+# (or FileBasedCache and a directory, for testing) to share the 'exclist' cache between workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'exclist': {
+        'BACKEND': config('EXC_LIST_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('EXC_LIST_CACHE_LOCATION', default='exclist'),
+        'KEY_PREFIX': 'exclusionlist',
+    },
+}
 
-# Watchman
+# Lookup cache, a TTL of 0 disables caching for that OU. EXC_LIST_SHARED_CACHE names the CACHES
+# alias to keep it in so every worker on a host shares it, empty keeps an LRU of
+# EXC_LIST_CACHE_SIZE entries in each process. A write only invalidates the process LRU of the
+# worker that made it, so the brute-force counters in ou=IDProof are only cached by default
+# when the cache is shared
+EXC_LIST_SHARED_CACHE = config('EXC_LIST_SHARED_CACHE', default='')
+EXC_LIST_CACHE_SIZE = config('EXC_LIST_CACHE_SIZE', default='10000', cast=int)
+EXC_LIST_CACHE_TTLS = {
+    'Admin': config('EXC_LIST_CACHE_TTL_ADMIN', default='300', cast=int),
+    'IDProof': config('EXC_LIST_CACHE_TTL_IDPROOF', default='5' if EXC_LIST_SHARED_CACHE else '0', cast=int),
+}
+
+# Per-key admission to the backend for find_key, add_key and umid lookups, a rate of 0 disables it.
+# A key asked for more than RATE times a second, with bursts of BURST, is answered from the last
+# result for it and its increments are buffered like write-behind, or it gets a 429
+EXC_LIST_HOT_KEY_RATE = config('EXC_LIST_HOT_KEY_RATE', default='0', cast=float)
+EXC_LIST_HOT_KEY_BURST = config('EXC_LIST_HOT_KEY_BURST', default='20', cast=int)
+EXC_LIST_HOT_KEY_MAX_KEYS = config('EXC_LIST_HOT_KEY_MAX_KEYS', default='10000', cast=int)
+
+# Concurrent cache misses for the same name in a process share one directory search
+EXC_LIST_SINGLE_FLIGHT = config('EXC_LIST_SINGLE_FLIGHT', default=True, cast=bool)
+
+# Fail fast while the directory is in trouble, see api/circuit_breaker.py. The breaker opens after
+# FAILURES consecutive failed directory calls (0 never opens it) and answers 503 for RESET_TIMEOUT
+# seconds before letting a probe through. At most LDAP_MAX_IN_FLIGHT directory calls run at once in
+# a process (0 for no cap), a call waits LDAP_IN_FLIGHT_WAIT seconds for a slot before a 503. Except
+# under the async views the cap is held to LDAP_POOL_SIZE, so calls queue for a slot and not the pool
+EXC_LIST_BREAKER_FAILURES = config('EXC_LIST_BREAKER_FAILURES', default='5', cast=int)
+EXC_LIST_BREAKER_RESET_TIMEOUT = config('EXC_LIST_BREAKER_RESET_TIMEOUT', default='10', cast=int)
+LDAP_MAX_IN_FLIGHT = config('LDAP_MAX_IN_FLIGHT', default='64', cast=int)
+LDAP_IN_FLIGHT_WAIT = config('LDAP_IN_FLIGHT_WAIT', default='0.1', cast=float)
+
+# Local replica of ou=Admin used by umidexclist/find/
+EXC_LIST_SNAPSHOT_ENABLED = config('EXC_LIST_SNAPSHOT_ENABLED', default=True, cast=bool)
+EXC_LIST_SNAPSHOT_REFRESH_INTERVAL = config('EXC_LIST_SNAPSHOT_REFRESH_INTERVAL', default='60', cast=int)
+EXC_LIST_SNAPSHOT_FULL_RELOAD_INTERVAL = config('EXC_LIST_SNAPSHOT_FULL_RELOAD_INTERVAL', default='900', cast=int)
+EXC_LIST_SNAPSHOT_MAX_STALENESS = config('EXC_LIST_SNAPSHOT_MAX_STALENESS', default='300', cast=int)
+EXC_LIST_SNAPSHOT_PAGE_SIZE = config('EXC_LIST_SNAPSHOT_PAGE_SIZE', default='500', cast=int)
+
+# Watchman, the ldap check result is reused for this many seconds
+LDAP_HEALTH_CHECK_TTL = config('LDAP_HEALTH_CHECK_TTL', default='5', cast=float)
 WATCHMAN_CHECKS = (
     'api.my_watchman_checks.ldap',
 )
+
+# Warm-up of each serving process, see api/warmup.py. ready answers 503 until it has bound
+# CONNECTIONS connections in each LDAP pool and, with SNAPSHOT, loaded the Admin snapshot.
+# A process that cannot finish within TIMEOUT seconds reports ready anyway
+EXC_LIST_WARMUP = config('EXC_LIST_WARMUP', default=False, cast=bool)
+EXC_LIST_WARMUP_CONNECTIONS = config('EXC_LIST_WARMUP_CONNECTIONS', default='2', cast=int)
+EXC_LIST_WARMUP_SNAPSHOT = config('EXC_LIST_WARMUP_SNAPSHOT', default=True, cast=bool)
+EXC_LIST_WARMUP_TIMEOUT = config('EXC_LIST_WARMUP_TIMEOUT', default='60', cast=float)
@@ -15,8 +15,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path
+from api import views
 
 urlpatterns = [
     path('api/secure/', include('api.urls')),
     path('health/', include('watchman.urls')),
+    path('metrics/', views.metrics, name='metrics'),
+    path('ready/', views.ready, name='ready'),
 ]